@@ -4,9 +4,10 @@ import queue
 import threading
 import concurrent.futures
 
+from services.audio_assets import AudioAssets
 from services.camera_services import (FaceDB, PresenceDetector, RecordFace,
                                      Wakeface)
-from services.cloud import server
+from services.cloud import async_server, server
 from services.eyes.service import Eyes
 from services.leds import ArrayLed, LedState
 from services.mic import Recorder
@@ -33,15 +34,25 @@ notifications = queue.Queue() # Transition state queue
 listen_timer = None # Listening timeout handler
 DELAY_TIMEOUT = 5 # in sec
 
+BARGE_IN = True # Keep listening while the robot speaks, user speech cuts the playback
+SPECULATIVE_LLM = False # Start the response on stable interim transcripts, reused if the final transcript matches
+
 global_executor = concurrent.futures.ThreadPoolExecutor(max_workers=10) # Global executor for async tasks (server queries)
 SERVER_QUERY_TIMEOUT = 15 # in sec
+ASYNC_PIPELINE = True # asyncio cloud pipeline: timed out or abandoned queries cancel their requests in flight
+# Warm-up of the connections that the queries actually use
+connection_warmer = async_server.connection_warmer if ASYNC_PIPELINE else server.connection_warmer
+if ASYNC_PIPELINE:
+    async_server.use_async_probes() # Circuit probes through the clients the pipeline sends its requests with
 
 # Streaming STT state
 streaming_future = None  # Future for streaming STT task
 
-# Preload of error audios
-with open('files/connection_error.wav', 'rb') as f:
-    connection_error_audio = f.read()
+# Preload of system sounds, decoded into the speaker format
+assets = AudioAssets(rate=24000) # Speaker rate
+assets.load('connection_error', 'files/connection_error.wav')
+assets.load('powerdown', 'files/powerdown_sound.wav')
+connection_error_audio = assets['connection_error']
 
 
 def wf_event_handler(event, usernames=None):
@@ -102,11 +113,13 @@ def mic_event_handler(event, audio=None):
             'audio': audio
         }
     }
-    if event == 'start_recording' and robot_context['state'] in ['listening', 'listening_without_cam']:
+    if event == 'start_recording' and robot_context['state'] in ['listening', 'listening_without_cam', 'speaking']:
         if robot_context['state'] == 'listening':
             notification['transition']  = 'listening2recording'
         elif robot_context['state'] == 'listening_without_cam':
             notification['transition']  = 'listening_without_cam2recording'
+        elif robot_context['state'] == 'speaking': # User barge-in
+            notification['transition']  = 'speaking2recording'
         notifications.put(notification)
 
     if event == 'stop_recording' and robot_context['state'] == 'recording':
@@ -145,6 +158,15 @@ def proactive_service_event_handler(event, params={}):
         notification ['params']['question'] = 'who_are_you'
         notifications.put(notification)
 
+    elif event == 'pregenerate': # Prepare the how_are_you response before it is due
+        global_executor.submit(
+            server.pregenerate_proactive_query,
+            server.Request(
+                username=params.get('username', None),
+                proactive_question='how_are_you'
+            )
+        )
+
 
 def listen_timeout_handler():
     global robot_context
@@ -153,6 +175,28 @@ def listen_timeout_handler():
         notifications.put({'transition': 'listening_without_cam2idle_presence'})
 
 
+def speculative_request():
+    # Context for the speculative response of the current user turn (None if disabled)
+    if SPECULATIVE_LLM:
+        return server.Request(username=robot_context['username'], proactive_question=robot_context['proactive_question'])
+    return None
+
+
+def submit_cloud(task, *args):
+    # Run a server pipeline task (server.streaming_stt, server.query_with_text...) in background.
+    # With the asyncio pipeline, cancelling the returned future also cancels its requests in flight
+    if ASYNC_PIPELINE:
+        return async_server.submit(getattr(async_server, task.__name__)(*args))
+    return global_executor.submit(task, *args)
+
+
+def start_barge_in():
+    # Listen while the robot speaks, gating the robot's own voice by the playback level
+    if BARGE_IN:
+        mic.set_playback_gate(speaker.playback_level)
+        mic.start()
+
+
 def process_transition(transition, params={}):
     global robot_context, listen_timer
 
@@ -163,6 +207,8 @@ def process_transition(transition, params={}):
         robot_context['state'] = 'idle_presence'
         leds.set(LedState.static_color((186,85,211))) # set static purple color 
         wf.start()
+        connection_warmer.start() # Warm cloud connections before the first query
+        proactive.set_presence(True)
     
     # User left the room
     elif transition == 'idle_presence2idle' and robot_context['state'] == 'idle_presence':
@@ -170,6 +216,8 @@ def process_transition(transition, params={}):
         robot_context['username'] = None
         leds.set(LedState.static_color((0,0,0))) # set static black color
         wf.stop()
+        connection_warmer.stop()
+        proactive.set_presence(False)
 
     # User looking at the robot
     elif transition == 'idle_presence2listening' and robot_context['state'] == 'idle_presence':
@@ -204,9 +252,12 @@ def process_transition(transition, params={}):
         
         # Start streaming STT in background
         global streaming_future
-        streaming_future = global_executor.submit(
+        streaming_future = submit_cloud(
             server.streaming_stt,  # Only STT streaming
-            audio_generator
+            audio_generator,
+            mic.on_stt_result, # STT results also drive the end of turn detection
+            speculative_request(),
+            mic.speech_duration # Short utterances are raced with a batch recognition
         )
     
     # User in conversation starts talking
@@ -220,9 +271,12 @@ def process_transition(transition, params={}):
         audio_generator = mic.get_audio_generator()
         
         # Start streaming STT in background
-        streaming_future = global_executor.submit(
+        streaming_future = submit_cloud(
             server.streaming_stt,  # Only STT streaming
-            audio_generator
+            audio_generator,
+            mic.on_stt_result, # STT results also drive the end of turn detection
+            speculative_request(),
+            mic.speech_duration # Short utterances are raced with a batch recognition
         )
 
     # User finished talking: generate robot response
@@ -236,6 +290,7 @@ def process_transition(transition, params={}):
             transcript = streaming_future.result(timeout=SERVER_QUERY_TIMEOUT) # Wait for the streaming STT result
         except concurrent.futures.TimeoutError: # Timeout error: play error msg
             logger.error('Timeout error in streaming STT processing')
+            streaming_future.cancel() # Stop the request (asyncio pipeline)
             mic.disable_streaming() # Clean up streaming resources
 
             robot_context['continue_conversation'] = False
@@ -260,7 +315,7 @@ def process_transition(transition, params={}):
             
             if transcript:           
                 # Process the query with text already transcribed (LLM + TTS)
-                future = global_executor.submit(
+                future = submit_cloud(
                     server.query_with_text,
                     server.Request(
                         text=transcript,
@@ -273,6 +328,7 @@ def process_transition(transition, params={}):
                     response = future.result(timeout=SERVER_QUERY_TIMEOUT) # Wait for the response with timeout
                 except concurrent.futures.TimeoutError: # Timeout error: play error msg
                     logger.error('Timeout error in query_with_text processing')
+                    future.cancel() # Stop the requests still in flight (asyncio pipeline)
 
                     robot_context['continue_conversation'] = False
                     robot_context['proactive_question'] = ''
@@ -321,6 +377,7 @@ def process_transition(transition, params={}):
                         eyes.set(response.robot_mood)
                         leds.set(LedState.breath((52,158,235))) # light blue breath
                         speaker.start(response.audio)
+                        start_barge_in()
 
                         if not robot_context['username']: # Unknown user
                             robot_context['unknown_user_interactions'] += 1
@@ -380,10 +437,29 @@ def process_transition(transition, params={}):
                 pd.start()
                 wf.start()
 
+    # User talks while the robot speaks: cut the playback and record
+    elif transition == 'speaking2recording' and robot_context['state'] == 'speaking':
+        robot_context['state'] = 'recording'
+        speaker.stop() # finish_speak transitions are discarded (no longer speaking)
+        leds.set(LedState.loop((255,255,255))) # set white loop color
+
+        # Enable streaming STT (recorded audio since the speech onset included)
+        mic.enable_streaming()
+        audio_generator = mic.get_audio_generator()
+
+        streaming_future = submit_cloud(
+            server.streaming_stt,  # Only STT streaming
+            audio_generator,
+            mic.on_stt_result, # STT results also drive the end of turn detection
+            speculative_request(),
+            mic.speech_duration # Short utterances are raced with a batch recognition
+        )
+
     # Continue conversation after robot speaks: waiting for user audio
     elif transition == 'speaking2listening_without_cam' and robot_context['state'] == 'speaking':
         robot_context['state'] = 'listening_without_cam'
         leds.set(LedState.loop((52,158,235))) # light blue color
+        mic.stop() # Stop barge-in listening (if any), start a new session without playback gate
         mic.start()
 
         # Add a timeout to execute a transition funcion due to inactivity
@@ -406,6 +482,7 @@ def process_transition(transition, params={}):
         robot_context['unknown_user_interactions'] = 0
         eyes.set('neutral')
         leds.set(LedState.static_color((0,0,0))) # put black static color
+        mic.stop() # Stop barge-in listening (if any)
         rf.stop()
         pd.start()
         wf.start()
@@ -438,7 +515,11 @@ def process_transition(transition, params={}):
 
         logger.info(f"Proactive question: {params['question']}")
 
-        if params['question'] == 'how_are_you':
+        if not server.cloud_available(): # Offline: do not start a conversation that can only fail, ask it later
+            logger.warning(f"Proactive question deferred, cloud services unavailable :: {server.get_circuit_states()}")
+            proactive.update('deferred', params['question'], params)
+
+        elif params['question'] == 'how_are_you':
             if robot_context['state'] in ['idle_presence', 'listening']:
                 robot_context['state'] = 'processing_query'
                 leds.set(LedState.static_color((0,0,0))) # put black static color
@@ -455,7 +536,7 @@ def process_transition(transition, params={}):
                 except Exception as e:
                     logger.warning(f'Could not load conversation history. {str(e)}') 
 
-                future = global_executor.submit(
+                future = submit_cloud(
                     server.proactive_query, # Make the query to the cloud
                     server.Request(
                         username=robot_context['username'], 
@@ -468,6 +549,7 @@ def process_transition(transition, params={}):
 
                 except concurrent.futures.TimeoutError: # Timeout error: play error msg
                     logger.error('Timeout error in proactive query processing')
+                    future.cancel() # Stop the requests still in flight (asyncio pipeline)
 
                     robot_context['continue_conversation'] = False
                     robot_context['proactive_question'] = ''
@@ -490,6 +572,7 @@ def process_transition(transition, params={}):
                     eyes.set(response.robot_mood)
                     leds.set(LedState.breath((52,158,235))) # light blue led breath animation
                     speaker.start(response.audio)
+                    start_barge_in()
 
                     proactive.update('confirm', 'how_are_you', {'type': params['type'], 'username': robot_context['username']})
             
@@ -502,7 +585,7 @@ def process_transition(transition, params={}):
                 mic.stop()
                 wf.stop()
 
-                future = global_executor.submit(
+                future = submit_cloud(
                     server.proactive_query, # Make the query to the cloud
                     server.Request(
                         username=robot_context['username'], 
@@ -515,6 +598,7 @@ def process_transition(transition, params={}):
 
                 except concurrent.futures.TimeoutError: # Timeout error: play error ms
                     logger.error('Timeout error in proactive query processing')
+                    future.cancel() # Stop the requests still in flight (asyncio pipeline)
 
                     robot_context['continue_conversation'] = False
                     robot_context['proactive_question'] = ''
@@ -538,6 +622,7 @@ def process_transition(transition, params={}):
                     eyes.set(response.robot_mood)
                     leds.set(LedState.breath((52,158,235))) # light blue led breath animation
                     speaker.start(response.audio)
+                    start_barge_in()
                     try:
                         server.load_conversation_db(robot_context['username']) # Load conversation history for that user
                     except Exception as e:
@@ -578,12 +663,16 @@ if __name__ == '__main__':
     proactive = ProactiveService(proactive_service_event_handler)
 
     speaker = Speaker(speaker_event_handler)
-    mic = Recorder(mic_event_handler)
+    mic = Recorder(mic_event_handler, vad_mode='streaming', pregate=True, vad_worker=True,
+                   vad_backend='onnx', vad_intra_op_threads=1, vad_inter_op_threads=1)
     touch = TouchScreen(touchscreen_event_handler)
 
     touch.start()
     pd.start()
 
+    global_executor.submit(server.warm_up_tts) # Pre-synthesize frequent phrases in background
+    global_executor.submit(server.warm_up_speech_backends)
+
     logger.info('Ready')
     try:
         while True:
@@ -600,12 +689,10 @@ if __name__ == '__main__':
     finally:
         logger.info("Interruption detected. Stopping and shutting down the robot...")
     
-        with open('files/powerdown_sound.wav', 'rb') as f:
-            powerdown_audio = f.read()
-        
-        speaker.start(powerdown_audio) # play goodbye audio
+        speaker.start(assets['powerdown']) # play goodbye audio
 
         touch.stop()
+        proactive.stop()
 
         server.dump_conversation_db(robot_context['username']) # dump in-RAM conversation history before exit
 
@@ -617,6 +704,16 @@ if __name__ == '__main__':
             logger.info('Streaming future cancelled')
 
         global_executor.shutdown(wait=False) # shutdown global executor
+        connection_warmer.stop() # Before the event loop that runs its probes
+        async_server.bridge.stop()
+        logger.info(f'TTS cache stats :: {server.get_tts_cache_stats()}')
+        logger.info(f'Connection stats :: {server.get_connection_stats()}')
+        logger.info(f'Hedging stats :: {server.get_hedging_stats()}')
+        logger.info(f'STT race stats :: {server.get_stt_race_stats()}')
+        logger.info(f'Speech backend stats :: {server.get_speech_backend_stats()}')
+        logger.info(f'Circuit breakers :: {server.get_circuit_states()}')
+        if SPECULATIVE_LLM:
+            logger.info(f'Speculative response stats :: {server.speculation.get_stats()}')
 
         wf.stop()
         rf.stop()
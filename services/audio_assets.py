@@ -0,0 +1,76 @@
+import logging
+import wave
+from math import gcd
+
+import numpy as np
+from scipy.signal import resample_poly
+
+
+class AudioAssets:
+    '''
+    Registry of system sounds (error, shutdown...). WAV files are parsed, validated, converted
+    and resampled once at boot into raw PCM in the speaker's native format (16-bit, speaker
+    rate and channels), so they can be played with no decode cost.
+    '''
+    def __init__(self, rate=24000, channels=1, sample_width=2):
+        self.logger = logging.getLogger('Speaker')
+        self.logger.setLevel(logging.DEBUG)
+
+        if sample_width != 2:
+            raise ValueError('Only 16-bit speaker format is supported')
+
+        self.rate = rate
+        self.channels = channels
+        self.sample_width = sample_width
+
+        self.sounds = {} # name -> PCM bytes
+
+    def load(self, name, path):
+        try:
+            with wave.open(path, 'rb') as wav:
+                file_channels = wav.getnchannels()
+                file_width = wav.getsampwidth()
+                file_rate = wav.getframerate()
+                frames = wav.readframes(wav.getnframes())
+        except (wave.Error, EOFError) as e:
+            raise ValueError(f'{path} is not a valid PCM WAV file: {str(e)}') from e
+
+        samples = self._to_float(frames, file_width).reshape(-1, file_channels)
+        if not samples.size:
+            raise ValueError(f'{path} has no audio')
+
+        # Channels: downmix to mono, then replicate if the speaker has more channels
+        samples = samples.mean(axis=1, keepdims=True)
+        if file_rate != self.rate:
+            factor = gcd(self.rate, file_rate)
+            samples = resample_poly(samples, self.rate // factor, file_rate // factor, axis=0)
+        samples = np.repeat(samples, self.channels, axis=1)
+
+        pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+        self.sounds[name] = pcm
+
+        self.logger.info(f'Audio asset {name} loaded from {path} ({file_rate} Hz, {file_channels} ch, '
+                         f'{file_width * 8} bit -> {len(pcm) / (self.rate * self.channels * self.sample_width):.2f} s)')
+        return pcm
+
+    @staticmethod
+    def _to_float(frames, sample_width):
+        # Raw PCM samples to float32 in [-1, 1)
+        if sample_width == 1: # 8-bit WAV is unsigned
+            return (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+        if sample_width == 2:
+            return np.frombuffer(frames, dtype='<i2').astype(np.float32) / 2**15
+        if sample_width == 3: # 24-bit little endian, sign extended through the top byte
+            raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+            samples = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+            samples = np.where(samples & 0x800000, samples - 0x1000000, samples)
+            return samples.astype(np.float32) / 2**23
+        if sample_width == 4:
+            return np.frombuffer(frames, dtype='<i4').astype(np.float32) / 2**31
+        raise ValueError(f'Unsupported sample width {sample_width}')
+
+    def __getitem__(self, name):
+        return self.sounds[name]
+
+    def __contains__(self, name):
+        return name in self.sounds
@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import time
+from threading import Thread
+
+from .google_api import google_breaker, probe_stt_connection_async, probe_tts_connection_async
+from .speech_backends import speech_router
+from .openai_api import generate_response_async, generate_response_stream_async, openai_breaker, probe_llm_connection_async
+from .server import LLM_STREAMING, Request, SpeechSegments, build_response, speculation, take_pregenerated_response
+from .warmup import ConnectionWarmer
+
+logger = logging.getLogger('Server')
+
+# Deadline of each stage (in sec). Streaming STT has none: it lasts as long as the user
+# talks, and it is cancelled by the caller
+STAGE_DEADLINES = {
+    'stt': 8, # Non-streaming recognition
+    'llm': 10, # Until the first sentence of the response
+    'tts': 5 # Each sentence
+}
+
+
+class StageTimeoutError(TimeoutError):
+    def __init__(self, stage):
+        super().__init__(f'{stage} stage deadline exceeded ({STAGE_DEADLINES[stage]} seconds)')
+        self.stage = stage
+
+
+class AsyncBridge:
+    '''
+    Runs the asyncio event loop of the cloud pipeline in a background thread, for the
+    synchronous state machine. submit(coroutine) returns a concurrent.futures.Future:
+    cancelling it (e.g. after a timeout waiting for its result) cancels the task, and
+    with it the requests in flight.
+    '''
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+bridge = AsyncBridge()
+
+def submit(coroutine):
+    return bridge.submit(coroutine)
+
+
+def in_event_loop(probe, timeout=5):
+    # Warm-up probe run in the event loop, where the async clients (and their connections) live
+    def run():
+        future = bridge.submit(probe())
+        try:
+            future.result(timeout)
+        finally:
+            future.cancel() # Only if it timed out
+    return run
+
+def use_async_probes():
+    # Half-open circuit probes through the async clients: a sync probe could succeed while the
+    # requests of the asyncio pipeline fail (and the other way round)
+    google_breaker.probe = in_event_loop(probe_tts_connection_async)
+    openai_breaker.probe = in_event_loop(probe_llm_connection_async)
+
+# Connections of the asyncio pipeline kept warm while someone is in the room (see server.connection_warmer)
+connection_warmer = ConnectionWarmer({
+    'stt': in_event_loop(probe_stt_connection_async),
+    'tts': in_event_loop(probe_tts_connection_async),
+    'llm': in_event_loop(probe_llm_connection_async)
+})
+
+
+async def run_stage(stage, coroutine):
+    # Run a stage of the pipeline within its deadline (the stage is cancelled when it expires)
+    try:
+        return await asyncio.wait_for(coroutine, STAGE_DEADLINES[stage])
+    except asyncio.TimeoutError:
+        raise StageTimeoutError(stage) from None
+
+_END = object()
+
+async def iterate_in_thread(iterator):
+    # Async iteration of a blocking iterator (e.g. the mic audio generator)
+    loop = asyncio.get_running_loop()
+    iterator = iter(iterator)
+    while True:
+        item = await loop.run_in_executor(None, next, iterator, _END)
+        if item is _END:
+            return
+        yield item
+
+
+class AsyncSpeechSegments(SpeechSegments):
+    '''
+    SpeechSegments synthesized on the event loop. cancel() (e.g. playback cut by the user)
+    also cancels the LLM stream that is still producing sentences.
+    '''
+    def __init__(self, text=None):
+        super().__init__(text, submit=lambda sentence: bridge.submit(run_stage('tts', speech_router.text_to_speech_async(sentence))))
+        self.producer = None # Task adding the sentences
+
+    def cancel(self):
+        super().cancel()
+        if self.producer is not None:
+            bridge.loop.call_soon_threadsafe(self.producer.cancel)
+
+    async def wait_head(self):
+        if self.futures:
+            await asyncio.wrap_future(self.futures[0])
+
+
+async def streaming_text_to_speech(input_text, context_variables):
+    # Stream the LLM response, sending each sentence to TTS as soon as it is complete.
+    # Returns once the first segment is ready; the rest of the response keeps being generated
+    start_time = time.time()
+    audio = AsyncSpeechSegments()
+    robot_context = {}
+    first_sentence = asyncio.get_running_loop().create_future()
+
+    async def produce():
+        error = None
+        try:
+            async for event, data in generate_response_stream_async(input_text, context_variables):
+                if event == 'context':
+                    robot_context.update(data)
+                elif event == 'sentence':
+                    audio.add(data)
+                    if not first_sentence.done():
+                        logger.info(f'LLM first sentence generated in {time.time() - start_time:.2f} seconds')
+                        first_sentence.set_result(None)
+                elif event == 'end':
+                    text_response, context = data
+                    robot_context.update(context)
+                    logger.info(f'LLM response generated in {time.time() - start_time:.2f} seconds')
+                    logger.info(f'Response text :: {text_response}')
+                    logger.info(f'Response context :: {context}')
+        except Exception as e:
+            logger.error(f'Could not generate streaming response. {str(e)}')
+            error = e
+        finally:
+            audio.finish(error)
+            if not first_sentence.done():
+                if error is not None:
+                    first_sentence.set_exception(error)
+                else:
+                    first_sentence.set_result(None)
+
+    audio.producer = asyncio.create_task(produce())
+    try:
+        await run_stage('llm', asyncio.shield(first_sentence))
+        await audio.wait_head()
+    except BaseException: # Deadline, error or cancelled by the caller
+        audio.cancel()
+        raise
+
+    logger.info(f"TTS first segment obtained in {time.time() - start_time:.2f} seconds (streaming LLM, asyncio)")
+    return audio.text, dict(robot_context), audio
+
+async def generate_speech_response(input_text, context_variables):
+    # asyncio variant of server.generate_speech_response
+    if LLM_STREAMING:
+        return await streaming_text_to_speech(input_text, context_variables)
+
+    start_time = time.time()
+    text_response, robot_context = await run_stage('llm', generate_response_async(input_text, context_variables))
+    logger.info(f'LLM response generated in {time.time() - start_time:.2f} seconds')
+    logger.info(f'Response text :: {text_response}')
+    logger.info(f'Response context :: {robot_context}')
+
+    start_time = time.time()
+    audio = AsyncSpeechSegments(text_response)
+    try:
+        await audio.wait_head()
+    except BaseException:
+        audio.cancel()
+        raise
+    logger.info(f"TTS first segment obtained in {time.time() - start_time:.2f} seconds ({len(audio.sentences)} segments)")
+    return text_response, robot_context, audio
+
+
+# Pipeline: same functions as server.py (submit(query_with_text(request)) instead of query_with_text(request))
+
+async def query(request: Request):
+    # STT + LLM + TTS
+    start_time = time.time()
+    request.text = await run_stage('stt', speech_router.speech_to_text_async(request.audio))
+    logger.info(f"STT result ({time.time() - start_time:.2f} seconds) :: '{request.text}'")
+
+    if not request.text:
+        return None
+
+    return await query_with_text(request)
+
+async def query_with_text(request: Request):
+    # LLM + TTS with text already transcribed
+    if not request.text:
+        return None
+
+    logger.info(f"Processing query with streaming STT text: '{request.text}'")
+
+    # Set context variables
+    context_variables = {}
+    context_variables["username"] = request.username
+    context_variables["proactive_question"] = request.proactive_question
+    logger.info(f'Query context :: {context_variables}')
+
+    # Generate the response (LLM + TTS), reusing the speculative one if it was started on the same transcript
+    speculative_response = await asyncio.to_thread(speculation.take, request)
+    if speculative_response is not None:
+        text_response, robot_context, audio_response = speculative_response
+    else:
+        text_response, robot_context, audio_response = await generate_speech_response(request.text, context_variables)
+
+    # Check if LLM response text robot is empty
+    if not text_response:
+        return None
+
+    return build_response(request, text_response, robot_context, audio_response)
+
+async def streaming_stt(audio_generator, on_result=None, speculate=None, speech_duration=None):
+    # Only streaming STT (see server.streaming_stt). Cancelling it closes the streaming call
+    if speculate is not None:
+        speculation.begin(speculate)
+        on_result = speculation.result_handler(on_result)
+
+    transcript, silence_detection_time = await speech_router.streaming_speech_to_text_async(iterate_in_thread(audio_generator), on_result, speech_duration)
+
+    if silence_detection_time is not None:
+        logger.info(f"Streaming STT result (silence detection: {silence_detection_time:.3f} seconds) :: '{transcript}'")
+    else:
+        logger.info(f"Streaming STT result (no final result) :: '{transcript}'")
+
+    return transcript
+
+async def proactive_query(request: Request):
+    # Use the response prepared in advance if it is still valid
+    response = take_pregenerated_response(request)
+    if response is not None:
+        logger.info(f'Using pre-generated proactive response :: {response.text}')
+        return response
+
+    # Set context variables
+    context_variables = {}
+    context_variables["username"] = request.username
+    context_variables["proactive_question"] = request.proactive_question
+    logger.info(f'Query context :: {context_variables}')
+
+    # Generate the response (LLM + TTS)
+    text_response, robot_context, audio_response = await generate_speech_response('', context_variables) # Empty input_text since it's a proactive question
+
+    return build_response(request, text_response, robot_context, audio_response)
@@ -0,0 +1,100 @@
+'''
+Opus/OGG transport of the cloud audio (PyAV, loaded on first use): the mic audio of
+streaming STT is encoded as it is captured, and OGG_OPUS TTS audio is decoded into the
+speaker PCM format. Opus at speech bitrates is ~10-20x smaller than LINEAR16.
+'''
+import io
+import logging
+
+import numpy as np
+
+logger = logging.getLogger('Server')
+
+OPUS_RATES = (8000, 12000, 16000, 24000, 48000) # Sample rates accepted by Google for OGG_OPUS
+
+
+class ByteSink:
+    ''' Write-only file object collecting what the muxer writes '''
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+class OpusStreamEncoder:
+    '''
+    Incremental OGG/Opus encoder of 16-bit mono PCM: encode(pcm) returns the OGG bytes
+    available so far (possibly empty) and close() the rest of the stream. Concatenating
+    all the outputs gives a complete OGG file, starting with the Opus headers.
+    '''
+    def __init__(self, rate=16000, bitrate=24000, page_duration=0.1, application='voip'):
+        import av
+
+        if rate not in OPUS_RATES:
+            raise ValueError(f'Opus does not support {rate} Hz')
+
+        self.rate = rate
+        self.sink = ByteSink()
+        # Small OGG pages, flushed right away, so that audio leaves as soon as it is encoded
+        self.container = av.open(self.sink, mode='w', format='ogg',
+                                 container_options={'page_duration': str(int(page_duration * 1e6)), 'flush_packets': '1'})
+        self.stream = self.container.add_stream('libopus', rate=rate, layout='mono', options={'application': application})
+        self.stream.bit_rate = bitrate
+        self.samples = 0 # Samples encoded so far (frame pts)
+        self.bytes_in = 0
+        self.closed = False
+
+    def encode(self, pcm):
+        import av
+
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        if samples.size:
+            frame = av.AudioFrame.from_ndarray(samples.reshape(1, -1), format='s16', layout='mono')
+            frame.sample_rate = self.rate
+            frame.pts = self.samples
+            self.samples += samples.size
+            self.bytes_in += len(pcm)
+            for packet in self.stream.encode(frame):
+                self.container.mux(packet)
+        return self.sink.take()
+
+    def close(self):
+        if self.closed:
+            return b''
+        self.closed = True
+        for packet in self.stream.encode(None): # Flush the encoder
+            self.container.mux(packet)
+        self.container.close()
+        return self.sink.take()
+
+    @property
+    def bytes_out(self):
+        return self.sink.size
+
+
+def encode_ogg_opus(pcm, rate=16000, bitrate=24000):
+    # Whole PCM buffer as an OGG/Opus file
+    encoder = OpusStreamEncoder(rate, bitrate)
+    return encoder.encode(pcm) + encoder.close()
+
+
+def decode_ogg_opus(data, rate=24000):
+    # OGG/Opus file into 16-bit mono PCM at the given rate (speaker format)
+    import av
+
+    resampler = av.AudioResampler(format='s16', layout='mono', rate=rate)
+    pcm = []
+    with av.open(io.BytesIO(data), mode='r', format='ogg') as container:
+        for frame in container.decode(audio=0):
+            pcm.extend(resampled.to_ndarray().tobytes() for resampled in resampler.resample(frame))
+    pcm.extend(resampled.to_ndarray().tobytes() for resampled in resampler.resample(None))
+    return b''.join(pcm)
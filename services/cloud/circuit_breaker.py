@@ -0,0 +1,122 @@
+import logging
+import time
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+
+logger = logging.getLogger('Server')
+
+
+class CircuitOpenError(Exception):
+    # Request not sent: the service is considered unavailable
+    def __init__(self, name):
+        super().__init__(f'{name} circuit open, service unavailable')
+        self.name = name
+
+
+class CircuitBreaker:
+    '''
+    Circuit breaker of a cloud service. After failure_threshold consecutive connection
+    failures (or timeouts) the circuit opens: requests fail immediately with CircuitOpenError
+    instead of waiting for their timeout. While open, probe() is run in background every
+    probe_interval seconds (half-open); when it succeeds the circuit closes again.
+    Only errors of failure_types count as failures: any other answer means the service is reachable.
+    '''
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_types, probe, failure_threshold=3, probe_interval=10):
+        self.name = name
+        self.failure_types = failure_types
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+
+        self.state = self.CLOSED
+        self.failures = 0 # Consecutive failures
+        self.opened_time = None
+        self.lock = Lock()
+        self.stop_event = Event()
+        self._thread = None
+
+        self.stats = {'failures': 0, 'rejected': 0, 'trips': 0, 'probes': 0}
+
+    @property
+    def available(self):
+        return self.state == self.CLOSED
+
+    def before_call(self):
+        if self.state != self.CLOSED:
+            with self.lock:
+                self.stats['rejected'] += 1
+            raise CircuitOpenError(self.name)
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+
+    def record_failure(self, error):
+        if not isinstance(error, self.failure_types):
+            self.record_success() # The service answered
+            return
+
+        with self.lock:
+            self.failures += 1
+            self.stats['failures'] += 1
+            trip = self.state == self.CLOSED and self.failures >= self.failure_threshold
+            if trip:
+                self.state = self.OPEN
+                self.opened_time = time.time()
+                self.stats['trips'] += 1
+
+        if trip:
+            logger.warning(f'{self.name} circuit open after {self.failures} consecutive failures ({type(error).__name__})')
+            self._thread = Thread(target=self._probe_loop, daemon=True)
+            self._thread.start()
+
+    @contextmanager
+    def track(self):
+        # Guard a request: fail fast if the circuit is open, record its outcome otherwise
+        self.before_call()
+        try:
+            yield
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        else:
+            self.record_success()
+
+    def call(self, fn, *args, **kwargs):
+        with self.track():
+            return fn(*args, **kwargs)
+
+    async def call_async(self, fn, *args, **kwargs):
+        with self.track():
+            return await fn(*args, **kwargs)
+
+    def _probe_loop(self):
+        # Half-open probing until the service answers again
+        while not self.stop_event.wait(self.probe_interval):
+            with self.lock:
+                self.state = self.HALF_OPEN
+                self.stats['probes'] += 1
+
+            try:
+                self.probe()
+            except Exception as e:
+                with self.lock:
+                    self.state = self.OPEN
+                logger.debug(f'{self.name} circuit probe failed. {str(e)}')
+            else:
+                with self.lock:
+                    self.state = self.CLOSED
+                    self.failures = 0
+                logger.info(f'{self.name} circuit closed, service restored after {time.time() - self.opened_time:.0f} seconds')
+                return
+
+    def stop(self):
+        self.stop_event.set()
+
+    def get_stats(self):
+        with self.lock:
+            return {'state': self.state, **self.stats}
@@ -1,23 +1,69 @@
 # Google services wrapper
 # (TTS, STT)
+from google.api_core import exceptions as google_exceptions
 from google.cloud import speech, texttospeech
 
+import asyncio
+import grpc
+import io
+import logging
+import os
 import time
+import wave
+from threading import Event, Lock
+
+from .audio_codec import OpusStreamEncoder, decode_ogg_opus
+from .circuit_breaker import CircuitBreaker
+from .hedging import Hedger
+from .tts_cache import TTSCache
+from .warmup import AsyncGrpcChannelMonitor, GrpcChannelMonitor
+
+logger = logging.getLogger('Server')
+
+# Request timeouts (in sec), so that an unreachable service fails instead of hanging
+STT_TIMEOUT = 8
+STREAMING_STT_TIMEOUT = 60 # Whole streaming call, longer than the max recording duration
+TTS_TIMEOUT = 5
+PROBE_TIMEOUT = 3
+
+# Compressed audio transport (Opus/OGG, needs PyAV), for constrained networks
+COMPRESSED_STT_UPLINK = False # Streaming STT mic audio encoded as it is captured
+COMPRESSED_TTS_DOWNLINK = False # TTS audio as OGG_OPUS, decoded into the speaker format
+OPUS_BITRATE = 24000 # Uplink bitrate (bps)
+
+# Local emulator (host:port of tools/emulators/google_emulator.py) instead of the real services
+EMULATOR_HOST = os.environ.get('GOOGLE_SPEECH_EMULATOR_HOST')
+
+def create_client(client_class, asynchronous=False):
+    if not EMULATOR_HOST:
+        return client_class()
+
+    logger.info(f'Using Google emulator at {EMULATOR_HOST} ({client_class.__name__})')
+    if asynchronous:
+        transport = client_class.get_transport_class('grpc_asyncio')(channel=grpc.aio.insecure_channel(EMULATOR_HOST))
+    else:
+        transport = client_class.get_transport_class('grpc')(channel=grpc.insecure_channel(EMULATOR_HOST))
+    return client_class(transport=transport)
+
 
 # TTS
-clientTTS = texttospeech.TextToSpeechClient()
+clientTTS = create_client(texttospeech.TextToSpeechClient)
+tts_channel = GrpcChannelMonitor('tts', clientTTS.transport.grpc_channel)
 voice = texttospeech.VoiceSelectionParams(
     language_code='es-ES',
     ssml_gender=texttospeech.SsmlVoiceGender.FEMALE
 )
 tts_config = texttospeech.AudioConfig(
-    audio_encoding=texttospeech.AudioEncoding.LINEAR16,
+    audio_encoding=texttospeech.AudioEncoding.OGG_OPUS if COMPRESSED_TTS_DOWNLINK else texttospeech.AudioEncoding.LINEAR16,
     sample_rate_hertz=24000,
     pitch=-0.4,
 )
+tts_cache = TTSCache() # Synthesized audio by (text, voice, config)
+tts_hedger = Hedger('tts', percentile=0.95, budget=0.1) # Duplicate the slowest TTS requests
 
 # STT 
-clientSTT = speech.SpeechClient()
+clientSTT = create_client(speech.SpeechClient)
+stt_channel = GrpcChannelMonitor('stt', clientSTT.transport.grpc_channel)
 
 # STT Config (non-streaming) - used as fallback
 stt_config = speech.RecognitionConfig(
@@ -31,7 +77,7 @@ stt_config = speech.RecognitionConfig(
 # STT Streaming config - uses latest_long (optimized for conversations)
 streaming_config = speech.StreamingRecognitionConfig(
     config=speech.RecognitionConfig(
-        encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+        encoding=speech.RecognitionConfig.AudioEncoding.OGG_OPUS if COMPRESSED_STT_UPLINK else speech.RecognitionConfig.AudioEncoding.LINEAR16,
         sample_rate_hertz=16000,
         language_code="es-ES",
         enable_automatic_punctuation=True,
@@ -40,6 +86,11 @@ streaming_config = speech.StreamingRecognitionConfig(
     interim_results=True
 )
 
+# Race a latest_short recognize against streaming at the end of the speech (see RecognitionRace)
+STT_RACE = True
+RACE_MAX_DURATION = 2.0 # Utterances up to this duration (sec) are raced, e.g. "sí", "no"
+STT_BYTES_PER_SECOND = 16000 * 2 # 16 kHz LINEAR16
+
 
 def speech_to_text(audio_bytes):
     """
@@ -53,18 +104,72 @@ def speech_to_text(audio_bytes):
         str: The transcribed text
     """
     audio = speech.RecognitionAudio(content=audio_bytes)
-    response = clientSTT.recognize(config=stt_config, audio=audio)
+    stt_channel.on_request()
+    response = google_breaker.call(clientSTT.recognize, config=stt_config, audio=audio, timeout=STT_TIMEOUT)
 
     # The first alternative is the most likely one
     return "".join(result.alternatives[0].transcript for result in response.results)
 
-def text_to_speech(text):
+def synthesize_speech(text):
     synthesis_input = texttospeech.SynthesisInput(text=text)
-    response = clientTTS.synthesize_speech(
-        input=synthesis_input, voice=voice, audio_config=tts_config
+    tts_channel.on_request()
+    response = google_breaker.call(
+        tts_hedger.call, clientTTS.synthesize_speech, input=synthesis_input, voice=voice, audio_config=tts_config, timeout=TTS_TIMEOUT
     )
 
-    return response.audio_content
+    return decode_tts_audio(response.audio_content)
+
+def decode_tts_audio(audio_content):
+    # TTS audio in the speaker format (bare 24 kHz LINEAR16 PCM, as every speech backend returns it)
+    if COMPRESSED_TTS_DOWNLINK:
+        return decode_ogg_opus(audio_content, rate=tts_config.sample_rate_hertz)
+    if audio_content[:4] == b'RIFF':
+        # LINEAR16 comes as a WAV file: its header would be played as a click at the start of each sentence
+        with wave.open(io.BytesIO(audio_content), 'rb') as wav:
+            return wav.readframes(wav.getnframes())
+    return audio_content
+
+def probe_tts_connection():
+    # Cheap TTS call that opens (or keeps alive) its gRPC channel
+    tts_channel.on_request()
+    clientTTS.list_voices(language_code=voice.language_code, timeout=PROBE_TIMEOUT)
+
+def probe_stt_connection():
+    # Open the STT gRPC channel (there is no free STT call)
+    stt_channel.connect()
+
+# Fail fast while Google services are unreachable (probed in background until they answer)
+google_breaker = CircuitBreaker(
+    'google',
+    (google_exceptions.ServiceUnavailable, google_exceptions.DeadlineExceeded, google_exceptions.RetryError, ConnectionError, TimeoutError),
+    probe=probe_tts_connection
+)
+
+def text_to_speech(text):
+    # Repeated utterances (greetings, goodbyes, errors...) are served from the TTS cache
+    return tts_cache.get_or_synthesize(text, voice, tts_config, synthesize_speech)
+
+def warm_up_tts_cache(filename="files/tts_warmup.txt"):
+    """
+    Pre-synthesize the phrases of the warm-up list (one per line) into the TTS cache.
+
+    Returns:
+        int: Number of phrases in the cache after the warm-up
+    """
+    try:
+        with open(filename, "r", encoding="utf-8") as file:
+            phrases = [line.strip() for line in file if line.strip() and not line.startswith('#')]
+    except FileNotFoundError:
+        return 0
+
+    warmed = 0
+    for phrase in phrases:
+        try:
+            text_to_speech(phrase)
+            warmed += 1
+        except Exception as e:
+            logger.warning(f"Could not warm up TTS cache with '{phrase}'. {str(e)}")
+    return warmed
 
 
 def create_streaming_stt_request_generator(audio_generator):
@@ -81,32 +186,264 @@ def create_streaming_stt_request_generator(audio_generator):
         yield speech.StreamingRecognizeRequest(audio_content=audio_chunk)
 
 
-def create_streaming_requests_with_collection(audio_generator):
+def create_uplink_encoder():
+    # Opus/OGG encoder of the streaming STT audio (None: sent as LINEAR16)
+    if COMPRESSED_STT_UPLINK:
+        return OpusStreamEncoder(rate=16000, bitrate=OPUS_BITRATE)
+    return None
+
+def encoded_audio_requests(audio_chunk, encoder):
+    # Streaming requests of an audio chunk (none while the encoder has no output yet)
+    payload = encoder.encode(audio_chunk) if encoder is not None else audio_chunk
+    return [speech.StreamingRecognizeRequest(audio_content=payload)] if payload else []
+
+def close_uplink_encoder(encoder):
+    # Last streaming requests (end of the encoded stream)
+    if encoder is None:
+        return []
+    payload = encoder.close()
+    logger.debug(f"STT uplink: {encoder.bytes_in} PCM bytes sent as {encoder.bytes_out} Opus bytes")
+    return [speech.StreamingRecognizeRequest(audio_content=payload)] if payload else []
+
+
+def create_streaming_requests_with_collection(audio_generator, on_audio_end=None):
     """
     Creates streaming requests while collecting audio for fallback.
     
     Args:
         audio_generator: Generator that yields audio chunks (bytes)
+        on_audio_end: Optional callback on_audio_end(audio_bytes) called with the collected
+            audio when the audio generator ends (end of speech)
     
     Returns:
         tuple: (request_generator, collected_audio_list)
     """
     collected = []
+    encoder = create_uplink_encoder()
     
     def gen():
         for audio_chunk in audio_generator:
-            collected.append(audio_chunk)
-            yield speech.StreamingRecognizeRequest(audio_content=audio_chunk)
+            collected.append(audio_chunk) # Always PCM (fallback recognize)
+            yield from encoded_audio_requests(audio_chunk, encoder)
+        yield from close_uplink_encoder(encoder)
+        if on_audio_end is not None:
+            on_audio_end(b''.join(collected))
     
     return gen(), collected
 
 
-def streaming_speech_to_text(audio_generator):
+class StreamingTranscript:
+    ''' Transcript of a streaming recognition, built from its interim and final results '''
+    def __init__(self, on_result=None):
+        self.on_result = on_result
+        self.transcript = ""
+        self.silence_detection_time = None
+        self.last_interim_time = None
+        self.last_interim_transcript = ""  # Store last interim result as fallback
+
+    def on_response(self, response):
+        # Process a streaming response. Returns True once the final result has been received
+        if not response.results:
+            return False
+            
+        result = response.results[0]
+
+        if self.on_result is not None:
+            self.on_result(result.alternatives[0].transcript if result.alternatives else '', result.is_final)
+        
+        if not result.is_final:
+            # Update the time of the last interim result (user still speaking)
+            self.last_interim_transcript = result.alternatives[0].transcript  # Save interim transcript
+            self.last_interim_time = time.time()
+            return False
+
+        # Final result - calculate time since last interim result
+        final_result_time = time.time()
+        self.transcript = result.alternatives[0].transcript
+        
+        if self.last_interim_time is not None:
+            self.silence_detection_time = final_result_time - self.last_interim_time
+        else:
+            # No interim results received, can't measure accurately
+            self.silence_detection_time = 0.0
+
+        return True  # We got the final result
+
+    def result(self):
+        # If final transcript is empty (or the stream ended without it) but we had interim results, use the last interim
+        if not self.transcript and self.last_interim_transcript:
+            return self.last_interim_transcript, self.silence_detection_time
+        return self.transcript, self.silence_detection_time
+
+
+class RecognitionRaceStats:
+    def __init__(self):
+        self.lock = Lock()
+        self.stats = {'races': 0, 'streaming': 0, 'recognize': 0, 'none': 0, 'sequential_fallbacks': 0}
+
+    def record(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+stt_race_stats = RecognitionRaceStats() # Which path produced the transcript
+
+
+class RecognitionRace:
+    '''
+    Streaming recognition raced with a latest_short recognize of the same audio. The recognize
+    is started at the end of the speech, for short utterances or if streaming has not produced
+    interim results yet; the first non-empty transcript wins and the other request is cancelled.
+    speech_duration is an optional function returning the duration of the speech of the utterance
+    (e.g. Recorder.speech_duration): the audio also has the pre-roll and the trailing silence.
+    caller_races is an optional function returning whether the caller already races another
+    recognition of the utterance (see SpeechRouter): then there is no race here
+    '''
+    def __init__(self, speech_duration=None, caller_races=None):
+        self.speech_duration = speech_duration
+        self.caller_races = caller_races
+        self.lock = Lock()
+        self.winner = None # 'streaming' or 'recognize'
+        self.started = False # Recognize request sent
+        self.audio_end_time = None
+        self.recognize_transcript = ''
+        self.recognize_time = None # From the end of the speech to the recognize result
+        self.recognized = Event()
+        self.recognize_task = None # asyncio variant
+        self.streaming_cancelled = False # Streaming request cancelled because recognize won
+        self.cancel_streaming = None
+        self.cancel_recognize = None
+
+    def utterance_duration(self, audio_bytes):
+        # Duration of the speech (sec), or of the whole audio if unknown
+        duration = self.speech_duration() if self.speech_duration is not None else None
+        return duration if duration is not None else len(audio_bytes) / STT_BYTES_PER_SECOND
+
+    def should_race(self, audio_bytes, streaming_transcript):
+        if self.caller_races is not None and self.caller_races():
+            return False
+        short = self.utterance_duration(audio_bytes) <= RACE_MAX_DURATION
+        no_interim = streaming_transcript.last_interim_time is None
+        return STT_RACE and bool(audio_bytes) and (short or no_interim) and google_breaker.available
+
+    def claim(self, winner):
+        with self.lock:
+            if self.winner is None:
+                self.winner = winner
+                return True
+            return False
+
+    def set_cancel_streaming(self, cancel):
+        with self.lock:
+            self.cancel_streaming = cancel
+            lost = self.winner == 'recognize'
+        if lost:
+            cancel()
+
+    def on_recognize_result(self, transcript):
+        # Recognize transcript ('' if empty, failed or cancelled)
+        self.recognize_transcript = transcript
+        self.recognize_time = time.time() - self.audio_end_time
+        if transcript and self.claim('recognize'):
+            with self.lock:
+                cancel = self.cancel_streaming
+            if cancel is not None:
+                self.streaming_cancelled = True
+                cancel() # Streaming lost
+        self.recognized.set()
+
+    def start(self, audio_bytes, streaming_transcript):
+        # End of the speech (called from the gRPC request thread)
+        self.audio_end_time = time.time()
+        if not self.should_race(audio_bytes, streaming_transcript):
+            return
+
+        try:
+            google_breaker.before_call()
+            stt_channel.on_request()
+            # Raw gRPC future of the transport, so that the request can be cancelled if it loses
+            request = speech.RecognizeRequest(config=stt_config, audio=speech.RecognitionAudio(content=audio_bytes))
+            call = clientSTT.transport.recognize.future(request, timeout=STT_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Could not start short recognition race. {str(e)}")
+            return
+
+        self.started = True
+        self.cancel_recognize = call.cancel
+        call.add_done_callback(self._on_recognize_done)
+
+    def _on_recognize_done(self, call):
+        transcript = ''
+        try:
+            if not call.cancelled():
+                response = call.result()
+                google_breaker.record_success()
+                transcript = "".join(result.alternatives[0].transcript for result in response.results)
+        except grpc.RpcError as e:
+            google_breaker.record_failure(google_exceptions.from_grpc_error(e))
+        finally:
+            self.on_recognize_result(transcript)
+
+    def start_async(self, audio_bytes, streaming_transcript):
+        # asyncio variant of start (called from the event loop)
+        self.audio_end_time = time.time()
+        if self.should_race(audio_bytes, streaming_transcript):
+            self.recognize_task = asyncio.create_task(self._recognize_async(audio_bytes))
+            self.started = True
+            self.cancel_recognize = self.recognize_task.cancel
+
+    async def _recognize_async(self, audio_bytes):
+        transcript = ''
+        try:
+            transcript = await speech_to_text_async(audio_bytes)
+        except Exception as e:
+            logger.warning(f"Short recognition race failed. {str(e)}")
+        finally:
+            self.on_recognize_result(transcript)
+
+    def cancel(self):
+        if self.cancel_recognize is not None:
+            self.cancel_recognize()
+
+    def finish(self, transcript, silence_time):
+        ''' Result of the race once streaming has finished: (transcript, silence_detection_time) '''
+        if transcript and self.claim('streaming'):
+            self.cancel()
+        elif self.winner is None:
+            self.recognized.wait(STT_TIMEOUT + 1) # Streaming has no transcript, recognize may have it
+        return self._result(transcript, silence_time)
+
+    async def finish_async(self, transcript, silence_time):
+        if transcript and self.claim('streaming'):
+            self.cancel()
+        elif self.winner is None:
+            try:
+                await asyncio.wait({self.recognize_task}, timeout=STT_TIMEOUT + 1)
+            except asyncio.CancelledError:
+                self.cancel()
+                raise
+        return self._result(transcript, silence_time)
+
+    def _result(self, transcript, silence_time):
+        stt_race_stats.record('races')
+        stt_race_stats.record(self.winner or 'none')
+        if self.winner == 'recognize':
+            return self.recognize_transcript, self.recognize_time
+        return transcript, silence_time
+
+
+def streaming_speech_to_text(audio_generator, on_result=None, race=None):
     """
     Core streaming STT function. Pure streaming logic without fallback.
     
     Args:
         audio_generator: Generator that yields audio chunks (bytes)
+        on_result: Optional callback on_result(transcript, is_final) called for every
+            interim and final result (e.g. to detect the end of the turn early)
+        race: Optional RecognitionRace started at the end of the audio
     
     Returns:
         tuple: (transcript, silence_detection_time, audio_bytes) where:
@@ -114,74 +451,64 @@ def streaming_speech_to_text(audio_generator):
             - silence_detection_time: Time from last interim to final result
             - audio_bytes: Collected audio for potential fallback
     """
+    streaming_transcript = StreamingTranscript(on_result)
+    on_audio_end = (lambda audio_bytes: race.start(audio_bytes, streaming_transcript)) if race is not None else None
+
     # Create requests and collect audio for potential fallback
-    requests, collected_audio = create_streaming_requests_with_collection(audio_generator)
-    responses = clientSTT.streaming_recognize(streaming_config, requests)
-    
-    transcript = ""
-    silence_detection_time = None
-    last_interim_time = None
-    last_interim_transcript = ""  # Store last interim result as fallback
+    requests, collected_audio = create_streaming_requests_with_collection(audio_generator, on_audio_end)
+    google_breaker.before_call()
+    stt_channel.on_request()
+    responses = clientSTT.streaming_recognize(streaming_config, requests, timeout=STREAMING_STT_TIMEOUT)
+    if race is not None:
+        race.set_cancel_streaming(responses.cancel)
     
     try:
         for response in responses:
-            if not response.results:
-                continue
-                
-            result = response.results[0]
-            
-            if not result.is_final:
-                # Update the time of the last interim result (user still speaking)
-                last_interim_transcript = result.alternatives[0].transcript  # Save interim transcript
-                last_interim_time = time.time()
-            else:
-                # Final result - calculate time since last interim result
-                final_result_time = time.time()
-                transcript = result.alternatives[0].transcript
-                
-                if last_interim_time is not None:
-                    silence_detection_time = final_result_time - last_interim_time
-                else:
-                    # No interim results received, can't measure accurately
-                    silence_detection_time = 0.0
-                
-                # If final transcript is empty but we had interim results, use the last interim
-                if not transcript and last_interim_transcript:
-                    transcript = last_interim_transcript
-
-                break  # We got the final result
+            if streaming_transcript.on_response(response):
+                break
     
     except Exception as e:
         # If the stream ends or there's an error, return what we have
-        # Use last interim result if available
-        if not transcript and last_interim_transcript:
-            transcript = last_interim_transcript
+        if race is None or race.winner != 'recognize': # Not cancelled because recognize won
+            google_breaker.record_failure(e)
+    else:
+        google_breaker.record_success()
     
+    transcript, silence_detection_time = streaming_transcript.result()
     audio_bytes = b''.join(collected_audio) if collected_audio else b''
     return transcript, silence_detection_time, audio_bytes
 
 
-def compose_streaming_fallback_speech_to_text(audio_generator):
+def compose_streaming_fallback_speech_to_text(audio_generator, on_result=None, speech_duration=None, caller_races=None):
     """
     Performs streaming speech recognition with automatic fallback for empty results.
     
     Strategy:
     1. Try streaming STT with latest_long model (optimized for conversations)
-    2. If result is empty, fallback to latest_short model (better for monosyllables)
+    2. For short utterances, or if streaming has no interim results by the end of the speech,
+       race latest_short model (better for monosyllables) with it: first non-empty transcript wins
+    3. Otherwise, if result is empty, fallback to latest_short model
     
     Args:
         audio_generator: Generator that yields audio chunks (bytes)
+        on_result: Optional callback for streaming results (see streaming_speech_to_text)
+        speech_duration: Optional function returning the duration of the speech (see RecognitionRace)
+        caller_races: Optional function returning whether the caller races the utterance itself (see RecognitionRace)
     
     Returns:
         tuple: (transcript, silence_detection_time) where:
             - transcript: The transcribed text
             - silence_detection_time: Total time including fallback if used
     """
-    # Step 1: Try streaming STT
-    transcript, silence_time, audio_bytes = streaming_speech_to_text(audio_generator)
+    # Step 1-2: Try streaming STT, raced with recognize at the end of the speech
+    race = RecognitionRace(speech_duration, caller_races)
+    transcript, silence_time, audio_bytes = streaming_speech_to_text(audio_generator, on_result, race)
+    if race.started:
+        return race.finish(transcript, silence_time)
     
-    # Step 2: Fallback if result is empty
+    # Step 3: Fallback if result is empty
     if not transcript and audio_bytes:
+        stt_race_stats.record('sequential_fallbacks')
         try:
             fallback_start = time.time()
             fallback_transcript = speech_to_text(audio_bytes)
@@ -199,3 +526,125 @@ def compose_streaming_fallback_speech_to_text(audio_generator):
             pass
     
     return transcript, silence_time
+
+
+# asyncio pipeline (see async_server.py). The async clients are created on first use,
+# inside the event loop that runs them
+async_clients = {}
+
+def get_async_clients():
+    if not async_clients:
+        async_clients['stt'] = create_client(speech.SpeechAsyncClient, asynchronous=True)
+        async_clients['tts'] = create_client(texttospeech.TextToSpeechAsyncClient, asynchronous=True)
+        async_clients['stt_channel'] = AsyncGrpcChannelMonitor('stt', async_clients['stt'].transport.grpc_channel)
+        async_clients['tts_channel'] = AsyncGrpcChannelMonitor('tts', async_clients['tts'].transport.grpc_channel)
+    return async_clients['stt'], async_clients['tts']
+
+async def speech_to_text_async(audio_bytes):
+    client, _ = get_async_clients()
+    audio = speech.RecognitionAudio(content=audio_bytes)
+    async_clients['stt_channel'].on_request()
+    response = await google_breaker.call_async(client.recognize, config=stt_config, audio=audio, timeout=STT_TIMEOUT)
+
+    # The first alternative is the most likely one
+    return "".join(result.alternatives[0].transcript for result in response.results)
+
+async def synthesize_speech_async(text):
+    _, client = get_async_clients()
+    synthesis_input = texttospeech.SynthesisInput(text=text)
+    async_clients['tts_channel'].on_request()
+    response = await google_breaker.call_async(
+        tts_hedger.call_async, client.synthesize_speech, input=synthesis_input, voice=voice, audio_config=tts_config, timeout=TTS_TIMEOUT
+    )
+
+    return decode_tts_audio(response.audio_content)
+
+async def probe_tts_connection_async():
+    # probe_tts_connection of the async client (run in the event loop of the asyncio pipeline)
+    _, client = get_async_clients()
+    async_clients['tts_channel'].on_request()
+    await client.list_voices(language_code=voice.language_code, timeout=PROBE_TIMEOUT)
+
+async def probe_stt_connection_async():
+    get_async_clients()
+    await async_clients['stt_channel'].connect(PROBE_TIMEOUT)
+
+async def text_to_speech_async(text):
+    # Same TTS cache as text_to_speech
+    key = tts_cache.key(text, voice, tts_config)
+    audio = tts_cache.get(key)
+    if audio is None:
+        audio = await synthesize_speech_async(text)
+        if audio:
+            tts_cache.put(key, audio)
+    return audio
+
+async def streaming_speech_to_text_async(audio_chunks, on_result=None, race=None):
+    """
+    asyncio variant of streaming_speech_to_text. audio_chunks is an async iterable of audio chunks.
+    Cancelling it cancels the streaming call.
+    """
+    client, _ = get_async_clients()
+    collected_audio = []
+    encoder = create_uplink_encoder()
+
+    async def requests():
+        # The async client has no helper to send the config: it goes in the first request
+        yield speech.StreamingRecognizeRequest(streaming_config=streaming_config)
+        async for audio_chunk in audio_chunks:
+            collected_audio.append(audio_chunk)
+            for request in encoded_audio_requests(audio_chunk, encoder):
+                yield request
+        for request in close_uplink_encoder(encoder):
+            yield request
+        if race is not None:
+            race.start_async(b''.join(collected_audio), streaming_transcript)
+
+    streaming_transcript = StreamingTranscript(on_result)
+
+    google_breaker.before_call()
+    async_clients['stt_channel'].on_request()
+    try:
+        responses = await client.streaming_recognize(requests=requests(), timeout=STREAMING_STT_TIMEOUT)
+        async for response in responses:
+            if streaming_transcript.on_response(response):
+                break
+
+    except Exception as e:
+        # If the stream ends or there's an error, return what we have
+        google_breaker.record_failure(e)
+    else:
+        google_breaker.record_success()
+
+    transcript, silence_detection_time = streaming_transcript.result()
+    return transcript, silence_detection_time, b''.join(collected_audio)
+
+async def compose_streaming_fallback_speech_to_text_async(audio_chunks, on_result=None, speech_duration=None, caller_races=None):
+    # asyncio variant of compose_streaming_fallback_speech_to_text
+    race = RecognitionRace(speech_duration, caller_races)
+    streaming = asyncio.create_task(streaming_speech_to_text_async(audio_chunks, on_result, race))
+    race.set_cancel_streaming(streaming.cancel)
+    try:
+        transcript, silence_time, audio_bytes = await streaming
+    except asyncio.CancelledError:
+        if not race.streaming_cancelled:
+            race.cancel() # Whole recognition cancelled
+            raise
+        transcript, silence_time, audio_bytes = '', None, b''
+
+    if race.started:
+        return await race.finish_async(transcript, silence_time)
+
+    if not transcript and audio_bytes:
+        stt_race_stats.record('sequential_fallbacks')
+        try:
+            fallback_start = time.time()
+            fallback_transcript = await speech_to_text_async(audio_bytes)
+            if fallback_transcript:
+                transcript = fallback_transcript
+                silence_time = (silence_time or 0.0) + time.time() - fallback_start
+        except Exception:
+            # Fallback failed, keep original transcript
+            pass
+
+    return transcript, silence_time
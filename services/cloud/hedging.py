@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Lock
+
+logger = logging.getLogger('Server')
+
+# Primary and duplicate requests of hedged calls (TTS and LLM). A losing request cannot be
+# cancelled once it has started: it keeps its worker until it finishes, so there are workers
+# for the requests in flight plus as many stragglers
+hedge_executor = ThreadPoolExecutor(max_workers=16)
+
+
+class LatencyTracker:
+    # Rolling window of the latencies of a stage
+    def __init__(self, window=200):
+        self.samples = deque(maxlen=window)
+        self.lock = Lock()
+
+    def add(self, latency):
+        with self.lock:
+            self.samples.append(latency)
+
+    def percentile(self, q):
+        # Nearest-rank percentile (q in 0-1), None without samples
+        with self.lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return None
+        return samples[max(math.ceil(q * len(samples)) - 1, 0)]
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class Hedger:
+    '''
+    Hedged requests for a stage: when a call takes longer than the given percentile of the
+    recent latencies of the stage, a duplicate request is sent and the first one to finish
+    is used (the other one is cancelled if possible, or its result discarded).
+    At most budget (fraction) of the recent calls are hedged. discard is called with the result
+    of a losing request that finished anyway (e.g. to close the stream it opened).
+    '''
+    def __init__(self, stage, percentile=0.95, budget=0.1, min_samples=20, window=200, executor=None, enabled=True,
+                 discard=None):
+        self.stage = stage
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples # No hedging until the percentile is meaningful
+        self.executor = executor or hedge_executor
+        self.enabled = enabled
+        self.discard = discard
+
+        self.latencies = LatencyTracker(window)
+        self.recent_hedges = deque(maxlen=window) # Whether each recent call was hedged
+        self.lock = Lock()
+        self.stats = {'calls': 0, 'hedges_fired': 0, 'hedges_won': 0}
+
+    def hedge_delay(self):
+        # Time to wait for a request before hedging it (None: not hedged)
+        if not self.enabled or len(self.latencies) < self.min_samples:
+            return None
+        return self.latencies.percentile(self.percentile)
+
+    def _take_budget(self):
+        with self.lock:
+            if sum(self.recent_hedges) >= self.budget * max(len(self.recent_hedges), 1):
+                return False
+            self.stats['hedges_fired'] += 1
+            return True
+
+    def _record(self, latency, hedged, won):
+        # Latency of the call: from the start of the primary request to the first result
+        self.latencies.add(latency)
+        with self.lock:
+            self.recent_hedges.append(hedged)
+            self.stats['calls'] += 1
+            if won:
+                self.stats['hedges_won'] += 1
+
+    def _record_loser(self, future):
+        # A losing request that finishes is a latency sample too (without it slow requests would be under-counted)
+        if not future.cancelled() and future.exception() is None:
+            result, latency = future.result()
+            self.latencies.add(latency)
+            if self.discard is not None:
+                self.discard(result)
+
+    @staticmethod
+    def _timed(fn, args, kwargs):
+        start = time.monotonic()
+        return fn(*args, **kwargs), time.monotonic() - start
+
+    def call(self, fn, *args, **kwargs):
+        # fn(*args, **kwargs), hedged when it is slow
+        delay = self.hedge_delay()
+        if delay is None:
+            result, latency = self._timed(fn, args, kwargs)
+            self._record(latency, False, False)
+            return result
+
+        start = time.monotonic()
+        futures = [self.executor.submit(self._timed, fn, args, kwargs)]
+        done, _ = wait(futures, timeout=delay)
+        if not done and self._take_budget():
+            logger.debug(f'{self.stage} request slower than p{self.percentile * 100:.0f} ({delay * 1000:.0f} ms), hedging')
+            futures.append(self.executor.submit(self._timed, fn, args, kwargs))
+
+        return self._first_result(futures, start)
+
+    def _first_result(self, futures, start):
+        # First successful result; the error of the last one if all of them fail
+        pending = set(futures)
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    self._record(time.monotonic() - start, len(futures) > 1, future is not futures[0])
+                    for other in futures:
+                        if other is not future:
+                            other.cancel()
+                            other.add_done_callback(self._record_loser)
+                    return future.result()[0]
+                error = future.exception()
+        raise error
+
+    async def call_async(self, fn, *args, **kwargs):
+        # await fn(*args, **kwargs), hedged when it is slow. The losing request is cancelled
+        async def timed():
+            start = time.monotonic()
+            return await fn(*args, **kwargs), time.monotonic() - start
+
+        delay = self.hedge_delay()
+        if delay is None:
+            result, latency = await timed()
+            self._record(latency, False, False)
+            return result
+
+        start = time.monotonic()
+        tasks = [asyncio.ensure_future(timed())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self._take_budget():
+                logger.debug(f'{self.stage} request slower than p{self.percentile * 100:.0f} ({delay * 1000:.0f} ms), hedging')
+                tasks.append(asyncio.ensure_future(timed()))
+
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self._record(time.monotonic() - start, len(tasks) > 1, task is not tasks[0])
+                        for other in tasks:
+                            if other is not task:
+                                other.add_done_callback(self._record_loser) # Cancelled below unless already done
+                        return task.result()[0]
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        for q in (0.5, 0.9, 0.95):
+            latency = self.latencies.percentile(q)
+            stats[f'p{q * 100:.0f}_ms'] = round(latency * 1000) if latency is not None else None
+        return stats
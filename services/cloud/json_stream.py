@@ -0,0 +1,138 @@
+import json
+
+
+class IncrementalJSONParser:
+    '''
+    Incremental parser of a flat JSON object ({"key": value, ...}) received piece by piece,
+    e.g. a structured output being streamed by the LLM. feed(text) returns the events found
+    in the new text, in order:
+        (key, text, False)  new characters of a string value, as they arrive
+        (key, value, True)  a value is complete (string, number, boolean or null)
+    Nested objects and arrays are not supported.
+    '''
+    ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+    _QUOTE = object() # Unescaped closing quote
+
+    def __init__(self):
+        self.state = 'start' # start, key_wait, key, colon, value_wait, string, literal, after_value, done
+        self.key = None
+        self.token = [] # Key or value being parsed
+        self.escape = None # Escape sequence being parsed (without the backslash)
+        self.high_surrogate = None # First half of an escaped UTF-16 surrogate pair
+        self.values = {} # Complete values
+
+    def feed(self, text):
+        events = []
+        delta = [] # Characters of the current string value in this piece of text
+
+        for char in text:
+            state = self.state
+
+            if state in ('key', 'string'):
+                decoded = self._decode(char)
+                if decoded is None: # Inside an escape sequence
+                    continue
+
+                if decoded is self._QUOTE:
+                    value = ''.join(self.token)
+                    self.token = []
+                    if state == 'key':
+                        self.key = value
+                        self.state = 'colon'
+                    else:
+                        if delta:
+                            events.append((self.key, ''.join(delta), False))
+                            delta = []
+                        self._complete(value, events)
+                        self.state = 'after_value'
+                else:
+                    self.token.append(decoded)
+                    if state == 'string':
+                        delta.append(decoded)
+
+            elif state == 'literal':
+                if char in ',}':
+                    literal = ''.join(self.token).strip()
+                    self.token = []
+                    try:
+                        value = json.loads(literal)
+                    except json.JSONDecodeError:
+                        value = literal
+                    self._complete(value, events)
+                    self.state = 'key_wait' if char == ',' else 'done'
+                else:
+                    self.token.append(char)
+
+            elif char.isspace():
+                continue
+
+            elif state == 'start':
+                if char == '{':
+                    self.state = 'key_wait'
+
+            elif state == 'key_wait':
+                if char == '"':
+                    self.state = 'key'
+                elif char == '}':
+                    self.state = 'done'
+
+            elif state == 'colon':
+                if char == ':':
+                    self.state = 'value_wait'
+
+            elif state == 'value_wait':
+                if char == '"':
+                    self.state = 'string'
+                else:
+                    self.state = 'literal'
+                    self.token = [char]
+
+            elif state == 'after_value':
+                if char == ',':
+                    self.state = 'key_wait'
+                elif char == '}':
+                    self.state = 'done'
+
+        if delta:
+            events.append((self.key, ''.join(delta), False))
+        return events
+
+    def _complete(self, value, events):
+        self.values[self.key] = value
+        events.append((self.key, value, True))
+
+    def _decode(self, char):
+        # Decoded text for the next character of a string, None inside an escape sequence
+        if self.escape is None:
+            if char == '\\':
+                self.escape = ''
+                return None
+            if char == '"':
+                return self._QUOTE
+            return char
+
+        self.escape += char
+        if self.escape[0] != 'u':
+            self.escape = None
+            return self.ESCAPES.get(char, char)
+
+        if len(self.escape) < 5: # \uXXXX
+            return None
+
+        try:
+            code = int(self.escape[1:], 16)
+        except ValueError:
+            code = 0xFFFD
+        self.escape = None
+
+        if 0xD800 <= code < 0xDC00:
+            self.high_surrogate = code
+            return ''
+        if 0xDC00 <= code < 0xE000 and self.high_surrogate is not None:
+            code = 0x10000 + ((self.high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+        self.high_surrogate = None
+        return chr(code)
+
+    @property
+    def done(self):
+        return self.state == 'done'
@@ -1,9 +1,40 @@
+import asyncio
 import json
 from datetime import datetime
-from openai import OpenAI  
+import httpx
+import openai
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
 from pydantic import BaseModel, Field
 
-client = OpenAI()
+from .circuit_breaker import CircuitBreaker
+from .hedging import Hedger
+from .json_stream import IncrementalJSONParser
+from .sentences import SentenceBuffer
+from .warmup import http_connection_hooks
+
+# Idle connections are kept in the pool between the warm-up probes. A short connect timeout
+# and a single retry, so that an unreachable service fails (and trips the circuit breaker) quickly
+REQUEST_TIMEOUT = httpx.Timeout(20, connect=3)
+client = OpenAI(timeout=REQUEST_TIMEOUT, max_retries=1, http_client=DefaultHttpxClient(
+    event_hooks=http_connection_hooks('llm'),
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=90)
+))
+async_client = AsyncOpenAI(timeout=REQUEST_TIMEOUT, max_retries=1, http_client=DefaultAsyncHttpxClient( # asyncio pipeline
+    event_hooks=http_connection_hooks('llm', asynchronous=True),
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=90)
+))
+
+def discard_response_stream(result):
+    # Close the stream opened by a losing hedged request (see open_response_stream)
+    stream, _ = result
+    closing = stream.close()
+    if closing is not None: # AsyncResponseStream.close() is a coroutine (run in the event loop)
+        asyncio.ensure_future(closing)
+
+# Duplicate the slowest LLM requests: whole responses (generate_response), and streamed responses
+# on the time to their first event (generate_response_stream, the live conversation path)
+llm_hedger = Hedger('llm', percentile=0.9, budget=0.05)
+llm_stream_hedger = Hedger('llm_stream', percentile=0.9, budget=0.05, discard=discard_response_stream)
 
 prev_conversation_history = [] # Conversation history from previous sessions (from file)
 current_conversation_history = [] # Conversation history from current session (new current interaction)
@@ -19,19 +50,22 @@ def load_tools(filename="files/tools_config.json"):
         return json.load(file)
 
 # Load and save conversation history
-def load_conversation_history(username, filename="files/conversations_db.json"):
-    global prev_conversation_history
-
+def read_conversation_history(username, filename="files/conversations_db.json"):
+    # Stored conversation history of a user, without loading it
     if username:
         try:
             with open(filename, "r", encoding="utf-8") as file:
                 conversation_dict = json.load(file)
-                prev_conversation_history = conversation_dict.get(username, [])
+                return conversation_dict.get(username, [])
         except (FileNotFoundError, json.JSONDecodeError):
-            prev_conversation_history = []
-    
-    else:
-        prev_conversation_history = []
+            pass
+
+    return []
+
+def load_conversation_history(username, filename="files/conversations_db.json"):
+    global prev_conversation_history
+
+    prev_conversation_history = read_conversation_history(username, filename)
 
 def save_conversation_history(username, filename="files/conversations_db.json"):
     if current_conversation_history: # Save only if there is conversation history to save
@@ -69,6 +103,10 @@ def save_conversation_history(username, filename="files/conversations_db.json"):
 def get_full_conversation_history():
     return prev_conversation_history + current_conversation_history
 
+def commit_conversation(exchange):
+    # Add to the current session the messages of a response generated without committing them
+    current_conversation_history.extend(exchange)
+
 # Clear conversation history in-RAM (temporal context conversation)
 def clear_conversation_history():
     prev_conversation_history.clear()
@@ -125,16 +163,30 @@ def handle_tool_call(tool_call, context_data):
     return result, robot_action
 
 
-def build_messages(input_text, context_data):
-    ''' Build messages with conversation history '''
+def message_timestamp():
+    return datetime.now().strftime("%d-%m-%Y %H:%M")
+
+def restamp_exchange(exchange):
+    ''' Messages of a response generated in advance, with the user message stamped now (when it is used) '''
+    user_message, *messages = exchange
+    content = json.loads(user_message["content"])
+    content["timestamp"] = message_timestamp()
+    return [{**user_message, "content": json.dumps(content, ensure_ascii=False)}, *messages]
+
 
-    messages = prev_conversation_history + current_conversation_history # include previous conversation history
+def build_messages(input_text, context_data, history=None, commit=True):
+    ''' Build messages with conversation history (the loaded one by default) '''
+
+    if history is None:
+        history = prev_conversation_history + current_conversation_history # include previous conversation history
+    messages = list(history)
     user_message = {"role": "user", "content": json.dumps({**context_data,
                                                            "user_input": input_text,
-                                                           "timestamp": datetime.now().strftime("%d-%m-%Y %H:%M")}, ensure_ascii=False)}
+                                                           "timestamp": message_timestamp()}, ensure_ascii=False)}
 
     messages.append(user_message)
-    current_conversation_history.append(user_message)
+    if commit:
+        current_conversation_history.append(user_message)
 
     return messages
 
@@ -157,45 +209,48 @@ def get_tools_for_context(context_data):
     return tools_to_use, requireness
 
 
-def generate_response(input_text, context_data={}):
-    ''' Generate response from user input, context data, and conversation history '''
-    
-    messages = build_messages(input_text, context_data)
-    tools_to_use, requireness_tool = get_tools_for_context(context_data)
+def build_completion_args(messages, context_data):
+    ''' Completion arguments of a request (the shared configuration is not modified, so requests can run concurrently) '''
+    args = {**completion_args, "input": messages}
 
-    # Create OpenAI completion arguments
-    completion_args["input"] = messages
+    tools_to_use, requireness_tool = get_tools_for_context(context_data)
     if tools_to_use:  # Only add 'tools' if there are tools available
-        completion_args["tools"] = tools_to_use
-        completion_args["tool_choice"] = requireness_tool
+        args["tools"] = tools_to_use
+        args["tool_choice"] = requireness_tool
 
-    robot_action = {}
-    response = client.responses.parse(**completion_args)
+    return args
 
-    # Check if there is a function call in the list of response.output
-    if any(item.type == "function_call" for item in response.output):
-        tool_call = next(item for item in response.output if item.type == "function_call")
-        result, robot_action = handle_tool_call(tool_call, context_data)
 
-        messages.append(tool_call) # append model's function call message
-        messages.append({                   # append function result message
-            "type": "function_call_output",
-            "call_id": tool_call.call_id,
-            "output": result
-        })
+def find_tool_call(response):
+    ''' Function call of the response output, if any '''
+    return next((item for item in response.output if item.type == "function_call"), None)
 
-        completion_args.pop("tool_choice", None)  # Remove tools
-        completion_args.pop("tools", None)
 
-        response = client.responses.parse(**completion_args)
-    
-    # Get response dict from OpenAI response
-    response_dict = response.output_parsed.model_dump(by_alias=True)
-    
+def add_tool_result(tool_call, messages, args, context_data):
+    ''' Handle a tool call: its result is added to the messages and the tools are removed for the final response '''
+    result, robot_action = handle_tool_call(tool_call, context_data)
+
+    messages.append(tool_call) # append model's function call message
+    messages.append({                   # append function result message
+        "type": "function_call_output",
+        "call_id": tool_call.call_id,
+        "output": result
+    })
+
+    args.pop("tool_choice", None)  # Remove tools
+    args.pop("tools", None)
+
+    return robot_action
+
+
+def finish_response(response_dict, robot_action, user_message, commit):
+    ''' Response text and robot context from the parsed response, added to the conversation history if commit '''
     response_text = response_dict.get("response", "").translate(str.maketrans("'", '"', '*_#'))
     
     # Add response to conversation history
-    current_conversation_history.append({"role": "assistant", "content": response_text})
+    assistant_message = {"role": "assistant", "content": response_text}
+    if commit:
+        current_conversation_history.append(assistant_message)
 
     # Build robot_context from parsed data (continue, robot_mood, robot_action)
     robot_context = {
@@ -203,4 +258,202 @@ def generate_response(input_text, context_data={}):
         "robot_mood": response_dict.get("robot_mood", "neutral"),
     } | robot_action
     
+    if not commit:
+        return response_text, robot_context, [user_message, assistant_message]
     return response_text, robot_context
+
+
+def generate_response(input_text, context_data={}, history=None, commit=True):
+    '''
+    Generate response from user input, context data, and conversation history.
+    With commit=False the conversation history is not modified (e.g. responses prepared in advance)
+    and the messages to add with commit_conversation() if the response is used are also returned.
+    '''
+    
+    messages = build_messages(input_text, context_data, history, commit)
+    user_message = messages[-1]
+
+    # Create OpenAI completion arguments
+    args = build_completion_args(messages, context_data)
+
+    robot_action = {}
+    response = openai_breaker.call(llm_hedger.call, client.responses.parse, **args)
+
+    # Check if there is a function call in the list of response.output
+    tool_call = find_tool_call(response)
+    if tool_call is not None:
+        robot_action = add_tool_result(tool_call, messages, args, context_data)
+        response = openai_breaker.call(llm_hedger.call, client.responses.parse, **args)
+    
+    # Get response dict from OpenAI response
+    return finish_response(response.output_parsed.model_dump(by_alias=True), robot_action, user_message, commit)
+
+
+async def generate_response_async(input_text, context_data={}, history=None, commit=True):
+    ''' asyncio variant of generate_response (cancelling it aborts the request in flight) '''
+    
+    messages = build_messages(input_text, context_data, history, commit=False)
+    user_message = messages[-1]
+
+    args = build_completion_args(messages, context_data)
+
+    robot_action = {}
+    response = await openai_breaker.call_async(llm_hedger.call_async, async_client.responses.parse, **args)
+
+    tool_call = find_tool_call(response)
+    if tool_call is not None:
+        robot_action = add_tool_result(tool_call, messages, args, context_data)
+        response = await openai_breaker.call_async(llm_hedger.call_async, async_client.responses.parse, **args)
+
+    # History updated only once the response is complete (not if it is cancelled)
+    response = finish_response(response.output_parsed.model_dump(by_alias=True), robot_action, user_message, commit=False)
+    if commit:
+        commit_conversation(response[2])
+        return response[:2]
+    return response
+
+
+class StructuredResponseStream:
+    ''' Events of a structured response while it is streamed (see generate_response_stream) '''
+    def __init__(self):
+        self.robot_context = {}
+        self.parser = IncrementalJSONParser()
+        self.sentences = SentenceBuffer()
+        self.clean = str.maketrans("'", '"', '*_#')
+
+    def on_event(self, event):
+        # Events of a response stream event (None: the stream ended before the first one)
+        if event is not None and event.type == "response.output_text.delta":
+            return self.on_delta(event.delta)
+        return []
+
+    def on_delta(self, delta):
+        events = []
+        for key, value, complete in self.parser.feed(delta):
+            if key == "response" and not complete:
+                events += [('sentence', sentence.translate(self.clean)) for sentence in self.sentences.feed(value)]
+            elif key in ("continue", "robot_mood") and complete:
+                self.robot_context[key] = value
+                events.append(('context', dict(self.robot_context)))
+        return events
+
+    def on_robot_action(self, robot_action):
+        if not robot_action:
+            return []
+        self.robot_context |= robot_action
+        return [('context', dict(self.robot_context))]
+
+    def finish(self, user_message):
+        events = [('sentence', sentence.translate(self.clean)) for sentence in self.sentences.flush()]
+
+        response_text, robot_context, exchange = finish_response(self.parser.values, {}, user_message, commit=False)
+        robot_context |= self.robot_context
+
+        # Add the user message and the response to conversation history
+        commit_conversation(exchange)
+
+        return events + [('end', (response_text, robot_context))]
+
+
+def open_response_stream(args):
+    # Response stream and its first event (None if it has none): streamed responses are
+    # hedged on the time to the first event
+    stream = client.responses.stream(**args).__enter__()
+    try:
+        return stream, next(stream, None)
+    except BaseException:
+        stream.close()
+        raise
+
+async def open_response_stream_async(args):
+    stream = await async_client.responses.stream(**args).__aenter__()
+    try:
+        try:
+            return stream, await stream.__anext__()
+        except StopAsyncIteration:
+            return stream, None
+    except BaseException:
+        await stream.close()
+        raise
+
+
+def generate_response_stream(input_text, context_data={}):
+    '''
+    Streaming variant of generate_response: the structured output is parsed while it is generated.
+    Yields (event, data) as soon as each piece is known:
+        ('context', robot_context)  continue / robot_mood emitted, or robot action from a tool call
+        ('sentence', text)          each complete sentence of the response
+        ('end', (response_text, robot_context))  response complete (added to the conversation history)
+    '''
+    messages = build_messages(input_text, context_data, commit=False)
+    user_message = messages[-1]
+
+    # Create OpenAI completion arguments
+    args = build_completion_args(messages, context_data)
+
+    output = StructuredResponseStream()
+    while True:
+        with openai_breaker.track():
+            stream, first_event = llm_stream_hedger.call(open_response_stream, args)
+            with stream:
+                yield from output.on_event(first_event)
+                for event in stream:
+                    yield from output.on_event(event)
+
+                response = stream.get_final_response()
+
+        # Tool call (first pass only): handle it and generate the response with its result
+        tool_call = find_tool_call(response)
+        if tool_call is None or "tools" not in args:
+            break
+
+        yield from output.on_robot_action(add_tool_result(tool_call, messages, args, context_data))
+
+    yield from output.finish(user_message)
+
+
+async def generate_response_stream_async(input_text, context_data={}):
+    ''' asyncio variant of generate_response_stream '''
+    messages = build_messages(input_text, context_data, commit=False)
+    user_message = messages[-1]
+
+    args = build_completion_args(messages, context_data)
+
+    output = StructuredResponseStream()
+    while True:
+        with openai_breaker.track():
+            stream, first_event = await llm_stream_hedger.call_async(open_response_stream_async, args)
+            async with stream:
+                for output_event in output.on_event(first_event):
+                    yield output_event
+                async for event in stream:
+                    for output_event in output.on_event(event):
+                        yield output_event
+
+                response = await stream.get_final_response()
+
+        tool_call = find_tool_call(response)
+        if tool_call is None or "tools" not in args:
+            break
+
+        for output_event in output.on_robot_action(add_tool_result(tool_call, messages, args, context_data)):
+            yield output_event
+
+    for output_event in output.finish(user_message):
+        yield output_event
+
+
+def probe_llm_connection():
+    # Cheap OpenAI call that opens (or keeps alive) a pooled HTTP connection
+    client.with_options(timeout=3, max_retries=0).models.retrieve(completion_args["model"])
+
+async def probe_llm_connection_async():
+    # probe_llm_connection of the async client (run in the event loop of the asyncio pipeline)
+    await async_client.with_options(timeout=3, max_retries=0).models.retrieve(completion_args["model"])
+
+# Fail fast while OpenAI is unreachable (probed in background until it answers)
+openai_breaker = CircuitBreaker(
+    'openai',
+    (openai.APIConnectionError, openai.InternalServerError, ConnectionError, TimeoutError),
+    probe=probe_llm_connection
+)
@@ -0,0 +1,53 @@
+import re
+
+SENTENCE_END = re.compile(r'(?<=[.!?…;:])\s+')
+
+
+def split_sentences(text, min_length=20):
+    """
+    Split a text into sentences for TTS. Sentences shorter than min_length characters
+    are joined to the next one, so that interjections ("¡Hola!") do not cost a request
+    and do not break the prosody.
+    """
+    sentences = []
+    pending = ''
+    for sentence in SENTENCE_END.split(text.strip()) if text else []:
+        pending = f'{pending} {sentence}' if pending else sentence
+        if len(pending) >= min_length:
+            sentences.append(pending)
+            pending = ''
+
+    if pending:
+        if sentences and len(pending) < min_length:
+            sentences[-1] = f'{sentences[-1]} {pending}'
+        else:
+            sentences.append(pending)
+    return sentences
+
+
+class SentenceBuffer:
+    '''
+    Incremental version of split_sentences for text that is being generated:
+    feed() returns the sentences completed by the new text, flush() the rest at the end.
+    '''
+    def __init__(self, min_length=20):
+        self.min_length = min_length
+        self.text = ''
+
+    def feed(self, text):
+        self.text += text
+
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self.text):
+            if match.start() - start >= self.min_length:
+                sentences.append(self.text[start:match.start()].strip())
+                start = match.end()
+
+        self.text = self.text[start:]
+        return sentences
+
+    def flush(self):
+        rest = self.text.strip()
+        self.text = ''
+        return [rest] if rest else []
@@ -1,13 +1,32 @@
+import hashlib
+import json
 import logging
+import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from threading import Condition, Lock, Thread, Timer
 
-from .google_api import speech_to_text, text_to_speech, compose_streaming_fallback_speech_to_text
-from .openai_api import generate_response, load_conversation_history, save_conversation_history, clear_conversation_history
+from .google_api import (tts_cache, warm_up_tts_cache, probe_stt_connection, probe_tts_connection, tts_hedger, google_breaker,
+                         stt_race_stats)
+from .openai_api import (generate_response, generate_response_stream, load_conversation_history, save_conversation_history,
+                         clear_conversation_history, read_conversation_history, get_full_conversation_history, commit_conversation,
+                         probe_llm_connection, llm_hedger, llm_stream_hedger, openai_breaker, restamp_exchange)
+from .speech_backends import speech_router
+from .warmup import ConnectionWarmer, connection_stats
+from .sentences import split_sentences
 
 logger = logging.getLogger('Server')
 logger.setLevel(logging.DEBUG)
 
+tts_executor = ThreadPoolExecutor(max_workers=4) # Concurrent TTS requests of the sentences of a reply
+LLM_STREAMING = True # Stream the LLM output and synthesize each sentence as soon as it is generated
+
+# Proactive responses prepared before the question is due: (username, proactive_question) -> (fingerprint, time, Response, exchange)
+pregenerated_responses = {}
+pregenerated_lock = Lock()
+PREGENERATED_MAX_AGE = 30 * 60 # in sec
+
 
 @dataclass
 class Request:
@@ -19,13 +38,165 @@ class Request:
 @dataclass
 class Response:
     request: Request
-    audio: str
+    audio: 'SpeechSegments'
     action: str
     username: str
     continue_conversation: bool
     robot_mood: str = 'neutral'
     text: str = None
 
+def build_response(request: Request, text_response, robot_context, audio_response):
+    # Response of the robot from the LLM robot context (used by every pipeline, see async_server)
+    return Response(
+        request,
+        audio_response,
+        robot_context.get('action', None),
+        robot_context.get('username', None),
+        bool(robot_context.get('continue', '')),
+        robot_context['robot_mood'] if 'robot_mood' in robot_context and robot_context['robot_mood'] else 'neutral',
+        text_response
+    )
+
+
+
+class SpeechSegments:
+    '''
+    Audio of a reply synthesized sentence by sentence. The TTS request of each sentence is
+    submitted as soon as the sentence is added, so they are all in flight at once; iterating
+    yields the audio segments in order, each one as soon as it is ready.
+    Sentences can keep being added (e.g. while the LLM is generating) until finish() is called.
+    submit(sentence) starts the TTS of a sentence and returns a future of its audio
+    (by default speech_router.text_to_speech on the executor).
+    '''
+    def __init__(self, text=None, executor=tts_executor, submit=None):
+        self.submit = submit or (lambda sentence: executor.submit(speech_router.text_to_speech, sentence))
+        self.sentences = []
+        self.futures = []
+        self.finished = False
+        self.cancelled = False
+        self.error = None
+        self.condition = Condition()
+
+        if text is not None:
+            for sentence in split_sentences(text):
+                self.add(sentence)
+            self.finish()
+
+    def add(self, sentence):
+        with self.condition:
+            if self.cancelled:
+                return
+            self.sentences.append(sentence)
+            self.futures.append(self.submit(sentence))
+            self.condition.notify_all()
+
+    def finish(self, error=None):
+        # No more sentences. If the text source failed, iterating raises the error after the last segment
+        with self.condition:
+            self.finished = True
+            self.error = error
+            self.condition.notify_all()
+
+    def _future(self, index, timeout=None):
+        with self.condition:
+            self.condition.wait_for(lambda: index < len(self.futures) or self.finished, timeout)
+            if index < len(self.futures):
+                return self.futures[index]
+            if self.error is not None:
+                raise self.error
+            return None
+
+    def head(self, timeout=None):
+        # Audio of the first sentence (waits for it)
+        future = self._future(0, timeout)
+        return future.result(timeout) if future is not None else b''
+
+    def cancel(self):
+        # Drop the requests that have not started yet (e.g. playback cut by the user)
+        with self.condition:
+            self.cancelled = True
+            futures = list(self.futures)
+        for future in futures:
+            future.cancel()
+
+    def __iter__(self):
+        index = 0
+        while True:
+            future = self._future(index)
+            if future is None:
+                return
+            yield future.result()
+            index += 1
+
+    def __bytes__(self):
+        return b''.join(self)
+
+    @property
+    def text(self):
+        return ' '.join(self.sentences)
+
+
+def pipelined_text_to_speech(text):
+    # Submit the TTS of every sentence and return once the first one is ready to be played
+    start_time = time.time()
+    audio = SpeechSegments(text)
+    audio.head()
+    logger.info(f"TTS first segment obtained in {time.time() - start_time:.2f} seconds ({len(audio.sentences)} segments)")
+    return audio
+
+def streaming_text_to_speech(input_text, context_variables):
+    # Stream the LLM response in background, sending each sentence to TTS as soon as it is complete.
+    # Returns once the first segment is ready to be played
+    start_time = time.time()
+    audio = SpeechSegments()
+    robot_context = {}
+
+    def consume():
+        try:
+            for event, data in generate_response_stream(input_text, context_variables):
+                if event == 'context':
+                    robot_context.update(data)
+                elif event == 'sentence':
+                    if not audio.sentences:
+                        logger.info(f'LLM first sentence generated in {time.time() - start_time:.2f} seconds')
+                    audio.add(data)
+                elif event == 'end':
+                    text_response, context = data
+                    robot_context.update(context)
+                    logger.info(f'LLM response generated in {time.time() - start_time:.2f} seconds')
+                    logger.info(f'Response text :: {text_response}')
+                    logger.info(f'Response context :: {context}')
+        except Exception as e:
+            logger.error(f'Could not generate streaming response. {str(e)}')
+            audio.finish(e)
+        else:
+            audio.finish()
+
+    Thread(target=consume, daemon=True).start()
+
+    audio.head()
+    logger.info(f"TTS first segment obtained in {time.time() - start_time:.2f} seconds (streaming LLM)")
+    return audio.text, dict(robot_context), audio
+
+def generate_speech_response(input_text, context_variables):
+    """
+    LLM + TTS. Returns once the first audio segment of the response is ready.
+
+    Returns:
+        tuple: (response text, robot context, SpeechSegments). With LLM_STREAMING the text
+        is the part generated so far; the rest keeps arriving to the audio segments.
+    """
+    if LLM_STREAMING:
+        return streaming_text_to_speech(input_text, context_variables)
+
+    start_time = time.time()
+    text_response, robot_context = generate_response(input_text, context_variables)
+    logger.info(f'LLM response generated in {time.time() - start_time:.2f} seconds')
+    logger.info(f'Response text :: {text_response}')
+    logger.info(f'Response context :: {robot_context}')
+
+    return text_response, robot_context, pipelined_text_to_speech(text_response)
+
 
 def query(request: Request):
     """
@@ -39,7 +210,7 @@ def query(request: Request):
     """
     # STT
     start_time = time.time()
-    request.text = speech_to_text(request.audio)
+    request.text = speech_router.speech_to_text(request.audio)
     logger.info(f"STT result ({time.time() - start_time:.2f} seconds) :: '{request.text}'")
     
     if not request.text:
@@ -51,32 +222,15 @@ def query(request: Request):
     context_variables["proactive_question"] = request.proactive_question 
     logger.info(f'Query context :: {context_variables}')
 
-    # Generate the response
-    start_time = time.time()
-    text_response, robot_context = generate_response(request.text, context_variables)
-    logger.info(f'LLM response generated in {time.time() - start_time:.2f} seconds')
-    logger.info(f'Response text :: {text_response}')
-    logger.info(f'Response context :: {robot_context}')
+    # Generate the response (LLM + TTS)
+    text_response, robot_context, audio_response = generate_speech_response(request.text, context_variables)
 
     # Check if LLM response text robot is empty
     if not text_response:
         return None
 
-    # TTS
-    start_time = time.time()
-    audio_response = text_to_speech(text_response)
-    logger.info(f"TTS result obtained (response generated in {time.time() - start_time:.2f} seconds)")
-
     # Send back the response
-    return Response(
-        request,
-        audio_response,
-        robot_context.get('action', None),
-        robot_context.get('username', None),
-        bool(robot_context.get('continue', '')),
-        robot_context['robot_mood'] if 'robot_mood' in robot_context and robot_context['robot_mood'] else 'neutral',
-        text_response
-    )
+    return build_response(request, text_response, robot_context, audio_response)
 
 def query_with_text(request: Request):
     """Process query with text already transcribed LLM + TTS"""
@@ -91,46 +245,42 @@ def query_with_text(request: Request):
     context_variables["proactive_question"] = request.proactive_question 
     logger.info(f'Query context :: {context_variables}')
 
-    # Generate the response
-    start_time = time.time()
-    text_response, robot_context = generate_response(request.text, context_variables)
-    logger.info(f'LLM response generated in {time.time() - start_time:.2f} seconds')
-    logger.info(f'Response text :: {text_response}')
-    logger.info(f'Response context :: {robot_context}')
+    # Generate the response (LLM + TTS), reusing the speculative one if it was started on the same transcript
+    speculative_response = speculation.take(request)
+    if speculative_response is not None:
+        text_response, robot_context, audio_response = speculative_response
+    else:
+        text_response, robot_context, audio_response = generate_speech_response(request.text, context_variables)
 
     # Check if LLM response text robot is empty
     if not text_response:
         return None
 
-    # TTS
-    start_time = time.time()
-    audio_response = text_to_speech(text_response)
-    logger.info(f"TTS result obtained (response generated in {time.time() - start_time:.2f} seconds)")
-
     # Send back the response
-    return Response(
-        request,
-        audio_response,
-        robot_context.get('action', None),
-        robot_context.get('username', None),
-        bool(robot_context.get('continue', '')),
-        robot_context['robot_mood'] if 'robot_mood' in robot_context and robot_context['robot_mood'] else 'neutral',
-        text_response
-    )
+    return build_response(request, text_response, robot_context, audio_response)
 
 
-def streaming_stt(audio_generator):
+def streaming_stt(audio_generator, on_result=None, speculate=None, speech_duration=None):
     """
     Perform only streaming STT
     This is used to get the transcript quickly while maintaining proper state synchronization
     
     Args:
         audio_generator: Generator that yields audio chunks from the microphone
+        on_result: Optional callback on_result(transcript, is_final) for interim and final results
+        speculate: Optional Request (username, proactive_question) to start the response speculatively
+                   on the interim transcripts (reused by query_with_text if the final transcript matches)
+        speech_duration: Optional function returning the duration of the speech of the utterance
+                         (Recorder.speech_duration), once the audio has ended
         
     Returns:
         str: Transcript from streaming STT, or empty string if no speech detected
     """
-    transcript, silence_detection_time = compose_streaming_fallback_speech_to_text(audio_generator)
+    if speculate is not None:
+        speculation.begin(speculate)
+        on_result = speculation.result_handler(on_result)
+
+    transcript, silence_detection_time = speech_router.streaming_speech_to_text(audio_generator, on_result, speech_duration)
     
     if silence_detection_time is not None:
         logger.info(f"Streaming STT result (silence detection: {silence_detection_time:.3f} seconds) :: '{transcript}'")
@@ -140,7 +290,231 @@ def streaming_stt(audio_generator):
     return transcript
 
 
+def conversation_fingerprint(history, request: Request):
+    # Identifies the input of a proactive response: it is only valid for the same history and user context
+    data = json.dumps([history, request.username, request.proactive_question], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+def pregenerate_proactive_query(request: Request):
+    """
+    Prepare the response (LLM + TTS) of a proactive question before it is due, without
+    modifying the conversation history. proactive_query uses it if the history and the
+    user context have not changed in the meantime.
+    """
+    try:
+        start_time = time.time()
+        history = read_conversation_history(request.username)
+
+        context_variables = {}
+        context_variables["username"] = request.username
+        context_variables["proactive_question"] = request.proactive_question
+
+        text_response, robot_context, exchange = generate_response('', context_variables, history=history, commit=False)
+        audio_response = SpeechSegments(text_response)
+        audio_response.head()
+
+        response = build_response(request, text_response, robot_context, audio_response)
+
+        with pregenerated_lock:
+            previous = pregenerated_responses.get((request.username, request.proactive_question))
+            pregenerated_responses[(request.username, request.proactive_question)] = (
+                conversation_fingerprint(history, request), time.time(), response, exchange)
+        if previous is not None:
+            discard_pregenerated_response(previous, 'superseded')
+
+        logger.info(f"Proactive response pre-generated in {time.time() - start_time:.2f} seconds ({request.username}, {request.proactive_question}) :: {text_response}")
+
+    except Exception as e:
+        logger.warning(f'Could not pre-generate proactive response. {str(e)}')
+
+def discard_pregenerated_response(entry, reason):
+    logger.info(f'Pre-generated proactive response discarded ({reason})')
+    entry[2].audio.cancel() # TTS requests of the sentences not started yet are not sent
+
+def take_pregenerated_response(request: Request):
+    # Pre-generated response for the request if it is still valid for the loaded conversation history
+    with pregenerated_lock:
+        entry = pregenerated_responses.pop((request.username, request.proactive_question), None)
+
+    if entry is None:
+        return None
+
+    fingerprint, created_time, response, exchange = entry
+    if fingerprint != conversation_fingerprint(get_full_conversation_history(), request):
+        discard_pregenerated_response(entry, 'conversation history or context changed')
+        return None
+    if time.time() - created_time > PREGENERATED_MAX_AGE:
+        discard_pregenerated_response(entry, 'too old')
+        return None
+
+    commit_conversation(restamp_exchange(exchange)) # Stamped when it is asked, not when it was generated
+    response.request = request
+    return response
+
+class Speculation:
+    '''
+    Speculative response generation. While the user is talking, once an interim transcript has
+    been stable for stable_time seconds, the response (LLM and optionally TTS) is generated on it
+    without committing the conversation history. If the final transcript matches, the response is
+    reused; otherwise it is discarded.
+    '''
+    def __init__(self, stable_time=0.6, tts=False, executor=None):
+        self.stable_time = stable_time
+        self.tts = tts # Also synthesize the speculative response
+        self.executor = executor or ThreadPoolExecutor(max_workers=2)
+
+        self.lock = Lock()
+        self.request = None # Context of the current turn
+        self.timer = None
+        self.transcript = '' # Last interim transcript (normalized)
+        self.speculative = None # (transcript, fingerprint, start time, future)
+
+        self.stats = {'started': 0, 'hits': 0, 'misses': 0, 'errors': 0, 'saved_ms': 0.0}
+
+    @staticmethod
+    def normalize(transcript):
+        # Interim and final transcripts may differ in case and punctuation
+        return ' '.join(re.sub(r'[^\w\s]', ' ', transcript.lower()).split())
+
+    def begin(self, request: Request):
+        # New user turn: discard any previous speculation
+        with self.lock:
+            self._discard()
+            self.request = request
+            self.transcript = ''
+
+    def result_handler(self, on_result=None):
+        # STT result callback that feeds the speculation and then calls on_result
+        def handler(transcript, is_final):
+            self.on_stt_result(transcript, is_final)
+            if on_result is not None:
+                on_result(transcript, is_final)
+        return handler
+
+    def on_stt_result(self, transcript, is_final):
+        if is_final:
+            return
+
+        transcript = self.normalize(transcript)
+        with self.lock:
+            if self.request is None or not transcript or transcript == self.transcript:
+                return
+
+            # Transcript changed: wait for it to be stable again
+            self.transcript = transcript
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = Timer(self.stable_time, self._speculate, args=(transcript,))
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _speculate(self, transcript):
+        with self.lock:
+            if transcript != self.transcript or self.request is None:
+                return # Changed meanwhile
+            if self.speculative is not None and self.speculative[0] == transcript:
+                return # Already running on this transcript
+
+            self._discard()
+            history = get_full_conversation_history()
+            request = Request(text=transcript, username=self.request.username, proactive_question=self.request.proactive_question)
+            future = self.executor.submit(self._generate, request, history)
+            self.speculative = (transcript, conversation_fingerprint(history, request), time.time(), future)
+            self.stats['started'] += 1
+
+        logger.info(f"Speculative response started on interim transcript :: '{transcript}'")
+
+    def _generate(self, request: Request, history):
+        context_variables = {}
+        context_variables["username"] = request.username
+        context_variables["proactive_question"] = request.proactive_question
+
+        text_response, robot_context, exchange = generate_response(request.text, context_variables, history=history, commit=False)
+        audio_response = SpeechSegments(text_response) if self.tts else None
+        return text_response, robot_context, exchange, audio_response, time.time()
+
+    def _discard(self):
+        # Cancel the current speculation (if it is already running, its result is ignored)
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        if self.speculative is not None:
+            self._cancel(self.speculative[3])
+            self.speculative = None
+
+    @staticmethod
+    def _cancel(future):
+        # Not started yet: cancelled. Running: its speculative TTS requests are cancelled when it finishes
+        def cancel_audio(future):
+            if not future.cancelled() and future.exception() is None and future.result()[3] is not None:
+                future.result()[3].cancel()
+
+        if not future.cancel():
+            future.add_done_callback(cancel_audio)
+
+    def take(self, request: Request):
+        """
+        Speculative response for the final transcript of the turn, if it matches the speculation.
+
+        Returns:
+            tuple: (response text, robot context, SpeechSegments) or None
+        """
+        take_time = time.time()
+        with self.lock:
+            speculative = self.speculative
+            self.speculative = None
+            self.request = None
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+        if speculative is None:
+            return None
+
+        transcript, fingerprint, start_time, future = speculative
+        if transcript != self.normalize(request.text) or fingerprint != conversation_fingerprint(get_full_conversation_history(), request):
+            self._cancel(future)
+            self.stats['misses'] += 1
+            logger.info(f"Speculative response discarded ('{transcript}' != '{self.normalize(request.text)}') :: {self.get_stats()}")
+            return None
+
+        try:
+            text_response, robot_context, exchange, audio_response, end_time = future.result()
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.warning(f'Speculative response failed. {str(e)}')
+            return None
+
+        commit_conversation(exchange)
+        if audio_response is None:
+            audio_response = pipelined_text_to_speech(text_response)
+
+        # Time already spent on the response when the final transcript arrived
+        self.stats['hits'] += 1
+        self.stats['saved_ms'] += (min(take_time, end_time) - start_time) * 1000
+        logger.info(f'Speculative response reused ({(min(take_time, end_time) - start_time) * 1000:.0f} ms saved) :: {self.get_stats()}')
+        logger.info(f'Response text :: {text_response}')
+        logger.info(f'Response context :: {robot_context}')
+
+        return text_response, robot_context, audio_response
+
+    def get_stats(self):
+        resolved = self.stats['hits'] + self.stats['misses'] + self.stats['errors']
+        return {**self.stats,
+                'hit_rate': self.stats['hits'] / resolved if resolved else 0.0,
+                'mean_saved_ms': self.stats['saved_ms'] / self.stats['hits'] if self.stats['hits'] else 0.0}
+
+speculation = Speculation() # Used by streaming_stt (opt-in, speculate argument) and query_with_text
+
+
 def proactive_query(request: Request):
+    # Use the response prepared in advance if it is still valid
+    response = take_pregenerated_response(request)
+    if response is not None:
+        logger.info(f'Using pre-generated proactive response :: {response.text}')
+        return response
+
     # Same as query but with empty input_text and without STT
     # Set context variables
     context_variables = {}
@@ -148,28 +522,11 @@ def proactive_query(request: Request):
     context_variables["proactive_question"] = request.proactive_question 
     logger.info(f'Query context :: {context_variables}')
 
-    # Generate the response
-    start_time = time.time()
-    text_response, robot_context = generate_response('', context_variables) # Empty input_text since it's a proactive question
-    logger.info(f'LLM response generated in {time.time() - start_time:.2f} seconds')
-    logger.info(f'Response text :: {text_response}')
-    logger.info(f'Response context :: {robot_context}')
-
-    # TTS
-    start_time = time.time()
-    audio_response = text_to_speech(text_response)
-    logger.info(f"TTS result obtained (response generated in {time.time() - start_time:.2f} seconds)")
+    # Generate the response (LLM + TTS)
+    text_response, robot_context, audio_response = generate_speech_response('', context_variables) # Empty input_text since it's a proactive question
 
     # Send back the response
-    return Response(
-        request,
-        audio_response,
-        robot_context.get('action', None),
-        robot_context.get('username', None),
-        bool(robot_context.get('continue', '')),
-        robot_context['robot_mood'] if 'robot_mood' in robot_context and robot_context['robot_mood'] else 'neutral',
-        text_response
-    )
+    return build_response(request, text_response, robot_context, audio_response)
 
 def load_conversation_db(username):
     # Load conversation history for the user
@@ -183,3 +540,45 @@ def dump_conversation_db(username):
     clear_conversation_history() # Clear conversation history in-RAM
 
     logger.info(f'Conversation history of {username} updated to file database')
+
+def warm_up_tts():
+    # Pre-synthesize frequent phrases so that they skip the TTS stage
+    start_time = time.time()
+    warmed = warm_up_tts_cache()
+    logger.info(f'TTS cache warmed up with {warmed} phrases in {time.time() - start_time:.2f} seconds :: {tts_cache.get_stats()}')
+
+def warm_up_speech_backends():
+    # Load the on-device speech models in background (they are used while the cloud is down)
+    speech_router.warm_up()
+
+def get_speech_backend_stats():
+    return speech_router.get_stats()
+
+def get_tts_cache_stats():
+    return tts_cache.get_stats()
+
+# Cloud connections kept warm while someone is in the room
+connection_warmer = ConnectionWarmer({
+    'stt': probe_stt_connection,
+    'tts': probe_tts_connection,
+    'llm': probe_llm_connection
+})
+
+def get_connection_stats():
+    return connection_stats.get_stats()
+
+def get_hedging_stats():
+    return {'tts': tts_hedger.get_stats(), 'llm': llm_hedger.get_stats(), 'llm_stream': llm_stream_hedger.get_stats()}
+
+def get_stt_race_stats():
+    return stt_race_stats.get_stats()
+
+# Circuit breakers of the cloud services, so that the state machine can fall back immediately
+circuit_breakers = {'google': google_breaker, 'openai': openai_breaker}
+
+def cloud_available():
+    # False while any cloud service is considered down (queries would fail immediately)
+    return all(breaker.available for breaker in circuit_breakers.values())
+
+def get_circuit_states():
+    return {name: breaker.get_stats() for name, breaker in circuit_breakers.items()}
@@ -0,0 +1,525 @@
+'''
+Pluggable STT/TTS backends. The server talks to the speech services through speech_router,
+which picks, among the registered backends, the one with the lowest expected latency for
+each request:
+    - google: Google Cloud STT/TTS (google_api.py)
+    - local: on-device Vosk STT and Piper TTS, loaded on first use from model files in
+      files/models/. Used for short command-like utterances (raced with the cloud streaming
+      recognition), or while the cloud is unavailable
+
+A backend transcribes 16 kHz LINEAR16 audio (batch or streaming) and synthesizes 24 kHz
+LINEAR16 audio (speaker format), with the same signatures as the google_api functions.
+'''
+import asyncio
+import json
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, Future, InvalidStateError, ThreadPoolExecutor, wait
+from threading import Lock
+
+import numpy as np
+
+from .google_api import (speech_to_text, speech_to_text_async, text_to_speech, text_to_speech_async,
+                         compose_streaming_fallback_speech_to_text, compose_streaming_fallback_speech_to_text_async,
+                         google_breaker, tts_cache, tts_config, voice, STT_BYTES_PER_SECOND)
+from .hedging import LatencyTracker
+
+logger = logging.getLogger('Server')
+
+SHORT_UTTERANCE = 2.0 # Utterances up to this duration (sec) are short, command-like ones ("sí", "no", "para")
+
+
+class SpeechBackend(ABC):
+    name = None
+    caches_tts = False # text_to_speech already goes through the TTS cache
+
+    @abstractmethod
+    def available(self, operation):
+        ''' Whether the backend can serve the operation now '''
+
+    def suits(self, operation, audio_duration=None):
+        # Whether the backend should be used for the request while the others are available too
+        return True
+
+    def warm_up(self):
+        pass
+
+    @abstractmethod
+    def speech_to_text(self, audio_bytes):
+        ''' Transcript of a complete utterance '''
+
+    @abstractmethod
+    def streaming_speech_to_text(self, audio_generator, on_result=None, speech_duration=None, caller_races=None):
+        '''
+        (transcript, silence_detection_time) of the audio chunks of an utterance, as they are captured.
+        speech_duration: optional function returning the duration of the speech once the audio has ended
+        caller_races: optional function returning, once the audio has ended, whether the caller races
+            another recognition of the utterance (the backend then does not race its own)
+        '''
+
+    @abstractmethod
+    def streaming_speech_to_text_async(self, audio_chunks, on_result=None, speech_duration=None, caller_races=None):
+        ''' asyncio variant of streaming_speech_to_text (audio_chunks is an async iterable) '''
+
+    @abstractmethod
+    def text_to_speech(self, text):
+        ''' Audio of the text in the speaker format '''
+
+    async def speech_to_text_async(self, audio_bytes):
+        return await asyncio.to_thread(self.speech_to_text, audio_bytes)
+
+    async def text_to_speech_async(self, text):
+        return await asyncio.to_thread(self.text_to_speech, text)
+
+
+class GoogleSpeechBackend(SpeechBackend):
+    name = 'google'
+    caches_tts = True
+
+    def available(self, operation):
+        return google_breaker.available
+
+    def speech_to_text(self, audio_bytes):
+        return speech_to_text(audio_bytes)
+
+    def streaming_speech_to_text(self, audio_generator, on_result=None, speech_duration=None, caller_races=None):
+        return compose_streaming_fallback_speech_to_text(audio_generator, on_result, speech_duration, caller_races)
+
+    def text_to_speech(self, text):
+        return text_to_speech(text)
+
+    async def speech_to_text_async(self, audio_bytes):
+        return await speech_to_text_async(audio_bytes)
+
+    async def streaming_speech_to_text_async(self, audio_chunks, on_result=None, speech_duration=None, caller_races=None):
+        return await compose_streaming_fallback_speech_to_text_async(audio_chunks, on_result, speech_duration, caller_races)
+
+    async def text_to_speech_async(self, text):
+        return await text_to_speech_async(text)
+
+
+class VoskStream:
+    ''' Streaming recognition of an utterance with a Vosk recognizer '''
+    def __init__(self, recognizer, on_result=None):
+        self.recognizer = recognizer
+        self.on_result = on_result
+        self.segments = [] # Final results of the utterance (Vosk splits it at pauses)
+        self.last_partial_time = None
+
+    def accept(self, audio_chunk):
+        if self.recognizer.AcceptWaveform(audio_chunk):
+            self.segments.append(json.loads(self.recognizer.Result())['text'])
+            return
+
+        partial = json.loads(self.recognizer.PartialResult())['partial']
+        if partial:
+            self.last_partial_time = time.time()
+            if self.on_result is not None:
+                self.on_result(' '.join(self.segments + [partial]).strip(), False)
+
+    def finish(self):
+        self.segments.append(json.loads(self.recognizer.FinalResult())['text'])
+        transcript = ' '.join(segment for segment in self.segments if segment)
+        silence_detection_time = time.time() - self.last_partial_time if self.last_partial_time is not None else 0.0
+
+        if self.on_result is not None:
+            self.on_result(transcript, True)
+        return transcript, silence_detection_time
+
+
+def resample_pcm(pcm, from_rate, to_rate):
+    # 16-bit mono PCM linear resampling
+    if from_rate == to_rate:
+        return pcm
+    samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+    positions = np.arange(int(samples.size * to_rate / from_rate)) * from_rate / to_rate
+    return np.interp(positions, np.arange(samples.size), samples).astype(np.int16).tobytes()
+
+
+class LocalSpeechBackend(SpeechBackend):
+    '''
+    On-device engine: Vosk STT and Piper TTS, loaded from the model files on first use.
+    While the cloud is available it only takes short utterances: batch ones, and streamed
+    ones in a race with the cloud recognition (its accuracy drops on long free-form speech,
+    and its voice is not the cloud one)
+    '''
+    name = 'local'
+
+    def __init__(self, stt_model='files/models/vosk-model-small-es-0.42', tts_model='files/models/es_ES-sharvard-medium.onnx',
+                 max_stt_duration=SHORT_UTTERANCE, rate=16000):
+        self.stt_model_path = stt_model
+        self.tts_model_path = tts_model
+        self.max_stt_duration = max_stt_duration # Longest utterance (sec) it takes while the cloud is available
+        self.rate = rate
+
+        self.lock = Lock()
+        self.stt_model = None
+        self.voice = None
+        self.failed = set() # Operations whose engine could not be loaded
+
+    def available(self, operation):
+        if operation in self.failed:
+            return False
+        if operation == 'tts':
+            return os.path.isfile(self.tts_model_path)
+        return os.path.isdir(self.stt_model_path)
+
+    def suits(self, operation, audio_duration=None):
+        return operation == 'stt' and audio_duration is not None and audio_duration <= self.max_stt_duration
+
+    def warm_up(self):
+        # Load the models in advance (the first load takes seconds on the Pi)
+        if self.available('stt'):
+            self._recognizer()
+        if self.available('tts'):
+            self._voice()
+
+    def _load(self, operation, loader):
+        try:
+            return loader()
+        except Exception as e:
+            self.failed.update(('stt', 'streaming_stt') if operation == 'stt' else (operation,))
+            logger.error(f"Could not load local {operation} engine. {str(e)}")
+            raise
+
+    def _recognizer(self):
+        with self.lock:
+            if self.stt_model is None:
+                def load():
+                    from vosk import Model, SetLogLevel
+                    SetLogLevel(-1)
+                    return Model(self.stt_model_path)
+                self.stt_model = self._load('stt', load)
+                logger.info(f'Local STT model loaded :: {self.stt_model_path}')
+
+        from vosk import KaldiRecognizer
+        return KaldiRecognizer(self.stt_model, self.rate)
+
+    def _voice(self):
+        with self.lock:
+            if self.voice is None:
+                def load():
+                    from piper import PiperVoice
+                    return PiperVoice.load(self.tts_model_path)
+                self.voice = self._load('tts', load)
+                logger.info(f'Local TTS voice loaded :: {self.tts_model_path}')
+        return self.voice
+
+    def speech_to_text(self, audio_bytes):
+        stream = VoskStream(self._recognizer())
+        stream.accept(audio_bytes)
+        return stream.finish()[0]
+
+    def streaming_speech_to_text(self, audio_generator, on_result=None, speech_duration=None, caller_races=None):
+        stream = VoskStream(self._recognizer(), on_result)
+        for audio_chunk in audio_generator:
+            stream.accept(audio_chunk)
+        return stream.finish()
+
+    async def streaming_speech_to_text_async(self, audio_chunks, on_result=None, speech_duration=None, caller_races=None):
+        stream = VoskStream(await asyncio.to_thread(self._recognizer), on_result)
+        async for audio_chunk in audio_chunks:
+            await asyncio.to_thread(stream.accept, audio_chunk)
+        return await asyncio.to_thread(stream.finish)
+
+    def text_to_speech(self, text):
+        voice = self._voice()
+        audio = b''.join(voice.synthesize_stream_raw(text))
+        return resample_pcm(audio, voice.config.sample_rate, tts_config.sample_rate_hertz)
+
+
+# Registry of the available implementations, by name
+backends = {}
+
+def register_backend(backend):
+    backends[backend.name] = backend
+    return backend
+
+
+class ShortUtteranceRace:
+    '''
+    Batch recognition of a backend that suits short utterances (the local engine), raced with
+    the streaming recognition: at the end of the audio, if the speech is short, it is
+    recognized by both and the first non-empty transcript wins. Once the racer has won,
+    late streaming results are not passed to on_result anymore.
+    The speech duration comes from speech_duration() (e.g. Recorder.speech_duration) if given:
+    the audio also has the pre-roll and the trailing silence
+    '''
+    def __init__(self, racer, on_result=None, speech_duration=None):
+        self.racer = racer
+        self.on_result = on_result
+        self.speech_duration = speech_duration
+        self.collected = []
+        self.audio_end = None # Time the audio ended
+        self.audio_duration = 0.0 # Duration of the audio received (sec)
+        self.duration = None # Speech duration (sec), known at the end of the audio
+        self.raced = False # The racer recognizes the utterance
+        self.decided = False # The racer won
+
+    def result_handler(self, transcript, is_final):
+        if not self.decided and self.on_result is not None:
+            self.on_result(transcript, is_final)
+
+    def collect(self, audio_chunk):
+        self.audio_duration += len(audio_chunk) / STT_BYTES_PER_SECOND
+        if self.racer is not None:
+            self.collected.append(audio_chunk)
+
+    def end(self):
+        # End of the audio. Returns the audio to race with, or None
+        self.audio_end = time.monotonic()
+        self.duration = self.speech_duration() if self.speech_duration is not None else None
+        if self.duration is None:
+            self.duration = self.audio_duration
+        self.raced = self.racer is not None and self.duration <= SHORT_UTTERANCE
+        return b''.join(self.collected) if self.raced else None
+
+    def latency_key(self):
+        return latency_key('streaming_stt', self.duration)
+
+
+def latency_key(operation, audio_duration=None):
+    # Latencies of short utterances are tracked apart (e.g. the local engine only takes those)
+    if audio_duration is not None and audio_duration <= SHORT_UTTERANCE:
+        return f'{operation}_short'
+    return operation
+
+
+def settle(future, result):
+    # Set the result of a future unless it already has one
+    try:
+        future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+class SpeechRouter:
+    '''
+    Sends each STT/TTS request to the backend with the lowest expected latency (median of
+    its recent latencies for the operation and utterance length) among the available
+    backends that suit the request. Backends not measured yet for it are tried first, so
+    that they are compared on measured latencies only. If none suits it, any available
+    backend is used (e.g. the local engine while the cloud is down); if none is available,
+    the first registered one (which fails fast).
+    Short streamed utterances are also raced with a faster (or not measured yet) batch
+    backend, see ShortUtteranceRace. This is the only race of those: the streaming backend
+    does not race its own batch recognition of the utterances raced here (caller_races).
+    '''
+    def __init__(self, backends, window=50, min_samples=5):
+        self.backends = backends
+        self.window = window
+        self.min_samples = min_samples
+        self.latencies = {} # (backend, latency key) -> LatencyTracker
+        self.lock = Lock()
+        self.stats = {}
+        self.executor = ThreadPoolExecutor(max_workers=4) # Streaming recognition and its racer
+
+    def _tracker(self, backend, key):
+        with self.lock:
+            return self.latencies.setdefault((backend.name, key), LatencyTracker(self.window))
+
+    def expected_latency(self, backend, key):
+        # Median latency, None until measured enough
+        tracker = self._tracker(backend, key)
+        if len(tracker) < self.min_samples:
+            return None
+        return tracker.percentile(0.5)
+
+    def select(self, operation, audio_duration=None):
+        candidates = [backend for backend in self.backends.values() if backend.available(operation)]
+        suitable = [backend for backend in candidates if backend.suits(operation, audio_duration)]
+        pool = suitable or candidates
+        if not pool:
+            return next(iter(self.backends.values()))
+
+        key = latency_key(operation, audio_duration)
+        unmeasured = [backend for backend in pool if self.expected_latency(backend, key) is None]
+        if unmeasured:
+            return min(unmeasured, key=lambda backend: len(self._tracker(backend, key)))
+        return min(pool, key=lambda backend: self.expected_latency(backend, key))
+
+    def short_racer(self, backend):
+        # Backend to race with the streaming one on short utterances, if any is expected to be faster
+        streaming_latency = self.expected_latency(backend, 'streaming_stt_short')
+        for other in self.backends.values():
+            if other is backend or not other.available('stt') or not other.suits('stt', SHORT_UTTERANCE):
+                continue
+            latency = self.expected_latency(other, 'stt_short')
+            if streaming_latency is None or latency is None or latency < streaming_latency:
+                return other
+        return None
+
+    def _record(self, backend, key, latency=None):
+        # Latency of a successful request, None if it failed
+        with self.lock:
+            stats = self.stats.setdefault(f'{backend.name}.{key}', {'requests': 0, 'errors': 0})
+            stats['requests'] += 1
+            if latency is None:
+                stats['errors'] += 1
+        if latency is not None:
+            self._tracker(backend, key).add(latency)
+
+    def _run(self, backend, key, function, *args):
+        start = time.monotonic()
+        try:
+            result = function(*args)
+        except Exception:
+            self._record(backend, key)
+            raise
+        self._record(backend, key, time.monotonic() - start)
+        return result
+
+    async def _run_async(self, backend, key, coroutine):
+        start = time.monotonic()
+        try:
+            result = await coroutine
+        except Exception:
+            self._record(backend, key)
+            raise
+        self._record(backend, key, time.monotonic() - start)
+        return result
+
+    def speech_to_text(self, audio_bytes):
+        duration = len(audio_bytes) / STT_BYTES_PER_SECOND
+        backend = self.select('stt', duration)
+        return self._run(backend, latency_key('stt', duration), backend.speech_to_text, audio_bytes)
+
+    async def speech_to_text_async(self, audio_bytes):
+        duration = len(audio_bytes) / STT_BYTES_PER_SECOND
+        backend = self.select('stt', duration)
+        return await self._run_async(backend, latency_key('stt', duration), backend.speech_to_text_async(audio_bytes))
+
+    def _cached_speech(self, backend, text):
+        # A backend without the TTS cache (e.g. the local voice while the cloud is down) only
+        # synthesizes phrases that are not cached: cache hits keep the cloud voice and work offline
+        if backend.caches_tts:
+            return None
+        return tts_cache.get(tts_cache.key(text, voice, tts_config))
+
+    def text_to_speech(self, text):
+        backend = self.select('tts')
+        audio = self._cached_speech(backend, text)
+        if audio is not None:
+            return audio
+        return self._run(backend, 'tts', backend.text_to_speech, text)
+
+    async def text_to_speech_async(self, text):
+        backend = self.select('tts')
+        audio = self._cached_speech(backend, text)
+        if audio is not None:
+            return audio
+        return await self._run_async(backend, 'tts', backend.text_to_speech_async(text))
+
+    def _record_streaming(self, backend, race, error=None):
+        # Latency measured from the end of the audio (the utterance length is up to the user)
+        if error is not None or race.audio_end is None:
+            self._record(backend, race.latency_key())
+        else:
+            self._record(backend, race.latency_key(), time.monotonic() - race.audio_end)
+
+    def streaming_speech_to_text(self, audio_generator, on_result=None, speech_duration=None):
+        backend = self.select('streaming_stt')
+        race = ShortUtteranceRace(self.short_racer(backend), on_result, speech_duration)
+        racer = Future() # Racer transcript ('' if empty or failed), None if not raced
+
+        def audio():
+            for audio_chunk in audio_generator:
+                race.collect(audio_chunk)
+                yield audio_chunk
+            audio_bytes = race.end()
+            if audio_bytes is None or racer.done():
+                settle(racer, None)
+                return
+            recognition = self.executor.submit(self._run, race.racer, 'stt_short', race.racer.speech_to_text, audio_bytes)
+            recognition.add_done_callback(lambda future: settle(racer, '' if future.exception() else future.result()))
+
+        streaming = self.executor.submit(backend.streaming_speech_to_text, audio(), race.result_handler,
+                                         speech_duration, lambda: race.raced)
+        # Recorded even if it loses (the streaming call cannot be cancelled from here)
+        streaming.add_done_callback(lambda future: self._record_streaming(backend, race, future.exception()))
+
+        pending = {streaming, racer}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            if streaming in done:
+                if streaming.exception() is None and streaming.result()[0]:
+                    return streaming.result()
+                if race.audio_end is None:
+                    settle(racer, None) # Streaming ended before the audio did
+            if racer in done and racer.result():
+                race.decided = True
+                logger.info(f'{race.racer.name} speech backend won the short utterance race')
+                return racer.result(), time.monotonic() - race.audio_end
+
+        return streaming.result() # No transcript (or the streaming error)
+
+    async def streaming_speech_to_text_async(self, audio_chunks, on_result=None, speech_duration=None):
+        backend = self.select('streaming_stt')
+        race = ShortUtteranceRace(self.short_racer(backend), on_result, speech_duration)
+        loop = asyncio.get_running_loop()
+        racer = loop.create_future() # Task of the racer, None if not raced
+
+        async def audio():
+            async for audio_chunk in audio_chunks:
+                race.collect(audio_chunk)
+                yield audio_chunk
+            audio_bytes = race.end()
+            if not racer.done():
+                racer.set_result(None if audio_bytes is None else asyncio.create_task(
+                    self._run_async(race.racer, 'stt_short', race.racer.speech_to_text_async(audio_bytes))))
+
+        streaming = asyncio.create_task(backend.streaming_speech_to_text_async(audio(), race.result_handler,
+                                                                               speech_duration, lambda: race.raced))
+        streaming.add_done_callback(lambda task: task.cancelled() or self._record_streaming(backend, race, task.exception()))
+        recognition = None
+
+        try:
+            pending = {streaming, racer}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if streaming in done:
+                    if streaming.exception() is None and streaming.result()[0]:
+                        return streaming.result()
+                    if not racer.done():
+                        racer.set_result(None) # Streaming ended before the audio did
+                        pending.discard(racer)
+                if racer in done and racer.result() is not None:
+                    recognition = racer.result()
+                    pending.add(recognition)
+                if recognition in done and recognition.exception() is None and recognition.result():
+                    race.decided = True
+                    logger.info(f'{race.racer.name} speech backend won the short utterance race')
+                    return recognition.result(), time.monotonic() - race.audio_end
+
+            return streaming.result() # No transcript (or the streaming error)
+        finally:
+            # The loser (or everything, if cancelled) is cancelled
+            for task in (streaming, recognition):
+                if task is not None and not task.done():
+                    task.cancel()
+            if not racer.done():
+                racer.cancel()
+
+    def warm_up(self):
+        for backend in self.backends.values():
+            try:
+                backend.warm_up()
+            except Exception as e:
+                logger.warning(f"Could not warm up {backend.name} speech backend. {str(e)}")
+
+    def get_stats(self):
+        with self.lock:
+            stats = {name: dict(values) for name, values in self.stats.items()}
+        for name, values in stats.items():
+            backend, key = name.split('.')
+            tracker = self.latencies.get((backend, key))
+            latency = tracker.percentile(0.5) if tracker is not None else None
+            values['p50_ms'] = round(latency * 1000) if latency is not None else None
+        return stats
+
+
+register_backend(GoogleSpeechBackend())
+register_backend(LocalSpeechBackend())
+speech_router = SpeechRouter(backends)
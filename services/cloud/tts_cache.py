@@ -0,0 +1,129 @@
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from threading import Lock
+
+logger = logging.getLogger('Server')
+
+
+CACHE_FORMAT = b'pcm-v2' # Stored audio format (bare PCM), so that entries of older formats are not returned
+
+
+class TTSCache:
+    '''
+    Content-addressed cache of synthesized speech. The key is a hash of the text, the voice
+    and the audio config, so changing any of them never returns stale audio.
+    A size-bounded in-memory LRU sits over a persistent on-disk store (one file per key,
+    also size-bounded, least recently used files are removed first).
+    '''
+    def __init__(self, directory='files/tts_cache', max_memory_bytes=32 * 2**20, max_disk_bytes=512 * 2**20):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+
+        self.memory = OrderedDict() # key -> audio, least recently used first
+        self.memory_bytes = 0
+        self.lock = Lock()
+
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'disk_evictions': 0}
+
+        os.makedirs(directory, exist_ok=True)
+        self.disk_bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.name.endswith('.pcm'))
+
+    @staticmethod
+    def key(text, voice, audio_config):
+        digest = hashlib.sha256(CACHE_FORMAT)
+        for part in (text.encode('utf-8'), type(voice).serialize(voice), type(audio_config).serialize(audio_config)):
+            digest.update(len(part).to_bytes(4, 'big'))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.pcm')
+
+    def get(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return self.memory[key]
+
+        try:
+            with open(self._path(key), 'rb') as file:
+                audio = file.read()
+            os.utime(self._path(key)) # Recently used on disk
+        except FileNotFoundError:
+            with self.lock:
+                self.stats['misses'] += 1
+            return None
+
+        with self.lock:
+            self.stats['disk_hits'] += 1
+            self._put_memory(key, audio)
+        return audio
+
+    def put(self, key, audio):
+        path = self._path(key)
+        tmp_path = f'{path}.tmp{os.getpid()}'
+        try:
+            with open(tmp_path, 'wb') as file:
+                file.write(audio)
+            os.replace(tmp_path, path) # Atomic, never a half-written entry
+        except OSError as e:
+            logger.warning(f'Could not store TTS audio in disk cache. {str(e)}')
+        else:
+            with self.lock:
+                self.disk_bytes += len(audio)
+            self._prune_disk()
+
+        with self.lock:
+            self._put_memory(key, audio)
+
+    def _put_memory(self, key, audio):
+        if key in self.memory:
+            self.memory_bytes -= len(self.memory.pop(key))
+        self.memory[key] = audio
+        self.memory_bytes += len(audio)
+
+        while self.memory_bytes > self.max_memory_bytes and len(self.memory) > 1:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+            self.stats['evictions'] += 1
+
+    def _prune_disk(self):
+        if self.disk_bytes <= self.max_disk_bytes:
+            return
+
+        entries = sorted((entry for entry in os.scandir(self.directory) if entry.name.endswith('.pcm')),
+                         key=lambda entry: entry.stat().st_mtime)
+        disk_bytes = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if disk_bytes <= self.max_disk_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            disk_bytes -= size
+            with self.lock:
+                self.stats['disk_evictions'] += 1
+
+        with self.lock:
+            self.disk_bytes = disk_bytes
+
+    def get_or_synthesize(self, text, voice, audio_config, synthesize):
+        # Cached audio for the text, or synthesize(text) and store the result
+        key = self.key(text, voice, audio_config)
+        audio = self.get(key)
+        if audio is None:
+            audio = synthesize(text)
+            if audio:
+                self.put(key, audio)
+        return audio
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, 'memory_entries': len(self.memory), 'memory_bytes': self.memory_bytes,
+                    'disk_bytes': self.disk_bytes}
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import time
+from threading import Event, Lock, Thread
+
+import grpc
+
+logger = logging.getLogger('Server')
+
+
+class ConnectionStats:
+    '''
+    Connection reuse per service: each request is counted as sent on a reused (warm)
+    connection or on a new one (TCP + TLS handshake, or gRPC channel reconnection).
+    '''
+    def __init__(self):
+        self.lock = Lock()
+        self.stats = {}
+
+    def record(self, service, reused, handshake_time=None):
+        with self.lock:
+            stats = self.stats.setdefault(service, {'reused': 0, 'new': 0, 'handshake_ms': 0.0})
+            stats['reused' if reused else 'new'] += 1
+            if handshake_time is not None:
+                stats['handshake_ms'] += handshake_time * 1000
+
+        logger.debug(f"{service} request on {'reused' if reused else 'new'} connection"
+                     + (f' (handshake {handshake_time * 1000:.0f} ms)' if handshake_time is not None else ''))
+
+    def get_stats(self):
+        with self.lock:
+            return {service: dict(stats) for service, stats in self.stats.items()}
+
+connection_stats = ConnectionStats()
+
+
+class GrpcChannelMonitor:
+    '''
+    Tracks the connectivity of a gRPC channel (subscribe callback), so that each request
+    can be counted as reusing a READY channel or having to (re)connect it.
+    '''
+    def __init__(self, service, channel):
+        self.service = service
+        self.channel = channel
+        self.state = None
+        self.connections = 0 # Times the channel became READY
+        self.channel.subscribe(self._on_state)
+
+    def _on_state(self, state):
+        if state == grpc.ChannelConnectivity.READY and self.state != state:
+            self.connections += 1
+        self.state = state
+
+    def on_request(self):
+        # Call before each request of the channel
+        connection_stats.record(self.service, self.state == grpc.ChannelConnectivity.READY)
+
+    def connect(self, timeout=5):
+        # Open the channel (if not ready yet) and wait for it
+        grpc.channel_ready_future(self.channel).result(timeout=timeout)
+
+
+class AsyncGrpcChannelMonitor:
+    ''' GrpcChannelMonitor of a grpc.aio channel (it has no subscribe(): its state is read at each request) '''
+    def __init__(self, service, channel):
+        self.service = service
+        self.channel = channel
+
+    def on_request(self):
+        connection_stats.record(self.service, self.channel.get_state() == grpc.ChannelConnectivity.READY)
+
+    async def connect(self, timeout=5):
+        await asyncio.wait_for(self.channel.channel_ready(), timeout)
+
+
+class HttpConnectionTrace:
+    # httpcore trace callback: a TCP connect means the request did not reuse a pooled connection
+    def __init__(self):
+        self.connect_start = None
+        self.connect_end = None
+
+    def __call__(self, event_name, info):
+        if event_name == 'connection.connect_tcp.started':
+            self.connect_start = time.monotonic()
+        elif event_name in ('connection.start_tls.complete', 'connection.connect_tcp.complete'):
+            self.connect_end = time.monotonic()
+
+class AsyncHttpConnectionTrace(HttpConnectionTrace):
+    # Trace callback of async requests (httpcore awaits it)
+    async def __call__(self, event_name, info):
+        super().__call__(event_name, info)
+
+def http_connection_hooks(service, asynchronous=False):
+    '''
+    httpx event hooks (e.g. for DefaultHttpxClient) that record whether each request of
+    the service reused a pooled connection. asynchronous for httpx.AsyncClient.
+    '''
+    trace_class = AsyncHttpConnectionTrace if asynchronous else HttpConnectionTrace
+
+    def on_request(request):
+        request.extensions['trace'] = trace_class()
+
+    def on_response(response):
+        trace = response.request.extensions.get('trace')
+        if isinstance(trace, HttpConnectionTrace): # Sync or async
+            reused = trace.connect_start is None
+            handshake_time = None if reused or trace.connect_end is None else trace.connect_end - trace.connect_start
+            connection_stats.record(service, reused, handshake_time)
+
+    if asynchronous:
+        async def on_request_async(request):
+            on_request(request)
+
+        async def on_response_async(response):
+            on_response(response)
+
+        return {'request': [on_request_async], 'response': [on_response_async]}
+
+    return {'request': [on_request], 'response': [on_response]}
+
+
+class ConnectionWarmer:
+    '''
+    Keeps the cloud connections warm while someone is around: start() runs every probe
+    (a cheap call per service that opens its connection) and repeats them every interval
+    seconds, so that the first query does not pay for the handshakes, until stop().
+    '''
+    def __init__(self, probes, interval=30):
+        self.probes = probes # service -> probe()
+        self.interval = interval
+
+        self.stop_event = Event()
+        self.stop_event.set()
+        self._thread = None
+
+    def start(self):
+        if not self.stop_event.is_set():
+            return # Already running
+
+        self.stop_event.clear()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            self.warm_up()
+            self.stop_event.wait(self.interval)
+
+    def warm_up(self):
+        for service, probe in self.probes.items():
+            start_time = time.time()
+            try:
+                probe()
+            except Exception as e:
+                logger.warning(f'Could not warm up {service} connection. {str(e)}')
+            else:
+                logger.debug(f'{service} connection warmed up in {(time.time() - start_time) * 1000:.0f} ms')
+
+        logger.info(f'Connections warmed up :: {connection_stats.get_stats()}')
+
+    def stop(self):
+        self.stop_event.set()
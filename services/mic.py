@@ -1,15 +1,263 @@
 import logging
-import queue
+import time
 from collections import deque
-from threading import Event, Thread
+from threading import Condition, Event, Lock, Thread
 
 import pyaudio
 import numpy as np
-from silero_vad import get_speech_timestamps, load_silero_vad
+from silero_vad import get_speech_timestamps
+
+from .vad import load_vad
+
+
+class AudioRingBuffer:
+    '''
+    Fixed-size ring buffer of mono int16 audio, preallocated once.
+    Every sample is written twice (mirrored buffer), so any range of up to `capacity`
+    samples is a contiguous zero-copy view. A float32 copy of the audio (scaled to [-1, 1),
+    the format needed by Silero VAD) is kept in the same way, converted once per write.
+    Positions are absolute sample counts since the buffer was created.
+    '''
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._pcm = np.zeros(2 * capacity, dtype=np.int16)
+        self._float = np.zeros(2 * capacity, dtype=np.float32)
+        self.write_pos = 0  # Total number of samples written
+
+    @property
+    def oldest_pos(self):
+        # Oldest absolute position still available in the buffer
+        return max(0, self.write_pos - self.capacity)
+
+    def write(self, data):
+        samples = np.frombuffer(data, dtype=np.int16)
+        if samples.size > self.capacity: # Only the last `capacity` samples can be kept
+            self.write_pos += samples.size - self.capacity
+            samples = samples[-self.capacity:]
+
+        n = samples.size
+        start = self.write_pos % self.capacity
+        first = min(n, self.capacity - start) # Samples until the end of the ring
+
+        for pcm_segment, float_segment, src in (
+            (self._pcm[start:start + first], self._float[start:start + first], samples[:first]),
+            (self._pcm[:n - first], self._float[:n - first], samples[first:]),
+        ):
+            pcm_segment[:] = src
+            np.multiply(src, 1 / 32768.0, out=float_segment)
+
+        # Mirror the written segments in the second half of the buffer
+        end = start + first
+        self._pcm[self.capacity + start:self.capacity + end] = self._pcm[start:end]
+        self._float[self.capacity + start:self.capacity + end] = self._float[start:end]
+        self._pcm[self.capacity:self.capacity + n - first] = self._pcm[:n - first]
+        self._float[self.capacity:self.capacity + n - first] = self._float[:n - first]
+
+        self.write_pos += n
+
+    def _slice(self, start, end):
+        if start < self.oldest_pos or end > self.write_pos or start > end:
+            raise ValueError(f'Range [{start}, {end}) not available in the ring buffer '
+                             f'[{self.oldest_pos}, {self.write_pos})')
+        offset = start % self.capacity
+        return slice(offset, offset + end - start)
+
+    def view(self, start, end):
+        # Zero-copy int16 view of the absolute range [start, end)
+        return self._pcm[self._slice(start, end)]
+
+    def float_view(self, start, end):
+        # Zero-copy float32 view of the absolute range [start, end)
+        return self._float[self._slice(start, end)]
+
+    def read(self, start, end):
+        # Copy of the absolute range [start, end) as raw bytes
+        return self.view(start, end).tobytes()
+
+
+class StreamingBuffer:
+    '''
+    Lossless buffer of audio chunks for streaming STT. Chunks are never dropped: if the
+    consumer lags (e.g. network stall), they accumulate in memory and are coalesced into
+    larger requests of up to `max_request_size` bytes when consumed.
+    Tracks the high-water mark of pending audio and the consumer lag.
+    '''
+    def __init__(self, max_request_size=25600):
+        self.max_request_size = max_request_size # STT streaming requests are limited to ~25 KB
+        self.chunks = deque() # (put time, chunk)
+        self.pending_bytes = 0
+        self.closed = False
+        self.condition = Condition()
+
+        self.stats = {'chunks': 0, 'requests': 0, 'coalesced': 0, 'high_water_chunks': 0,
+                      'high_water_bytes': 0, 'consumer_lag': 0.0, 'max_consumer_lag': 0.0}
+
+    def put(self, chunk):
+        with self.condition:
+            if self.closed:
+                return
+
+            self.chunks.append((time.monotonic(), chunk))
+            self.pending_bytes += len(chunk)
+            self.stats['chunks'] += 1
+            self.stats['high_water_chunks'] = max(self.stats['high_water_chunks'], len(self.chunks))
+            self.stats['high_water_bytes'] = max(self.stats['high_water_bytes'], self.pending_bytes)
+            self.condition.notify()
+
+    def close(self):
+        # End of stream: the consumer gets the pending chunks and then stops
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def get(self):
+        # Wait for audio and return the pending chunks coalesced into a single request.
+        # Returns None when the stream is closed and everything has been consumed
+        with self.condition:
+            while not self.chunks and not self.closed:
+                self.condition.wait()
+
+            if not self.chunks:
+                return None
+
+            put_time, data = self.chunks.popleft()
+            lag = time.monotonic() - put_time
+            self.stats['consumer_lag'] = lag
+            self.stats['max_consumer_lag'] = max(self.stats['max_consumer_lag'], lag)
+
+            if len(data) > self.max_request_size: # Split too big chunks, keep the rest for the next request
+                self.chunks.appendleft((put_time, data[self.max_request_size:]))
+                data = data[:self.max_request_size]
+
+            parts = [data]
+            size = len(data)
+            while self.chunks and size + len(self.chunks[0][1]) <= self.max_request_size:
+                size += len(self.chunks[0][1])
+                parts.append(self.chunks.popleft()[1])
+
+            self.pending_bytes -= size
+            self.stats['requests'] += 1
+            self.stats['coalesced'] += len(parts) - 1
+
+        return b''.join(parts) if len(parts) > 1 else data
+
+    def clear(self):
+        with self.condition:
+            self.chunks.clear()
+            self.pending_bytes = 0
+            self.closed = True
+            self.condition.notify_all()
+
+    def __iter__(self):
+        while True:
+            data = self.get()
+            if data is None:
+                break
+            yield data
+
+    def get_stats(self):
+        with self.condition:
+            return {**self.stats, 'pending_bytes': self.pending_bytes}
+
+
+class AudioCapture:
+    '''
+    Persistent capture engine: the input device is opened once and kept open, and every
+    captured frame is published to the subscribed consumers (VAD, recorders, streaming...).
+    Consumers have the PyAudio stream callback signature; returning paComplete unsubscribes them.
+    '''
+    def __init__(self, chunk_size=2048, format=pyaudio.paInt16, channels=1, rate=16000,
+                 device_name="respeaker") -> None:
+        self.logger = logging.getLogger('Mic')
+        self.logger.setLevel(logging.DEBUG)
+
+        self.chunk_size = chunk_size
+        self.format = format
+        self.channels = channels
+        self.rate = rate
+
+        self.p = pyaudio.PyAudio()
+        self.input_device_index = self._get_input_sound_index(device_name)
+        self.stream = None
+
+        # Consumers by name. The dict is replaced (never modified) on (un)subscription,
+        # so the audio callback iterates over it without locking
+        self.consumers = {}
+        self.lock = Lock()
+
+    def _get_input_sound_index(self, device_name="respeaker"):
+        # Check all sound devices and return the index of the Respeaker device (or the looked device)
+        for i in range(self.p.get_device_count()):
+            dev_info = self.p.get_device_info_by_index(i)
+            if device_name in dev_info.get("name", "").lower():
+                self.logger.info(f"{device_name} detected in index {i}: {dev_info.get('name')}")
+                return i
+        self.logger.error(f"{device_name} not found")
+        return 0
+
+    def open(self):
+        with self.lock:
+            if self.stream is not None:
+                return
+
+            self.stream = self.p.open(format=self.format,
+                    channels=self.channels,
+                    rate=self.rate,
+                    input=True,
+                    frames_per_buffer=self.chunk_size,
+                    input_device_index=self.input_device_index,
+                    stream_callback=self._on_data)
+
+        self.logger.info('Capture stream opened')
+
+    def _on_data(self, in_data, frame_count, time_info, flag): # Callback for captured audio
+        for name, consumer in self.consumers.items():
+            try:
+                _, status = consumer(in_data, frame_count, time_info, flag)
+            except Exception as e:
+                self.logger.error(f'Consumer {name} failed: {str(e)}')
+                status = pyaudio.paContinue
+
+            if status == pyaudio.paComplete: # Consumer finished
+                self.unsubscribe(name)
+
+        return (None, pyaudio.paContinue)
+
+    def subscribe(self, name, consumer):
+        with self.lock:
+            self.consumers = {**self.consumers, name: consumer}
+
+        self.logger.info(f'Consumer {name} subscribed')
+
+    def unsubscribe(self, name):
+        with self.lock:
+            if name not in self.consumers:
+                return
+            self.consumers = {key: value for key, value in self.consumers.items() if key != name}
+
+        self.logger.info(f'Consumer {name} unsubscribed')
+
+    def close(self):
+        with self.lock:
+            self.consumers = {}
+            if self.stream is not None:
+                self.stream.stop_stream()
+                self.stream.close()
+                self.stream = None
+
+        self.p.terminate()
+        self.logger.info('Capture stream closed')
+
 
 class Recorder:
     def __init__(self, callback, chunk_size=2048, format=pyaudio.paInt16,
-                 channels=1, rate=16000, prev_audio_size=2.5, silence_duration=0.5) -> None:
+                 channels=1, rate=16000, prev_audio_size=2.5, silence_duration=0.5,
+                 vad_mode='window', vad_threshold=0.5, max_record_duration=30,
+                 capture=None, name='recorder', pregate=False, pregate_ratio=2.0,
+                 pregate_max_rms=0.02, pregate_zcr_margin=0.1, vad_worker=False,
+                 stt_stable_time=0.6, stt_silence_duration=0.2,
+                 barge_in_ratio=0.5, barge_in_margin=2.0, barge_in_min_speech=0.3, barge_in_preroll=0.3, vad_backend='torch',
+                 vad_intra_op_threads=None, vad_inter_op_threads=None, vad_quantize=False) -> None:
         self.logger = logging.getLogger('Mic')
         self.logger.setLevel(logging.DEBUG)
 
@@ -21,15 +269,26 @@ class Recorder:
                                         # is detected, how much of previously recorded audio is
                                         # prepended. This helps to prevent chopping the beggining
                                         # of the phrase.
-    
-        self.audio2send = []
-        self.prev_audio = deque(maxlen=int(prev_audio_size * rate/chunk_size)) 
-        
-        self.p = pyaudio.PyAudio()
-        self.input_device_index = self._get_input_sound_index()
 
-        self.model = load_silero_vad()  # Load Silero VAD model
-        self.stream = None
+        # Audio buffer shared by pre-roll, VAD and recorded utterance
+        self.buffer = AudioRingBuffer(int((prev_audio_size + max_record_duration) * rate))
+        self.session_start = 0  # Position where the current mic session started
+        self.utterance_start = 0  # Position where the recorded utterance starts (pre-roll included)
+        self.utterance_end = 0  # Position where the recorded utterance ends
+        self.speech_start = 0  # Position of the speech onset detected by the VAD (pre-roll excluded)
+        self.speech_end = 0  # Position of the end of the last speech detected (trailing silence excluded)
+
+        # Capture stream, opened once and shared. Starting/stopping the recorder only
+        # (un)subscribes it, the input device is never reopened
+        self.name = name
+        self.capture = capture if capture is not None else AudioCapture(chunk_size, format, channels, rate)
+        self.capture.open()
+
+        # Load Silero VAD model ('torch' JIT or 'onnx' backend, optionally int8 quantized)
+        vad_options = {'intra_op_threads': vad_intra_op_threads, 'inter_op_threads': vad_inter_op_threads}
+        if vad_backend == 'onnx':
+            vad_options['quantize'] = vad_quantize
+        self.model = load_vad(vad_backend, **vad_options)
 
         self._thread = None
         self.stopped = Event()
@@ -37,127 +296,403 @@ class Recorder:
         self.stop_recording = Event()
         self.callback = callback
 
-        self.audio_buffer = deque(maxlen=int(rate / chunk_size * 1.0))  # Buffer for 1 second of audio for faster detection
+        self.vad_buffer_size = int(rate * 1.0)  # Last 1 second of audio for faster detection
         self.process_every_n = 2  # Process every N chunks to reduce CPU load
         self.chunk_counter = 0
-        self.min_buffer_size = int(rate / chunk_size * 0.5)  # Minimum 0.5 seconds for VAD processing
-        
+        self.min_buffer_size = int(rate / chunk_size * 0.5)  # Minimum 0.5 seconds (in chunks) for VAD processing
+
+        # VAD mode: 'window' re-scans the last second of audio with get_speech_timestamps,
+        # 'streaming' scores every new window once with the stateful Silero model
+        if vad_mode not in ('window', 'streaming'):
+            raise ValueError(f"Unknown VAD mode '{vad_mode}'")
+        self.vad_mode = vad_mode
+        self.vad_threshold = vad_threshold
+        self.vad_neg_threshold = max(vad_threshold - 0.15, 0.01)  # Hysteresis to leave speech state (as VADIterator)
+        self.vad_window_size = 512 if rate == 16000 else 256  # Window sizes supported by Silero VAD
+        self.vad_pos = 0  # Position of the next sample to be scored (streaming mode)
+        self.vad_triggered = False  # Speech state kept between calls
+
+        # DSP pre-gate: skip the neural VAD on chunks clearly below the (adaptive) noise floor
+        self.pregate = pregate
+        self.pregate_ratio = pregate_ratio  # Chunk RMS must exceed noise floor * ratio to be evaluated
+        self.pregate_max_rms = pregate_max_rms  # Chunks above this RMS are always evaluated
+        self.pregate_zcr_margin = pregate_zcr_margin  # Zero-crossing rate above noise ZCR + margin is always evaluated (fricatives)
+        self.noise_rms = None  # Running noise floor estimate
+        self.noise_zcr = None  # Running noise zero-crossing rate estimate
+        self.vad_stats = {'gated': 0, 'evaluated': 0}  # Chunks skipped by the pre-gate vs. evaluated by the VAD
+
         # Silence detection tracking
         self.silence_chunks_needed = int(silence_duration * rate / chunk_size)  # Number of consecutive unvoiced chunks needed
         self.silence_chunk_counter = 0  # Counter for consecutive unvoiced chunks
 
+        # Early end of turn driven by streaming STT results (see on_stt_result)
+        self.stt_stable_time = stt_stable_time  # Time an interim transcript must stay unchanged
+        self.stt_silence_chunks = max(1, int(stt_silence_duration * rate / chunk_size))  # Silence needed with a stable transcript
+        self.stt_final = False  # Final result received for the current utterance
+        self.stt_transcript = ''  # Last interim transcript
+        self.stt_transcript_time = None  # When the last interim transcript changed
+
+        # Barge-in: listen while the robot speaks. A playback-level gate prevents self-triggering
+        # from the robot's own voice: mic chunks only count as speech if their RMS exceeds the
+        # current playback RMS * gate ratio, and speech must last barge_in_min_speech to start recording.
+        # The digital playback RMS and the mic RMS are on unrelated scales (speaker volume, acoustic
+        # coupling), so the ratio is calibrated while the robot speaks: echo_ratio follows the mic RMS /
+        # playback RMS of its own voice, and the gate ratio is echo_ratio * barge_in_margin
+        # (barge_in_ratio until the echo has been measured)
+        self.playback_level = None  # Function returning the current playback RMS level (see set_playback_gate)
+        self.barge_in_ratio = barge_in_ratio
+        self.barge_in_margin = barge_in_margin  # How much louder than the robot's echo the user must be
+        self.echo_ratio = None  # Running estimate of mic RMS / playback RMS of the robot's own voice (kept between sessions)
+        self.echo_min_level = 0.01  # Playback RMS needed to measure the echo (quieter audio is mostly room noise)
+        self.barge_in_chunks_needed = max(1, int(barge_in_min_speech * rate / chunk_size))
+        self.barge_in_chunk_counter = 0  # Consecutive speech chunks above the playback level
+        # Pre-roll of a barge-in (in seconds) before the speech onset: the audio before it is mostly
+        # the robot's own voice, so the prev_audio_size pre-roll would send it to STT as the user's turn
+        self.barge_in_preroll = barge_in_preroll
+        self.barge_in_onset = None  # Position of the first chunk of the speech passing the gate, if the robot was speaking
+
         # Streaming attributes
         self.streaming_enabled = False
-        self.streaming_queue = None
+        self.streaming_buffer = None
+        self.streamed_pos = 0  # Position up to which audio has been sent to the streaming buffer
+        self.lock = Lock()  # Exclusive access to streaming state (audio callback vs. main thread)
+
+        # VAD worker: the audio callback only copies the frame into the ring buffer (single
+        # producer, single consumer, no locks) and a worker thread makes the VAD decisions
+        self.vad_worker = vad_worker
+        self._worker_thread = None
+        self.data_available = Event()
+        self.processed_pos = 0  # Position up to which the worker has processed the audio
+
+        # Timing instrumentation (seconds)
+        self.chunk_duration = chunk_size / rate  # Time budget of the audio callback
+        self.timing_stats = {'callbacks': 0, 'callback_time': 0.0, 'max_callback_time': 0.0,
+                             'worker_lag': 0.0, 'max_worker_lag': 0.0}
 
         self.logger.info('Ready')
-    
-    def _get_input_sound_index(self, device_name="respeaker"):
-        # Check all sound devices and return the index of the Respeaker device (or the looked device)
-        for i in range(self.p.get_device_count()):
-            dev_info = self.p.get_device_info_by_index(i)
-            if device_name in dev_info.get("name", "").lower():
-                self.logger.info(f"{device_name} detected in index {i}: {dev_info.get('name')}")
-                return i
-        self.logger.error(f"{device_name} not found")
-        return 0
-    
+
     def on_data(self, in_data, frame_count, time_info, flag): # Callback for recorded audio
+        callback_start = time.perf_counter()
+
+        if self.vad_worker:
+            # Only copy the frame, the worker makes the decisions. Once it has detected the
+            # end of the utterance, the recorder is unsubscribed from the capture stream
+            self.buffer.write(in_data)
+            self.data_available.set()
+            status = pyaudio.paComplete if self.stop_recording.is_set() else pyaudio.paContinue
+
+        else:
+            chunk_start = self.buffer.write_pos
+            self.buffer.write(in_data)
+            status = self._process_chunk(chunk_start, self.buffer.write_pos)
+
+        self._update_callback_stats(time.perf_counter() - callback_start)
+        return (in_data, status)
+
+    def _run_vad_worker(self):
+        while not self.stopped.is_set():
+            if not self.data_available.wait(0.5):
+                continue
+            self.data_available.clear()
+
+            while self.processed_pos + self.chunk_size <= self.buffer.write_pos:
+                if self.processed_pos < self.buffer.oldest_pos:
+                    self.logger.error('VAD worker overrun, audio lost')
+                    self.processed_pos = self.buffer.oldest_pos
+                    self.vad_pos = max(self.vad_pos, self.processed_pos)
+
+                chunk_start = self.processed_pos
+                self.processed_pos += self.chunk_size
+                self._update_worker_lag((self.buffer.write_pos - self.processed_pos) / self.rate)
+
+                if self._process_chunk(chunk_start, self.processed_pos) == pyaudio.paComplete:
+                    return
+
+                if self.stopped.is_set():
+                    return
+
+    def _process_chunk(self, chunk_start, chunk_end):
+        # VAD and recording decisions for a chunk already written in the ring buffer
         is_speech = False
+        vad_evaluated = False  # The VAD classified this chunk (skipped chunks may contain speech)
+        speech_span = (chunk_start, chunk_end)  # Speech detected in the chunk (or in the VAD window)
+
+        rms, zcr = None, None
+        if self.pregate:
+            rms, zcr = self._chunk_features(chunk_start, chunk_end)
+
+        if self.pregate and self._is_below_noise_floor(rms, zcr):
+            self.vad_stats['gated'] += 1
+            self.vad_pos = chunk_end  # Gated windows are never scored
+            self.vad_triggered = False
+            if rms < self.noise_rms: # Quieter than the floor: it can only lower it
+                self._update_noise_floor(rms, zcr)
 
-        # Append incoming data to the buffer
-        self.audio_buffer.append(in_data)
-        
-        # Process only every N chunks to reduce CPU usage
-        self.chunk_counter += 1
-        should_process = (self.chunk_counter % self.process_every_n == 0) or self.start_recording.is_set()
+        elif self.vad_mode == 'streaming':
+            self.vad_stats['evaluated'] += 1
+            is_speech = self._streaming_vad(chunk_end)
+            vad_evaluated = True
 
-        # Process buffer if it contains enough data and it's time to process
-        if should_process and len(self.audio_buffer) >= self.min_buffer_size:
-            audio_chunk = np.frombuffer(b''.join(self.audio_buffer), dtype=np.int16).astype(np.float32) / 32768.0 # needed format for Silero VAD
-            voiced_timestamps = get_speech_timestamps(audio_chunk, self.model, sampling_rate=self.rate)
+        else:
+            # Process only every N chunks to reduce CPU usage
+            self.chunk_counter += 1
+            should_process = (self.chunk_counter % self.process_every_n == 0) or self.start_recording.is_set()
+
+            # Process buffer if it contains enough data and it's time to process
+            available = chunk_end - max(self.buffer.oldest_pos, self.session_start)
+            if should_process and available >= self.min_buffer_size * self.chunk_size:
+                self.vad_stats['evaluated'] += 1
+                audio_chunk = self.buffer.float_view(chunk_end - min(available, self.vad_buffer_size), chunk_end)
+                voiced_timestamps = get_speech_timestamps(audio_chunk, self.model, sampling_rate=self.rate)
+                vad_evaluated = True
+
+                if voiced_timestamps:
+                    is_speech = True
+                    window_start = chunk_end - audio_chunk.size
+                    speech_span = (window_start + voiced_timestamps[0]['start'], window_start + voiced_timestamps[-1]['end'])
 
-            if voiced_timestamps:
-                is_speech = True
+        if self.pregate and vad_evaluated and not is_speech:
+            self._update_noise_floor(rms, zcr)
+
+        if self.playback_level is not None and not self.start_recording.is_set():
+            is_speech = self._passes_playback_gate(is_speech, chunk_start, chunk_end, rms)
 
         if is_speech:
             if not self.start_recording.is_set():
-                self.audio2send = []
+                # Prepend previous audio (pre-roll) to the utterance
+                onset, preroll = chunk_start, self.prev_audio_size
+                self.speech_start, self.speech_end = speech_span
+                if self.playback_level is not None and self.barge_in_onset is not None:
+                    onset, preroll = self.barge_in_onset, self.barge_in_preroll # Barge-in while the robot speaks
+                    self.speech_start = onset
+                self.utterance_start = max(onset - int(preroll * self.rate),
+                                           self.session_start, self.buffer.oldest_pos)
+                with self.lock:
+                    self.streamed_pos = self.utterance_start
+                self._reset_stt_endpointing()
                 self.start_recording.set()
-                self.audio2send.extend(self.prev_audio)
-                
-                # If streaming is enabled, also send previous audio chunks to streaming queue
-                if self.streaming_enabled and self.streaming_queue is not None:
-                    for prev_chunk in self.prev_audio:
-                        try:
-                            self.streaming_queue.put_nowait(prev_chunk)
-                        except queue.Full:
-                            self.logger.warning('Streaming queue full while adding prev_audio, dropping chunk')
-            
+
             # Reset silence counter when speech is detected
             self.silence_chunk_counter = 0
-            
-            self.audio2send.append(in_data)
-            
-            # If streaming is enabled, send chunks to streaming queue
-            if self.streaming_enabled and self.streaming_queue is not None:
-                try:
-                    self.streaming_queue.put_nowait(in_data)
-                except queue.Full:
-                    self.logger.warning('Streaming queue full, dropping chunk')
+            self.speech_end = max(self.speech_end, speech_span[1])
+
+            # If streaming is enabled, send chunks to streaming buffer
+            self._send_streaming(chunk_end)
 
         elif self.start_recording.is_set(): # Silence detected after voice activity
             # Increment silence counter
             self.silence_chunk_counter += 1
-            
-            # Continue appending audio during silence period
-            self.audio2send.append(in_data)
-            
-            # If streaming is enabled, send chunks to streaming queue
-            if self.streaming_enabled and self.streaming_queue is not None:
-                try:
-                    self.streaming_queue.put_nowait(in_data)
-                except queue.Full:
-                    self.logger.warning('Streaming queue full, dropping chunk')
-            
-            # Only stop if we have reached the required silence duration
-            if self.silence_chunk_counter >= self.silence_chunks_needed:
+
+            # Continue recording audio during silence period
+            self._send_streaming(chunk_end)
+
+            # Only stop if we have reached the required silence duration (or STT detected the end of the turn)
+            if self.silence_chunk_counter >= self.silence_chunks_needed or self._is_stt_endpoint():
+                self.utterance_end = chunk_end
                 self.start_recording.clear()
                 self.stop_recording.set()
                 self.silence_chunk_counter = 0  # Reset counter
-                
+
                 # Signal end of streaming
-                if self.streaming_enabled and self.streaming_queue is not None:
-                    try:
-                        self.streaming_queue.put_nowait(None)  # Stop value
-                    except queue.Full:
-                        pass
-                
-                self.prev_audio = deque(maxlen=int(self.prev_audio_size * self.rate/self.chunk_size)) 
-                return (in_data, pyaudio.paComplete)
-            
-        else:
-            self.prev_audio.append(in_data)
-        
-        return (in_data, pyaudio.paContinue)
+                with self.lock:
+                    if self.streaming_enabled and self.streaming_buffer is not None:
+                        self.streaming_buffer.close()
+
+                return pyaudio.paComplete
+
+        return pyaudio.paContinue
+
+    def on_stt_result(self, transcript, is_final):
+        # Streaming STT results for the current utterance, used to close the turn early:
+        # a final result or a stable interim transcript with a short silence end the turn
+        if not self.start_recording.is_set():
+            return
+
+        if is_final:
+            self.stt_final = True
+        elif transcript != self.stt_transcript:
+            # Time first: _is_stt_endpoint (audio callback or VAD worker) reads them without a lock
+            self.stt_transcript_time = time.monotonic()
+            self.stt_transcript = transcript
+
+    def _is_stt_endpoint(self):
+        # Called on silent chunks during recording
+        if self.stt_final:
+            self.logger.info('End of turn detected by STT final result')
+            return True
+
+        transcript, transcript_time = self.stt_transcript, self.stt_transcript_time
+        if (transcript and transcript_time is not None and self.silence_chunk_counter >= self.stt_silence_chunks
+                and time.monotonic() - transcript_time >= self.stt_stable_time):
+            self.logger.info(f"End of turn detected by stable STT transcript '{transcript}'")
+            return True
+
+        return False
+
+    def _reset_stt_endpointing(self):
+        self.stt_final = False
+        self.stt_transcript = ''
+        self.stt_transcript_time = None
+
+    def _update_callback_stats(self, elapsed):
+        self.timing_stats['callbacks'] += 1
+        self.timing_stats['callback_time'] += elapsed
+        if elapsed > self.timing_stats['max_callback_time']:
+            self.timing_stats['max_callback_time'] = elapsed
+
+        if elapsed > self.chunk_duration: # Callback slower than real time: overruns
+            self.logger.warning(f'Audio callback took {elapsed * 1000:.1f} ms (budget {self.chunk_duration * 1000:.1f} ms)')
+
+    def _update_worker_lag(self, lag):
+        self.timing_stats['worker_lag'] = lag
+        if lag > self.timing_stats['max_worker_lag']:
+            self.timing_stats['max_worker_lag'] = lag
+
+    def get_timing_stats(self):
+        # Audio callback execution time and VAD worker lag (in ms), to check how close we are to xruns
+        callbacks = self.timing_stats['callbacks']
+        return {
+            'callbacks': callbacks,
+            'budget_ms': self.chunk_duration * 1000,
+            'mean_callback_ms': self.timing_stats['callback_time'] / callbacks * 1000 if callbacks else 0.0,
+            'max_callback_ms': self.timing_stats['max_callback_time'] * 1000,
+            'worker_lag_ms': self.timing_stats['worker_lag'] * 1000,
+            'max_worker_lag_ms': self.timing_stats['max_worker_lag'] * 1000,
+        }
+
+    def _chunk_features(self, start, end):
+        # Vectorized RMS and zero-crossing rate of a chunk
+        samples = self.buffer.float_view(start, end)
+        if samples.size < 2:
+            return 0.0, 0.0
+
+        rms = float(np.sqrt(np.dot(samples, samples) / samples.size))
+        zcr = np.count_nonzero(np.diff(np.signbit(samples))) / (samples.size - 1)
+        return rms, zcr
+
+    def _is_below_noise_floor(self, rms, zcr):
+        if self.noise_rms is None: # No noise estimate yet
+            return False
+
+        threshold = min(self.noise_rms * self.pregate_ratio, self.pregate_max_rms)
+        return rms < threshold and zcr < self.noise_zcr + self.pregate_zcr_margin
+
+    def _update_noise_floor(self, rms, zcr):
+        # Running noise estimate from non-speech chunks: follows decreases quickly and
+        # increases slowly, so speech misclassified as noise barely raises the floor
+        if self.noise_rms is None:
+            self.noise_rms, self.noise_zcr = rms, zcr
+            return
+
+        alpha = 0.3 if rms < self.noise_rms else 0.02
+        self.noise_rms += alpha * (rms - self.noise_rms)
+        self.noise_zcr += 0.05 * (zcr - self.noise_zcr)
+
+    def set_playback_gate(self, playback_level):
+        # Enable barge-in gating (set before start()). playback_level() returns the RMS (0-1) being played
+        self.playback_level = playback_level
+        self.barge_in_chunk_counter = 0
+        self.barge_in_onset = None
+
+    def _update_echo_ratio(self, ratio):
+        # Lower envelope of the mic / playback ratio while the robot speaks: the user's voice only
+        # adds to the echo, so the estimate follows decreases quickly and increases slowly
+        if self.echo_ratio is None:
+            self.echo_ratio = ratio
+            return
+
+        alpha = 0.3 if ratio < self.echo_ratio else 0.02
+        self.echo_ratio += alpha * (ratio - self.echo_ratio)
+
+    def _passes_playback_gate(self, is_speech, chunk_start, chunk_end, rms):
+        if rms is None:
+            rms, _ = self._chunk_features(chunk_start, chunk_end)
+
+        level = self.playback_level()
+        gate_ratio = self.barge_in_ratio if self.echo_ratio is None else self.echo_ratio * self.barge_in_margin
+        if level >= self.echo_min_level:
+            self._update_echo_ratio(rms / level)
+
+        if not is_speech or rms <= level * gate_ratio: # Silence, or probably the robot's own voice
+            self.barge_in_chunk_counter = 0
+            return False
+
+        if self.barge_in_chunk_counter == 0:
+            self.barge_in_onset = chunk_start if level > 0 else None
+        self.barge_in_chunk_counter += 1
+        return self.barge_in_chunk_counter >= self.barge_in_chunks_needed
+
+    def get_vad_stats(self):
+        # Pre-gate counters, current noise estimate and barge-in echo calibration
+        return {**self.vad_stats, 'noise_rms': self.noise_rms, 'noise_zcr': self.noise_zcr, 'echo_ratio': self.echo_ratio}
+
+    def _streaming_vad(self, end):
+        # Score each new VAD window exactly once, keeping the model state (and the
+        # speech/silence state) between calls. Returns True if the chunk contains speech
+        is_speech = False
+
+        while self.vad_pos + self.vad_window_size <= end:
+            window = self.buffer.float_view(self.vad_pos, self.vad_pos + self.vad_window_size)
+            speech_prob = self.model(window, self.rate).item()
+            self.vad_pos += self.vad_window_size
+
+            if speech_prob >= self.vad_threshold:
+                self.vad_triggered = True
+            elif speech_prob < self.vad_neg_threshold:
+                self.vad_triggered = False
+
+            is_speech = is_speech or self.vad_triggered
+
+        return is_speech
+
+    def _reset_vad(self):
+        self.model.reset_states()
+        self.vad_pos = self.buffer.write_pos
+        self.vad_triggered = False
+
+    def _send_streaming(self, end):
+        # Send the recorded audio not yet streamed (pre-roll included) to the streaming buffer
+        with self.lock:
+            if not self.streaming_enabled or self.streaming_buffer is None:
+                return
+
+            start = max(self.streamed_pos, self.buffer.oldest_pos)
+            if start < end:
+                self.streaming_buffer.put(self.buffer.read(start, end))
+            self.streamed_pos = end
+
+    def speech_duration(self):
+        # Duration (sec) of the speech of the last utterance, from the VAD onset to the end of
+        # the speech: without the pre-roll and the trailing silence of the recorded audio
+        return max(self.speech_end - self.speech_start, 0) / self.rate
+
+    def _utterance_audio(self):
+        start = self.utterance_start
+        if start < self.buffer.oldest_pos:
+            self.logger.warning('Utterance longer than the audio buffer, beginning of the audio lost')
+            start = self.buffer.oldest_pos
+        return self.buffer.read(start, self.utterance_end)
 
     def start(self):
 
         self.stopped.clear()
         self.start_recording.clear() # Start recording event
         self.stop_recording.clear() # Stop recording event
+        self.session_start = self.buffer.write_pos
+        self.processed_pos = self.session_start
+        self._reset_vad()
+        self._reset_stt_endpointing()
 
-        self.stream = self.p.open(format=self.format,
-                channels=self.channels,
-                rate=self.rate,
-                input=True,
-                frames_per_buffer=self.chunk_size,
-                input_device_index=self.input_device_index,
-                stream_callback=self.on_data)
-        
         self._thread = Thread(target=self._run)
         self._thread.start()
 
+        if self.vad_worker:
+            self.data_available.clear()
+            self._worker_thread = Thread(target=self._run_vad_worker)
+            self._worker_thread.start()
+
+        self.capture.subscribe(self.name, self.on_data) # Arm the recorder
+
         self.logger.info('Mic opened')
 
     def _run(self):
@@ -173,76 +708,80 @@ class Recorder:
             return
 
         self.logger.info('Stopped recording')
-        self.callback('stop_recording', b''.join(self.audio2send))
-        self.stream.close()
-        self.stream = None
+        self.callback('stop_recording', self._utterance_audio())
 
     def stop(self):
         self.logger.info("Mic closed")
+        if self.pregate:
+            self.logger.debug(f'VAD stats :: {self.get_vad_stats()}')
+        self.logger.debug(f'Timing stats :: {self.get_timing_stats()}')
+
+        self.capture.unsubscribe(self.name) # Disarm the recorder, the capture stream stays open
+        self.playback_level = None # Barge-in gate only applies to one session
 
         self.stopped.set()
         self.start_recording.set()
         self.stop_recording.set()
-        
+
         if self._thread is not None and self._thread.is_alive():
             self._thread.join()
 
-        if self.stream is not None:
-            self.stream.close()
+        if self._worker_thread is not None and self._worker_thread.is_alive():
+            self._worker_thread.join()
+
         self.start_recording.clear()
         self.stop_recording.clear()
-    
+
     def destroy(self):
         self.stop()
-        self.disable_streaming()  # Clean up streaming queue if enabled
-        self.p.terminate()
+        self.disable_streaming()  # Clean up streaming buffer if enabled
+        self.capture.close()
 
 
     def enable_streaming(self):
-        # Enable streaming mode: audio chunks will be sent to streaming queue
-        if not self.streaming_enabled:
-            self.streaming_queue = queue.Queue(maxsize=100)
+        # Enable streaming mode: audio chunks will be sent to streaming buffer
+        with self.lock:
+            if self.streaming_enabled:
+                return
+
+            self.streaming_buffer = StreamingBuffer()
             self.streaming_enabled = True
-            
-            # Send any audio already in audio2send to the streaming queue (includes prev_audio)
-            if self.audio2send:
-                self.logger.info(f'Streaming enabled with {len(self.audio2send)} prev audio chunks')
-                for chunk in self.audio2send:
-                    try:
-                        self.streaming_queue.put_nowait(chunk)
-                    except queue.Full:
-                        self.logger.warning('Streaming queue full while adding audio2send, dropping chunk')
-            else:
-                self.logger.info('Streaming enabled')
-    
+
+        if self.start_recording.is_set() or self.stop_recording.is_set():
+            # Send the audio already recorded to the streaming buffer (includes prev_audio)
+            end = self.utterance_end if self.stop_recording.is_set() else self.buffer.write_pos
+            self.logger.info(f'Streaming enabled with {(end - self.streamed_pos) / self.rate:.2f} s of prev audio')
+            self._send_streaming(end)
+            if self.stop_recording.is_set(): # Utterance already finished
+                self.streaming_buffer.close()
+        else:
+            self.logger.info('Streaming enabled')
+
     def disable_streaming(self):
         # Disable streaming mode
-        if self.streaming_enabled:
+        with self.lock:
+            if not self.streaming_enabled:
+                return
+
             self.streaming_enabled = False
-            if self.streaming_queue is not None:
-                # Clear the queue
-                while not self.streaming_queue.empty():
-                    try:
-                        self.streaming_queue.get_nowait()
-                    except queue.Empty:
-                        break
-            self.streaming_queue = None
-            self.logger.info('Streaming disabled')
-    
+            if self.streaming_buffer is not None:
+                self.logger.info(f'Streaming stats :: {self.streaming_buffer.get_stats()}')
+                self.streaming_buffer.clear() # Also stops any consumer still waiting
+            self.streaming_buffer = None
+        self.logger.info('Streaming disabled')
+
     def get_audio_generator(self):
         """
-        Generator that yields audio chunks from the streaming queue.
-        Used to feed the STT streaming API
-        
+        Generator that yields audio chunks from the streaming buffer.
+        Used to feed the STT streaming API. Pending chunks are coalesced
+        into bigger requests when the consumer lags.
+
         Yields:
             bytes: Audio chunks
         """
-        if self.streaming_queue is None:
-            self.logger.warning('Streaming queue not initialized')
+        streaming_buffer = self.streaming_buffer
+        if streaming_buffer is None:
+            self.logger.warning('Streaming buffer not initialized')
             return
-        
-        while True:
-            chunk = self.streaming_queue.get()
-            if chunk is None:  # value to stop
-                break
-            yield chunk
\ No newline at end of file
+
+        yield from streaming_buffer
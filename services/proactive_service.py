@@ -1,16 +1,31 @@
 import json
 import logging
 from datetime import datetime, timedelta
+from threading import Lock, Timer
 
 
 class ProactiveService:
-    def __init__(self, callback) -> None:
+    def __init__(self, callback, pregeneration_lead=60, retry_interval=30) -> None:
         self.logger = logging.getLogger('Proactive')
         self.logger.setLevel(logging.DEBUG)
 
         self.question = None
         self.callback = callback
 
+        # Pre-generation of the next due question, pregeneration_lead seconds before it is due,
+        # only while someone is in the room (the question of the recognized user, or presence one)
+        self.pregeneration_lead = pregeneration_lead
+        self.pregeneration_timer = None
+        self.pregenerated = {} # (type, username) -> due time already pre-generated
+        self.present = False
+        self.present_user = None
+        self.lock = Lock() # Question times are read by the pre-generation timer thread
+
+        # A question that could not be asked (cloud services unavailable) is asked again every
+        # retry_interval seconds while someone is in the room, until it is asked
+        self.retry_interval = retry_interval
+        self.retry_timer = None
+
         # Put an alarms to ask for user mood
         self.next_presence_question_time = datetime.now() + timedelta(minutes=60)
         self.logger.info(f"First how_are_you (presence) set at {self.next_presence_question_time}")
@@ -26,6 +41,82 @@ class ProactiveService:
 
         self.logger.info('Ready')
 
+    def _next_due_question(self):
+        # Next how_are_you question of the person in the room, if it is not due yet and its
+        # response has not been pre-generated yet: (due time, params). Called with the lock
+        if not self.present:
+            return None
+
+        if self.present_user is not None:
+            due_time = self.next_close_face_question_time.get(self.present_user)
+            params = {'type': 'close_face_recognized', 'username': self.present_user}
+        else:
+            due_time = self.next_presence_question_time
+            params = {'type': 'presence'}
+
+        if due_time is None or due_time <= datetime.now(): # Already due: it is asked right away
+            return None
+        if self.pregenerated.get((params['type'], params.get('username'))) == due_time:
+            return None
+        return due_time, params
+
+    def _schedule_pregeneration(self):
+        with self.lock:
+            if self.pregeneration_timer is not None:
+                self.pregeneration_timer.cancel()
+                self.pregeneration_timer = None
+
+            question = self._next_due_question()
+            if question is None:
+                return
+
+            due_time, params = question
+            delay = max((due_time - datetime.now()).total_seconds() - self.pregeneration_lead, 0)
+            self.pregeneration_timer = Timer(delay, self._pregenerate, args=(due_time, params))
+            self.pregeneration_timer.daemon = True
+            self.pregeneration_timer.start()
+
+    def _pregenerate(self, due_time, params):
+        with self.lock:
+            if self._next_due_question() != (due_time, params):
+                return # The person left or changed, or the question was rescheduled
+            self.pregenerated[(params['type'], params.get('username'))] = due_time
+
+        # Only this question: the next one is scheduled when the question times change
+        self.logger.info(f"Pre-generating how_are_you {params} due at {due_time}")
+        self.callback('pregenerate', params)
+
+    def _cancel_retry(self):
+        # Called with the lock
+        if self.retry_timer is not None:
+            self.retry_timer.cancel()
+            self.retry_timer = None
+
+    def _retry(self, question, args):
+        with self.lock:
+            self.retry_timer = None
+            if not self.present:
+                self.logger.info(f"Deferred {question} {args} dropped, nobody in the room")
+                return
+
+        self.logger.info(f"Asking deferred {question} {args}")
+        self.callback(f'ask_{question}', args)
+
+    def set_presence(self, present):
+        # Someone is in the room (or left): pre-generation only runs while someone is there
+        with self.lock:
+            self.present = present
+            if not present:
+                self.present_user = None
+                self._cancel_retry()
+        self._schedule_pregeneration()
+
+    def stop(self):
+        with self.lock:
+            if self.pregeneration_timer is not None:
+                self.pregeneration_timer.cancel()
+            self._cancel_retry()
+
     
     def update(self, type, subtype, args={}):
         self.logger.info(f"Update {type}::{subtype} - {args}")
@@ -40,13 +131,19 @@ class ProactiveService:
                 # Timeout, ask 'How are you? to specific user'
                 username = args.get('username')
                 if username:
-                    # If user does not exist, initialize it
-                    if username not in self.next_close_face_question_time:
-                        self.next_close_face_question_time[username] = datetime.now()
-                        self.logger.info(f"New user detected: {username}. Timer initialized at {self.next_close_face_question_time[username]}")
-                    
-                    if (self.next_close_face_question_time[username] - datetime.now()).total_seconds() <= 0: 
+                    with self.lock:
+                        # If user does not exist, initialize it
+                        if username not in self.next_close_face_question_time:
+                            self.next_close_face_question_time[username] = datetime.now()
+                            self.logger.info(f"New user detected: {username}. Timer initialized at {self.next_close_face_question_time[username]}")
+                        due_time = self.next_close_face_question_time[username]
+                        user_changed = username != self.present_user
+                        self.present_user = username
+
+                    if (due_time - datetime.now()).total_seconds() <= 0: 
                         self.callback('ask_how_are_you', {'type': 'close_face_recognized', 'username': username})
+                    elif user_changed: # Pre-generate the question of the user in front of the robot
+                        self._schedule_pregeneration()
 
             elif subtype == 'unknown_face': # Ask new user's name
                 self.callback('ask_who_are_you')
@@ -54,23 +151,36 @@ class ProactiveService:
 
         elif type == 'new_timer':
             if subtype == 'how_are_you':# set next future alarms for proactive questions
-                 # Set new alarm for presence 2 hours later
-                self.next_presence_question_time = datetime.now() + timedelta(hours=2)
-                self.logger.info(f"Next how_are_you - presence timer set at {self.next_presence_question_time}")
+                with self.lock:
+                     # Set new alarm for presence 2 hours later
+                    self.next_presence_question_time = datetime.now() + timedelta(hours=2)
+                    self.logger.info(f"Next how_are_you - presence timer set at {self.next_presence_question_time}")
+
+                    username = args.get('username')
+                    if username: # Set new alarm for close face (specific user) 30 minute later
+                        self.next_close_face_question_time[username] = datetime.now() + timedelta(minutes=30)
+                        self.logger.info(f"Next how_are_you - close_face_recognized ({username}) set at {self.next_close_face_question_time}")
+                    
+                    else: # Postpone all the known users alarms 10 minutes later (just in case the user doesn't want to talk after presece proactive question and the user is still there)
+                        self.logger.info(f"Postponing all the known users alarms 10 minutes later")
+                        for user in self.next_close_face_question_time.keys():
+                            self.next_close_face_question_time[user] = datetime.now() + timedelta(minutes=10)
+                            self.logger.info(f"Next how_are_you - close_face_recognized postponed 10 min ({user}) set at {self.next_close_face_question_time[user]}")
+
+                self._schedule_pregeneration()
 
-                username = args.get('username')
-                if username: # Set new alarm for close face (specific user) 30 minute later
-                    self.next_close_face_question_time[username] = datetime.now() + timedelta(minutes=30)
-                    self.logger.info(f"Next how_are_you - close_face_recognized ({username}) set at {self.next_close_face_question_time}")
-                
-                else: # Postpone all the known users alarms 10 minutes later (just in case the user doesn't want to talk after presece proactive question and the user is still there)
-                    self.logger.info(f"Postponing all the known users alarms 10 minutes later")
-                    for user in self.next_close_face_question_time.keys():
-                        self.next_close_face_question_time[user] = datetime.now() + timedelta(minutes=10)
-                        self.logger.info(f"Next how_are_you - close_face_recognized postponed 10 min ({user}) set at {self.next_close_face_question_time[user]}")
 
+        elif type == 'deferred': # Question not asked (cloud services unavailable): ask it again later
+            with self.lock:
+                self._cancel_retry()
+                self.retry_timer = Timer(self.retry_interval, self._retry, args=(subtype, args))
+                self.retry_timer.daemon = True
+                self.retry_timer.start()
+            self.logger.info(f"{subtype} {args} deferred, asked again in {self.retry_interval} seconds")
 
         elif type == 'confirm': # Questions asked
+            with self.lock:
+                self._cancel_retry()
             if subtype == 'how_are_you':
                 self.logger.info(f"{subtype} - {args} proactive question asked")
 
@@ -80,5 +190,7 @@ class ProactiveService:
             elif subtype == 'recorded_face': # add new user to the list of users (proactive question alarm)
                 username = args.get('username')
                 if username:
-                    self.next_close_face_question_time[username] = datetime.now() + timedelta(minutes=30)
-                    self.logger.info(f"Added {username} to proactive alarm, set at {self.next_close_face_question_time[username]}")
+                    with self.lock:
+                        self.next_close_face_question_time[username] = datetime.now() + timedelta(minutes=30)
+                        self.logger.info(f"Added {username} to proactive alarm, set at {self.next_close_face_question_time[username]}")
+                    self._schedule_pregeneration()
@@ -1,42 +1,200 @@
 import logging
-from threading import Thread
+import queue
+import time
+from collections import deque
+from threading import Event, Lock, Thread
 
-import simpleaudio as sa
+import numpy as np
+import pyaudio
 
 
 class Speaker:
+    '''
+    Streaming playback engine. One output stream is opened at startup and kept open; each
+    utterance is played as audio is fed to it:
+        speaker.begin() -> speaker.feed(audio) (any number of times) -> speaker.close()
+    so playback starts as soon as the first piece of audio exists. start(audio) plays a
+    complete audio buffer, or an iterable of audio segments that are fed as they are
+    produced. finish_speak is fired once per utterance, when it has been played or when
+    it is cut with stop().
+    '''
+    _END = object() # End of utterance marker
+
     def __init__(self, callback, chunk_size=2048, channels=1, sample_width=2, rate = 24000):
         self.logger = logging.getLogger('Speaker')
         self.logger.setLevel(logging.DEBUG)
 
         self.chunk_size = chunk_size
-        self.format = format
         self.channels = channels
-        self.rate = rate  
+        self.rate = rate
         self.sample_width=sample_width
+        self.frame_size = channels * sample_width
 
         self.callback = callback
-        self._thread = None
+
+        self.p = pyaudio.PyAudio()
+        self.stream = self.p.open(format=self.p.get_format_from_width(sample_width),
+                                  channels=channels,
+                                  rate=rate,
+                                  output=True,
+                                  frames_per_buffer=chunk_size)
+        self.output_latency = self.stream.get_output_latency()
+
+        self.segments = queue.Queue() # (utterance id, audio or _END); None stops the engine
+        self.utterance_id = 0 # Current utterance (fed by begin/feed/close)
+        self.interrupted = Event() # Current utterance cut by stop()
+
+        # Timing of the utterance being played
+        self.begin_time = None # begin() call
+        self.first_sample_time = None # Estimated time the first sample reached the speaker
+        self.play_end_time = 0 # Estimated time all the audio written so far will have been played
+
+        # Playback level of the written chunks, for barge-in gating: (start time, end time, RMS 0-1)
+        self.levels = deque()
+        self.levels_lock = Lock()
+
+        self._thread = Thread(target=self._run)
+        self._thread.start()
 
         self.logger.info('Ready')
-    
+
+    def begin(self):
+        # Start a new utterance. Audio still pending from a previous one is discarded
+        self.utterance_id += 1
+        self.interrupted.clear()
+        self.begin_time = time.monotonic()
+        self.first_sample_time = None
+        return self.utterance_id
+
+    def feed(self, audio):
+        # Append audio (raw PCM in the speaker format) to the current utterance
+        if audio:
+            self.segments.put((self.utterance_id, audio))
+
+    def close(self):
+        # No more audio for the current utterance: finish_speak is fired once it has been played
+        self.segments.put((self.utterance_id, self._END))
+
     def start(self, audio):
-        self._thread= Thread(target=self.play, args=(audio,))
-        self._thread.start()
+        # Play a complete audio buffer, or an iterable of audio segments (e.g. one per
+        # sentence, synthesized in background) in order as soon as each one is available
+        utterance_id = self.begin()
+
+        if isinstance(audio, (bytes, bytearray)):
+            self.feed(audio)
+            self.close()
+        else:
+            Thread(target=self._feed_segments, args=(utterance_id, audio), daemon=True).start()
+
+    def _feed_segments(self, utterance_id, audio_segments):
+        try:
+            for audio in audio_segments:
+                if utterance_id != self.utterance_id or self.interrupted.is_set():
+                    break # Cut by stop() or replaced by a newer utterance
+                if audio:
+                    self.segments.put((utterance_id, audio))
+        except Exception as e:
+            self.logger.error(f'Could not get audio segment, playback truncated. {str(e)}')
+        finally:
+            cancel = getattr(audio_segments, 'cancel', None)
+            if cancel is not None:
+                cancel() # Segments not needed anymore
+            self.segments.put((utterance_id, self._END))
+
+    def _run(self):
+        playing_id = None # Utterance being played
+        finished_id = 0 # Last utterance whose finish_speak has been fired
+
+        while True:
+            item = self.segments.get()
+            if item is None: # Engine stopped
+                break
 
-    def play(self, audio):
-        self.logger.info('Playing audio')
+            utterance_id, audio = item
+            if utterance_id != self.utterance_id or utterance_id == finished_id:
+                continue # Replaced by a newer utterance, or already finished (cut by stop())
 
-        audio_object = sa.WaveObject(audio, self.channels, self.sample_width, self.rate)
+            if playing_id != utterance_id:
+                playing_id = utterance_id
+                self.logger.info('Playing audio')
 
-        play_object = audio_object.play()
-        play_object.wait_done()
+            if audio is not self._END:
+                self._write(audio)
 
-        self.logger.info('Playing done')
+            if audio is self._END or self.interrupted.is_set():
+                self._wait_played()
+                self._finish('Playing stopped' if self.interrupted.is_set() else 'Playing done')
+                finished_id = utterance_id
+
+    def _write(self, audio):
+        chunk_bytes = self.chunk_size * self.frame_size
+
+        for i in range(0, len(audio), chunk_bytes):
+            if self.interrupted.is_set():
+                return
+
+            chunk = audio[i:i + chunk_bytes]
+            frames = len(chunk) // self.frame_size
+
+            # Chunk playback time: after the audio already written, or after the output
+            # latency if the stream has run dry (e.g. waiting for the next piece of audio)
+            start = max(self.play_end_time, time.monotonic() + self.output_latency)
+            self.play_end_time = start + frames / self.rate
+            self._add_level(start, self.play_end_time, chunk)
+
+            if self.first_sample_time is None:
+                self.first_sample_time = start
+                self.logger.info(f'First sample played {(self.first_sample_time - self.begin_time) * 1000:.0f} ms after begin')
+
+            self.stream.write(chunk, frames)
+
+    def _wait_played(self):
+        # Wait until the audio written to the stream has actually been played
+        while not self.interrupted.is_set() and time.monotonic() < self.play_end_time:
+            self.interrupted.wait(min(0.05, max(self.play_end_time - time.monotonic(), 0)))
+
+    def _finish(self, message):
+        with self.levels_lock:
+            self.levels.clear()
+
+        self.logger.info(message)
         self.callback('finish_speak')
-    
+
+    def _add_level(self, start, end, chunk):
+        samples = np.frombuffer(chunk, dtype=np.int16)[::self.channels].astype(np.float32) / 32768.0
+        rms = float(np.sqrt(np.mean(samples ** 2))) if samples.size else 0.0
+
+        with self.levels_lock:
+            now = time.monotonic()
+            while self.levels and self.levels[0][1] < now - 0.5: # Forget chunks already played
+                self.levels.popleft()
+            self.levels.append((start, end, rms))
+
+    def playback_level(self):
+        # RMS level (0-1) of the audio being played right now (0 if nothing is playing).
+        # Neighbour chunks are included to cover output latency and room reverberation
+        now = time.monotonic()
+        margin = self.chunk_size / self.rate
+
+        with self.levels_lock:
+            return max((rms for start, end, rms in self.levels
+                        if start - margin <= now <= end + margin), default=0.0)
+
+    def stop(self):
+        # Cut the current playback (e.g. user barge-in). finish_speak is still fired
+        if not self.interrupted.is_set():
+            self.interrupted.set()
+            # Pending audio of this utterance is discarded; make sure the engine finishes it
+            self.segments.put((self.utterance_id, self._END))
+
     def destroy(self):
+        # Pending audio (e.g. the power down sound) is played before closing the stream
+        self.segments.put(None)
         if self._thread is not None and self._thread.is_alive():
             self._thread.join()
 
+        self.stream.stop_stream()
+        self.stream.close()
+        self.p.terminate()
+
         self.logger.info('Stopped')
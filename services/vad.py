@@ -0,0 +1,112 @@
+import logging
+from importlib import resources
+
+import numpy as np
+
+logger = logging.getLogger('Mic')
+
+
+class TorchSileroVAD:
+    '''
+    Silero VAD torch JIT model (silero_vad package).
+    Torch intra-op/inter-op thread pools are process wide, so limiting them here also
+    limits any other torch user in the process.
+    '''
+    def __init__(self, intra_op_threads=None, inter_op_threads=None):
+        import torch
+        from silero_vad import load_silero_vad
+
+        self.torch = torch
+
+        if intra_op_threads:
+            torch.set_num_threads(intra_op_threads)
+        if inter_op_threads:
+            try:
+                torch.set_num_interop_threads(inter_op_threads)
+            except RuntimeError: # Can only be set once, before any inter-op parallel work
+                logger.warning('Torch inter-op threads already set, ignoring inter_op_threads')
+
+        self.model = load_silero_vad()
+
+    def __call__(self, x, sr):
+        # Speech probability of a window (512 samples at 16 kHz, 256 at 8 kHz)
+        return self.model(self.torch.as_tensor(x), sr)
+
+    def reset_states(self):
+        self.model.reset_states()
+
+
+class OnnxSileroVAD:
+    '''
+    Silero VAD ONNX model run with onnxruntime, with explicit intra-op/inter-op thread counts.
+    With quantize=True the model is dynamically quantized to int8 (once, cached on disk).
+    Same interface as the torch model (stateful __call__(window, sr) and reset_states()),
+    so it can also be used with silero_vad.get_speech_timestamps.
+    '''
+    def __init__(self, model_path=None, quantize=False, quantized_model_path='files/silero_vad_int8.onnx',
+                 intra_op_threads=1, inter_op_threads=1):
+        import onnxruntime
+
+        if model_path is None: # ONNX model shipped with the silero_vad package
+            model_path = str(resources.files('silero_vad.data').joinpath('silero_vad.onnx'))
+
+        if quantize:
+            model_path = self._quantize(model_path, quantized_model_path)
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads or 1
+        options.inter_op_num_threads = inter_op_threads or 1
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+
+        self.session = onnxruntime.InferenceSession(model_path, sess_options=options,
+                                                    providers=['CPUExecutionProvider'])
+        self.reset_states()
+
+    @staticmethod
+    def _quantize(model_path, quantized_model_path):
+        import os
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        if not os.path.exists(quantized_model_path):
+            logger.info(f'Quantizing Silero VAD model to int8 ({quantized_model_path})')
+            quantize_dynamic(model_path, quantized_model_path, weight_type=QuantType.QInt8)
+        return quantized_model_path
+
+    def __call__(self, x, sr):
+        # Speech probability of a window (512 samples at 16 kHz, 256 at 8 kHz)
+        x = np.asarray(x, dtype=np.float32).reshape(1, -1)
+        if sr not in (16000, 8000):
+            raise ValueError(f'Unsupported sampling rate {sr} for Silero VAD')
+        if x.shape[1] != (512 if sr == 16000 else 256):
+            raise ValueError(f'Silero VAD expects windows of {512 if sr == 16000 else 256} samples at {sr} Hz')
+
+        if sr != self._last_sr:
+            self.reset_states()
+            self._context = np.zeros((1, 64 if sr == 16000 else 32), dtype=np.float32)
+            self._last_sr = sr
+
+        x = np.concatenate((self._context, x), axis=1) # The model needs the end of the previous window
+        out, self._state = self.session.run(None, {'input': x, 'state': self._state, 'sr': np.array(sr, dtype=np.int64)})
+        self._context = x[:, -self._context.shape[1]:]
+
+        return out[0, 0]
+
+    def reset_states(self):
+        self._state = np.zeros((2, 1, 128), dtype=np.float32)
+        self._context = np.zeros((1, 64), dtype=np.float32)
+        self._last_sr = 0
+
+
+VAD_BACKENDS = {
+    'torch': TorchSileroVAD,
+    'onnx': OnnxSileroVAD,
+}
+
+
+def load_vad(backend='torch', **kwargs):
+    # Load a Silero VAD model with the selected backend ('torch' or 'onnx')
+    if backend not in VAD_BACKENDS:
+        raise ValueError(f"Unknown VAD backend '{backend}'")
+
+    logger.info(f'Loading Silero VAD ({backend} backend, {kwargs})')
+    return VAD_BACKENDS[backend](**kwargs)
@@ -0,0 +1,69 @@
+'''
+Connection tracing hooks of the LLM clients, driven through the local OpenAI emulator
+(real sockets, so that httpcore calls the trace callbacks).
+
+Run from the repo root:
+    python -m pytest tests
+'''
+import asyncio
+from threading import Thread
+
+import httpx
+import pytest
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+from services.cloud.warmup import connection_stats, http_connection_hooks
+from tools.emulators.openai_emulator import create_server
+from tools.emulators.scenario import Scenario
+
+
+@pytest.fixture
+def emulator():
+    server = create_server(Scenario({'llm': {'latency_ms': 0, 'tokens_per_second': 0}}), port=0)
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/v1'
+    server.shutdown()
+    server.server_close()
+
+
+def requests_of(service):
+    stats = connection_stats.get_stats().get(service, {})
+    return stats.get('reused', 0) + stats.get('new', 0)
+
+
+def test_sync_client_hooks(emulator):
+    client = OpenAI(base_url=emulator, api_key='emulator', max_retries=0,
+                    http_client=DefaultHttpxClient(event_hooks=http_connection_hooks('test_sync')))
+    client.models.retrieve('emulator')
+    client.models.retrieve('emulator')
+
+    stats = connection_stats.get_stats()['test_sync']
+    assert stats['new'] == 1 and stats['reused'] == 1
+
+
+def test_async_client_hooks(emulator):
+    # The async trace callback must be awaitable, or every request fails with a connection error
+    async def run():
+        client = AsyncOpenAI(base_url=emulator, api_key='emulator', max_retries=0,
+                             http_client=DefaultAsyncHttpxClient(event_hooks=http_connection_hooks('test_async', asynchronous=True)))
+        await client.models.retrieve('emulator')
+        stream = await client.responses.create(model='emulator', input='Hola', stream=True)
+        events = [event.type async for event in stream]
+        await client.close()
+        return events
+
+    events = asyncio.run(run())
+
+    assert events[-1] == 'response.completed'
+    assert requests_of('test_async') == 2
+    assert connection_stats.get_stats()['test_async']['reused'] == 1
+
+
+def test_async_hooks_on_plain_httpx(emulator):
+    async def run():
+        async with httpx.AsyncClient(event_hooks=http_connection_hooks('test_httpx', asynchronous=True)) as client:
+            response = await client.get(f'{emulator}/models/emulator')
+            return response.status_code
+
+    assert asyncio.run(run()) == 200
+    assert connection_stats.get_stats()['test_httpx']['new'] == 1
@@ -0,0 +1,94 @@
+'''
+Compressed audio transport benchmark: bytes on the wire and CPU cost of the Opus/OGG
+STT uplink (16 kHz mic chunks encoded as they are captured) and TTS downlink (24 kHz
+OGG_OPUS decoded into the speaker format), compared with LINEAR16. Run it on the Pi.
+
+Usage (from the repo root):
+    python -m tools.audio_codec_benchmark
+    python -m tools.audio_codec_benchmark --wav recordings/hola.wav --bitrates 16000 24000 32000
+'''
+import argparse
+import time
+import wave
+
+import numpy as np
+
+from services.cloud.audio_codec import OpusStreamEncoder, decode_ogg_opus, encode_ogg_opus
+
+UPLINK_RATE = 16000
+DOWNLINK_RATE = 24000
+
+
+def load_audio(wav_path, rate, duration):
+    # 16-bit mono PCM at the given rate (default: speech-like modulated noise)
+    if wav_path is None:
+        rng = np.random.default_rng(0)
+        t = np.arange(int(duration * rate)) / rate
+        envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t) # ~syllable rate
+        audio = rng.standard_normal(t.size) * 0.1 * envelope
+    else:
+        with wave.open(wav_path, 'rb') as wav:
+            if wav.getnchannels() != 1 or wav.getsampwidth() != 2:
+                raise ValueError('Only mono 16-bit WAV files are supported')
+            audio = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16).astype(np.float32) / 32768.0
+            # Linear resampling to the transport rate is enough for a size/CPU benchmark
+            source_t = np.arange(audio.size) / wav.getframerate()
+            audio = np.interp(np.arange(int(source_t[-1] * rate)) / rate, source_t, audio)
+    return (np.clip(audio, -1, 1) * 32767).astype(np.int16).tobytes()
+
+
+def bench_uplink(pcm, bitrate, chunk_size):
+    encoder = OpusStreamEncoder(UPLINK_RATE, bitrate)
+    chunk_bytes = chunk_size * 2
+    requests = 0
+
+    cpu_start = time.process_time()
+    for i in range(0, len(pcm), chunk_bytes):
+        if encoder.encode(pcm[i:i + chunk_bytes]):
+            requests += 1
+    if encoder.close():
+        requests += 1
+    cpu_time = time.process_time() - cpu_start
+
+    return encoder.bytes_out, requests, cpu_time
+
+
+def bench_downlink(pcm, bitrate):
+    ogg = encode_ogg_opus(pcm, DOWNLINK_RATE, bitrate) # What the TTS service would send
+
+    cpu_start = time.process_time()
+    decoded = decode_ogg_opus(ogg, DOWNLINK_RATE)
+    cpu_time = time.process_time() - cpu_start
+
+    return len(ogg), len(decoded), cpu_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Opus/OGG audio transport benchmark')
+    parser.add_argument('--wav', help='Mono 16-bit WAV file to use as input (default: synthetic audio)')
+    parser.add_argument('--duration', type=float, default=10, help='Duration of the synthetic audio (sec)')
+    parser.add_argument('--bitrates', type=int, nargs='+', default=[16000, 24000, 32000])
+    parser.add_argument('--chunk-size', type=int, default=2048, help='Mic chunk size (samples)')
+    args = parser.parse_args()
+
+    uplink_pcm = load_audio(args.wav, UPLINK_RATE, args.duration)
+    downlink_pcm = load_audio(args.wav, DOWNLINK_RATE, args.duration)
+    seconds = len(uplink_pcm) / 2 / UPLINK_RATE
+
+    print(f'Audio: {seconds:.1f} s')
+    print(f"{'path':<10} {'bitrate':>8} {'PCM KB':>8} {'wire KB':>8} {'ratio':>6} {'requests':>9} {'CPU ms/s':>9}")
+    for bitrate in args.bitrates:
+        wire, requests, cpu_time = bench_uplink(uplink_pcm, bitrate, args.chunk_size)
+        print(f"{'uplink':<10} {bitrate:8d} {len(uplink_pcm) / 1024:8.1f} {wire / 1024:8.1f} "
+              f"{len(uplink_pcm) / wire:6.1f} {requests:9d} {cpu_time / seconds * 1000:9.2f}")
+
+    for bitrate in args.bitrates:
+        wire, decoded, cpu_time = bench_downlink(downlink_pcm, bitrate)
+        print(f"{'downlink':<10} {bitrate:8d} {len(downlink_pcm) / 1024:8.1f} {wire / 1024:8.1f} "
+              f"{len(downlink_pcm) / wire:6.1f} {'-':>9} {cpu_time / seconds * 1000:9.2f}")
+        if abs(decoded - len(downlink_pcm)) > DOWNLINK_RATE * 2 * 0.1: # More than 100 ms off
+            print(f'  warning: decoded {decoded} bytes, expected ~{len(downlink_pcm)}')
+
+
+if __name__ == '__main__':
+    main()
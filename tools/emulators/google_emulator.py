@@ -0,0 +1,193 @@
+'''
+Local emulator of Google Speech-to-Text (Recognize, StreamingRecognize) and Text-to-Speech
+(SynthesizeSpeech, ListVoices) v1 over gRPC, with the behaviour of tools/emulators/scenario.py.
+The services are registered as generic handlers, (de)serialized with the proto-plus types
+of the client libraries, so no generated stubs are needed.
+
+Transcripts are taken from the scenario (interim results grow word by word while audio
+arrives, the final one is sent when the client stops sending audio). A Recognize of the
+audio of a streaming session (e.g. the short recognition raced with it) gets the same
+transcript. Synthesized audio is a quiet tone of a duration proportional to the text.
+
+Usage (from the repo root):
+    python -m tools.emulators.google_emulator --port 50051 --scenario tools/emulators/scenario_example.json
+    GOOGLE_SPEECH_EMULATOR_HOST=localhost:50051 python3 main.py
+'''
+import argparse
+import io
+import logging
+import wave
+from collections import OrderedDict
+from concurrent import futures
+from threading import Lock
+
+import grpc
+import numpy as np
+from google.cloud import speech, texttospeech
+
+from tools.emulators.scenario import Scenario
+
+logger = logging.getLogger('GoogleEmulator')
+
+SESSION_KEY_SIZE = 1024 # Bytes of the first audio chunk identifying the audio of a streaming session
+MAX_SESSIONS = 32
+
+
+def abort_if_failure(stage, context):
+    if stage.should_fail():
+        code = getattr(grpc.StatusCode, stage.get('failure_code', 'UNAVAILABLE'))
+        context.abort(code, f'Injected {stage.name} failure')
+
+
+class SpeechEmulator:
+    def __init__(self, scenario):
+        self.stage = scenario['stt']
+        self.lock = Lock()
+        self.sessions = OrderedDict() # Start of the audio of recent streaming sessions -> transcript
+        self.open_sessions = [] # Transcripts of the streaming sessions in progress
+
+    def _session_transcript(self, audio):
+        # Transcript of the streaming session of the audio: by its first bytes (LINEAR16 uplink),
+        # or the last session in progress (Opus uplink, its audio is encoded)
+        with self.lock:
+            transcript = self.sessions.get(audio[:SESSION_KEY_SIZE])
+            if transcript is None and self.open_sessions:
+                transcript = self.open_sessions[-1]
+        return transcript
+
+    def _add_session(self, audio, transcript):
+        with self.lock:
+            self.sessions[audio[:SESSION_KEY_SIZE]] = transcript
+            while len(self.sessions) > MAX_SESSIONS:
+                self.sessions.popitem(last=False)
+
+    def recognize(self, request, context):
+        self.stage.wait()
+        abort_if_failure(self.stage, context)
+
+        transcript = ''
+        if request.audio.content:
+            transcript = self._session_transcript(request.audio.content)
+            if transcript is None:
+                transcript = self.stage.next('transcripts')
+        return speech.RecognizeResponse(results=[
+            speech.SpeechRecognitionResult(alternatives=[self._alternative(transcript, True)])])
+
+    def streaming_recognize(self, request_iterator, context):
+        transcript = self.stage.next('transcripts')
+        words = transcript.split()
+        interim_every = self.stage.get('interim_every', 4)
+
+        with self.lock:
+            self.open_sessions.append(transcript)
+        try:
+            audio_requests = 0
+            for request in request_iterator:
+                if not request.audio_content:
+                    continue # Config request
+                audio_requests += 1
+                if audio_requests == 1:
+                    self._add_session(request.audio_content, transcript)
+
+                # Interim results grow word by word while the user is talking
+                if audio_requests % interim_every == 0 and words:
+                    partial = ' '.join(words[:min(audio_requests // interim_every, len(words))])
+                    yield self._streaming_response(partial, False)
+
+            # Client finished sending audio: final result after the scenario latency
+            self.stage.wait()
+            abort_if_failure(self.stage, context)
+            yield self._streaming_response(transcript if audio_requests else '', True)
+        finally:
+            with self.lock:
+                self.open_sessions.remove(transcript)
+
+    @staticmethod
+    def _alternative(transcript, is_final):
+        return speech.SpeechRecognitionAlternative(transcript=transcript, confidence=0.9 if is_final else 0.0)
+
+    def _streaming_response(self, transcript, is_final):
+        result = speech.StreamingRecognitionResult(alternatives=[self._alternative(transcript, is_final)],
+                                                   is_final=is_final, stability=0.0 if is_final else 0.8)
+        return speech.StreamingRecognizeResponse(results=[result])
+
+
+class TextToSpeechEmulator:
+    def __init__(self, scenario):
+        self.stage = scenario['tts']
+
+    def synthesize_speech(self, request, context):
+        self.stage.wait()
+        abort_if_failure(self.stage, context)
+
+        rate = request.audio_config.sample_rate_hertz or 24000
+        duration = max(len(request.input.text or request.input.ssml), 1) * self.stage.get('seconds_per_char', 0.06)
+        return texttospeech.SynthesizeSpeechResponse(audio_content=self._tone(duration, rate))
+
+    def list_voices(self, request, context):
+        abort_if_failure(self.stage, context)
+        return texttospeech.ListVoicesResponse(voices=[
+            texttospeech.Voice(language_codes=['es-ES'], name='es-ES-Emulator', ssml_gender=texttospeech.SsmlVoiceGender.FEMALE,
+                               natural_sample_rate_hertz=24000)
+        ])
+
+    @staticmethod
+    def _tone(duration, rate):
+        # LINEAR16 WAV (with header, as the real service returns it) of a quiet 220 Hz tone
+        t = np.arange(int(duration * rate)) / rate
+        samples = (0.05 * np.sin(2 * np.pi * 220 * t) * 32767).astype(np.int16)
+
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(rate)
+            wav.writeframes(samples.tobytes())
+        return buffer.getvalue()
+
+
+def unary(method, request_type, response_type):
+    return grpc.unary_unary_rpc_method_handler(method, request_deserializer=request_type.deserialize,
+                                               response_serializer=response_type.serialize)
+
+def create_server(scenario, port=50051, max_workers=16):
+    speech_emulator = SpeechEmulator(scenario)
+    tts_emulator = TextToSpeechEmulator(scenario)
+
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+    server.add_generic_rpc_handlers((
+        grpc.method_handlers_generic_handler('google.cloud.speech.v1.Speech', {
+            'Recognize': unary(speech_emulator.recognize, speech.RecognizeRequest, speech.RecognizeResponse),
+            'StreamingRecognize': grpc.stream_stream_rpc_method_handler(
+                speech_emulator.streaming_recognize,
+                request_deserializer=speech.StreamingRecognizeRequest.deserialize,
+                response_serializer=speech.StreamingRecognizeResponse.serialize),
+        }),
+        grpc.method_handlers_generic_handler('google.cloud.texttospeech.v1.TextToSpeech', {
+            'SynthesizeSpeech': unary(tts_emulator.synthesize_speech, texttospeech.SynthesizeSpeechRequest, texttospeech.SynthesizeSpeechResponse),
+            'ListVoices': unary(tts_emulator.list_voices, texttospeech.ListVoicesRequest, texttospeech.ListVoicesResponse),
+        }),
+    ))
+    server.add_insecure_port(f'[::]:{port}')
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local Google STT/TTS emulator')
+    parser.add_argument('--port', type=int, default=50051)
+    parser.add_argument('--scenario', help='Scenario JSON file (default behaviour if omitted)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    server = create_server(Scenario.load(args.scenario), args.port)
+    server.start()
+    logger.info(f'Google STT/TTS emulator listening on port {args.port}')
+    try:
+        server.wait_for_termination()
+    except KeyboardInterrupt:
+        server.stop(grace=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+'''
+Local emulator of the OpenAI Responses API (POST /v1/responses, plain and streamed with
+server-sent events, and GET /v1/models/{id} used as connection probe), with the behaviour
+of tools/emulators/scenario.py. Responses are the scripted structured responses (JSON
+text); when the request offers a tool that is required or scripted in "tool_calls", a
+function call is returned instead. Streamed text is paced at "tokens_per_second".
+
+The OpenAI SDK honours OPENAI_BASE_URL, so no client changes are needed.
+
+Usage (from the repo root):
+    python -m tools.emulators.openai_emulator --port 8080 --scenario tools/emulators/scenario_example.json
+    OPENAI_BASE_URL=http://localhost:8080/v1 OPENAI_API_KEY=emulator python3 main.py
+'''
+import argparse
+import json
+import logging
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tools.emulators.scenario import Scenario
+
+logger = logging.getLogger('OpenAIEmulator')
+
+CHARS_PER_TOKEN = 4 # Approximate size of a streamed delta
+
+
+def new_id(prefix):
+    return f'{prefix}_{uuid.uuid4().hex}'
+
+
+class ResponseBuilder:
+    ''' Response objects and stream events of one request '''
+    def __init__(self, request, stage):
+        self.request = request
+        self.stage = stage
+        self.id = new_id('resp')
+        self.created_at = int(time.time())
+        self.sequence_number = 0
+
+        tool = self._scripted_tool()
+        if tool is not None:
+            name, arguments = tool
+            self.item = {'type': 'function_call', 'id': new_id('fc'), 'call_id': new_id('call'), 'name': name,
+                         'arguments': json.dumps(arguments, ensure_ascii=False), 'status': 'completed'}
+            self.text = self.item['arguments']
+        else:
+            self.text = json.dumps(stage.next('responses'), ensure_ascii=False)
+            self.item = {'type': 'message', 'id': new_id('msg'), 'status': 'completed', 'role': 'assistant',
+                         'content': [self._text_part(self.text)]}
+
+    def _scripted_tool(self):
+        # Tool call to return: a required tool, or an offered tool with scripted arguments
+        tool_calls = self.stage.get('tool_calls', {})
+        for tool in self.request.get('tools') or []:
+            name = tool.get('name')
+            if name in tool_calls:
+                return name, tool_calls[name]
+            if self.request.get('tool_choice') == 'required':
+                return name, {}
+        return None
+
+    @staticmethod
+    def _text_part(text):
+        return {'type': 'output_text', 'text': text, 'annotations': []}
+
+    def response(self, status='completed'):
+        return {
+            'id': self.id, 'object': 'response', 'created_at': self.created_at, 'status': status,
+            'model': self.request.get('model', 'emulator'),
+            'output': [self.item] if status == 'completed' else [],
+            'instructions': self.request.get('instructions'),
+            'parallel_tool_calls': True, 'tool_choice': self.request.get('tool_choice') or 'auto',
+            'tools': self.request.get('tools') or [], 'temperature': self.request.get('temperature'),
+            'top_p': self.request.get('top_p'), 'text': self.request.get('text') or {'format': {'type': 'text'}},
+            'truncation': self.request.get('truncation'), 'metadata': {}, 'error': None, 'incomplete_details': None,
+            'usage': self._usage()
+        }
+
+    def _usage(self):
+        input_tokens = len(json.dumps(self.request.get('input', ''))) // CHARS_PER_TOKEN
+        output_tokens = len(self.text) // CHARS_PER_TOKEN
+        return {'input_tokens': input_tokens, 'input_tokens_details': {'cached_tokens': 0},
+                'output_tokens': output_tokens, 'output_tokens_details': {'reasoning_tokens': 0},
+                'total_tokens': input_tokens + output_tokens}
+
+    def event(self, event_type, **fields):
+        event = {'type': event_type, 'sequence_number': self.sequence_number, **fields}
+        self.sequence_number += 1
+        return event
+
+    def events(self, tokens_per_second):
+        # Stream events, paced as the text is generated
+        yield self.event('response.created', response=self.response('in_progress'))
+
+        item = self.item
+        is_message = item['type'] == 'message'
+        chunks = [self.text[i:i + CHARS_PER_TOKEN] for i in range(0, len(self.text), CHARS_PER_TOKEN)]
+        delay = 1 / tokens_per_second if tokens_per_second else 0
+
+        if is_message:
+            yield self.event('response.output_item.added', output_index=0, item={**item, 'status': 'in_progress', 'content': []})
+            yield self.event('response.content_part.added', item_id=item['id'], output_index=0, content_index=0,
+                             part=self._text_part(''))
+            for chunk in chunks:
+                time.sleep(delay)
+                yield self.event('response.output_text.delta', item_id=item['id'], output_index=0, content_index=0,
+                                 delta=chunk, logprobs=[])
+            yield self.event('response.output_text.done', item_id=item['id'], output_index=0, content_index=0,
+                             text=self.text, logprobs=[])
+            yield self.event('response.content_part.done', item_id=item['id'], output_index=0, content_index=0,
+                             part=self._text_part(self.text))
+        else:
+            yield self.event('response.output_item.added', output_index=0, item={**item, 'status': 'in_progress', 'arguments': ''})
+            for chunk in chunks:
+                time.sleep(delay)
+                yield self.event('response.function_call_arguments.delta', item_id=item['id'], output_index=0, delta=chunk)
+            yield self.event('response.function_call_arguments.done', item_id=item['id'], output_index=0,
+                             name=item['name'], arguments=self.text)
+
+        yield self.event('response.output_item.done', output_index=0, item=item)
+        yield self.event('response.completed', response=self.response())
+
+
+class OpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Keep-alive, as the real API
+    scenario = None
+
+    def do_GET(self):
+        if self.path.startswith('/v1/models/'):
+            model = self.path[len('/v1/models/'):]
+            self._send_json(200, {'id': model, 'object': 'model', 'created': 0, 'owned_by': 'emulator'})
+        else:
+            self._send_error(404, 'Not found')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+
+        if self.path != '/v1/responses':
+            self._send_error(404, 'Not found')
+            return
+
+        stage = self.scenario['llm']
+        stage.wait() # Time to first token
+        if stage.should_fail():
+            status = stage.get('failure_status', 503)
+            self._send_error(status, f'Injected llm failure ({status})')
+            return
+
+        builder = ResponseBuilder(request, stage)
+        if request.get('stream'):
+            self._send_stream(builder.events(stage.get('tokens_per_second', 60)))
+        else:
+            self._send_json(200, builder.response())
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status, message):
+        self._send_json(status, {'error': {'message': message, 'type': 'server_error', 'param': None, 'code': None}})
+
+    def _send_stream(self, events):
+        # Server-sent events with chunked transfer encoding (the connection stays open)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        try:
+            for event in events:
+                data = f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n".encode('utf-8')
+                self.wfile.write(f'{len(data):X}\r\n'.encode() + data + b'\r\n')
+                self.wfile.flush()
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info('Stream cancelled by the client')
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def create_server(scenario, port=8080):
+    handler = type('ScenarioOpenAIHandler', (OpenAIHandler,), {'scenario': scenario})
+    server = ThreadingHTTPServer(('', port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local OpenAI Responses API emulator')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--scenario', help='Scenario JSON file (default behaviour if omitted)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    server = create_server(Scenario.load(args.scenario), args.port)
+    logger.info(f'OpenAI emulator listening on port {args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+'''
+Scriptable behaviour of the local cloud emulators: response content, latency distribution
+and failure rate of each stage (stt, tts, llm). A scenario is a JSON file, e.g.:
+
+    {
+        "seed": 1,
+        "stt": {"latency_ms": {"distribution": "lognormal", "median": 250, "sigma": 0.4},
+                "failure_rate": 0.02, "failure_code": "UNAVAILABLE",
+                "transcripts": ["Hola, ¿qué tal?", "Sí", "No"], "interim_every": 4},
+        "tts": {"latency_ms": {"distribution": "uniform", "min": 80, "max": 300}},
+        "llm": {"latency_ms": 400, "tokens_per_second": 60, "failure_rate": 0.01, "failure_status": 503,
+                "responses": [{"continue": true, "robot_mood": "joy", "response": "¡Hola! ¿Cómo estás?"}],
+                "tool_calls": {"record_face": {"username": "Laura"}}}
+    }
+
+Latencies are fixed ("latency_ms": 300) or distributions: fixed (value), uniform (min, max),
+normal (mean, std) or lognormal (median, sigma), in milliseconds.
+'''
+import json
+import math
+import random
+import time
+from threading import Lock
+
+
+DEFAULTS = {
+    'stt': {
+        'latency_ms': {'distribution': 'lognormal', 'median': 200, 'sigma': 0.3},
+        'transcripts': ['Hola, ¿qué tal estás?'],
+        'interim_every': 4 # Audio requests per interim result
+    },
+    'tts': {
+        'latency_ms': {'distribution': 'lognormal', 'median': 150, 'sigma': 0.3},
+        'seconds_per_char': 0.06 # Duration of the synthesized audio
+    },
+    'llm': {
+        'latency_ms': {'distribution': 'lognormal', 'median': 500, 'sigma': 0.4}, # Until the first token
+        'tokens_per_second': 60,
+        'responses': [{'continue': True, 'robot_mood': 'joy', 'response': '¡Hola! Me alegro mucho de verte. ¿Qué tal te ha ido el día?'}],
+        'tool_calls': {}
+    }
+}
+
+
+class Latency:
+    def __init__(self, spec, rng):
+        self.spec = spec if isinstance(spec, dict) else {'distribution': 'fixed', 'value': spec}
+        self.rng = rng
+
+    def sample(self):
+        # Latency in seconds
+        spec = self.spec
+        distribution = spec.get('distribution', 'fixed')
+        if distribution == 'fixed':
+            value = spec.get('value', 0)
+        elif distribution == 'uniform':
+            value = self.rng.uniform(spec['min'], spec['max'])
+        elif distribution == 'normal':
+            value = self.rng.gauss(spec['mean'], spec['std'])
+        elif distribution == 'lognormal':
+            value = self.rng.lognormvariate(math.log(spec['median']), spec['sigma'])
+        else:
+            raise ValueError(f'Unknown latency distribution {distribution}')
+        return max(value, 0) / 1000
+
+
+class Stage:
+    def __init__(self, name, config, seed=None):
+        self.name = name
+        self.config = config
+        self.rng = random.Random(seed)
+        self.lock = Lock()
+        self.latency = Latency(config.get('latency_ms', 0), self.rng)
+        self.failure_rate = config.get('failure_rate', 0.0)
+        self.counter = 0
+
+    def wait(self):
+        # Sleep the sampled latency of a request
+        with self.lock:
+            latency = self.latency.sample()
+        time.sleep(latency)
+        return latency
+
+    def should_fail(self):
+        with self.lock:
+            return self.rng.random() < self.failure_rate
+
+    def next(self, key):
+        # Next item of a scripted list (round robin)
+        with self.lock:
+            items = self.config[key]
+            item = items[self.counter % len(items)]
+            self.counter += 1
+        return item
+
+    def get(self, key, default=None):
+        return self.config.get(key, default)
+
+
+class Scenario:
+    def __init__(self, config=None):
+        config = config or {}
+        seed = config.get('seed')
+        self.stages = {name: Stage(name, {**defaults, **config.get(name, {})}, seed)
+                       for name, defaults in DEFAULTS.items()}
+
+    @classmethod
+    def load(cls, path=None):
+        if path is None:
+            return cls()
+        with open(path, 'r', encoding='utf-8') as file:
+            return cls(json.load(file))
+
+    def __getitem__(self, name):
+        return self.stages[name]
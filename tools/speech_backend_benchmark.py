@@ -0,0 +1,135 @@
+'''
+Side by side benchmark of the speech backends (services/cloud/speech_backends.py) on
+recorded audio: batch and streaming STT latency and word error rate, and TTS latency and
+real-time factor.
+
+References are a JSON file mapping each WAV file name to its transcript (optional):
+    {"si.wav": "sí", "tiempo.wav": "¿Qué tiempo hace hoy?"}
+
+Usage (from the repo root):
+    python -m tools.speech_backend_benchmark recordings/*.wav
+    python -m tools.speech_backend_benchmark --references references.json --backends google local recordings/*.wav
+    python -m tools.speech_backend_benchmark --tts "Hola, ¿qué tal?" "¡Hasta luego!" --repeat 3
+'''
+import argparse
+import json
+import os
+import re
+import time
+import wave
+
+import numpy as np
+
+from services.cloud.speech_backends import backends
+
+RATE = 16000
+TTS_RATE = 24000
+CHUNK_SIZE = 2048 # Mic chunk size (samples)
+
+
+def load_wav(path):
+    with wave.open(path, 'rb') as wav:
+        if wav.getframerate() != RATE or wav.getnchannels() != 1 or wav.getsampwidth() != 2:
+            raise ValueError('Only 16 kHz mono 16-bit WAV files are supported')
+        return wav.readframes(wav.getnframes())
+
+
+def words(text):
+    return re.sub(r'[^\w\s]', '', text.lower()).split()
+
+def word_error_rate(reference, hypothesis):
+    # Word-level Levenshtein distance over the reference length
+    reference, hypothesis = words(reference), words(hypothesis)
+    distances = np.arange(len(hypothesis) + 1)
+    for i, reference_word in enumerate(reference, 1):
+        previous, distances[0] = distances.copy(), i
+        for j, hypothesis_word in enumerate(hypothesis, 1):
+            distances[j] = min(previous[j] + 1, distances[j - 1] + 1, previous[j - 1] + (reference_word != hypothesis_word))
+    return distances[-1] / max(len(reference), 1)
+
+
+def streamed(audio, pace):
+    # Mic chunks, at real-time pace if pace (the latency is measured from the last one)
+    chunk_bytes = CHUNK_SIZE * 2
+    for i in range(0, len(audio), chunk_bytes):
+        if pace:
+            time.sleep(CHUNK_SIZE / RATE)
+        yield audio[i:i + chunk_bytes]
+
+
+def bench_stt(backend, path, reference, pace):
+    audio = load_wav(path)
+    results = {}
+
+    start = time.monotonic()
+    transcript = backend.speech_to_text(audio)
+    results['stt'] = (time.monotonic() - start, transcript)
+
+    chunks = streamed(audio, pace)
+    audio_end = {}
+    def audio_generator():
+        yield from chunks
+        audio_end['time'] = time.monotonic()
+    transcript, _ = backend.streaming_speech_to_text(audio_generator())
+    results['streaming_stt'] = (time.monotonic() - audio_end['time'], transcript)
+
+    for operation, (latency, transcript) in results.items():
+        wer = f'{word_error_rate(reference, transcript):5.2f}' if reference is not None else '    -'
+        print(f"{backend.name:<8} {operation:<14} {os.path.basename(path):<20} {len(audio) / 2 / RATE:6.2f} "
+              f"{latency * 1000:9.0f} {wer:>5}  {transcript}")
+
+
+def bench_tts(backend, text, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.monotonic()
+        audio = backend.text_to_speech(text)
+        latencies.append(time.monotonic() - start)
+    seconds = len(audio) / 2 / TTS_RATE
+    latency = float(np.median(latencies))
+    print(f"{backend.name:<8} {'tts':<14} {text[:20]:<20} {seconds:6.2f} {latency * 1000:9.0f} {latency / seconds:5.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Speech backend benchmark')
+    parser.add_argument('wavs', nargs='*', help='16 kHz mono WAV recordings')
+    parser.add_argument('--references', help='JSON file with the reference transcript of each recording')
+    parser.add_argument('--backends', nargs='+', choices=list(backends), default=list(backends))
+    parser.add_argument('--tts', nargs='*', default=['Hola, ¿qué tal?', '¡Me alegro mucho de verte! ¿Qué tal te ha ido el día?'],
+                        help='Phrases to synthesize')
+    parser.add_argument('--repeat', type=int, default=1, help='Repetitions of each TTS phrase (median latency)')
+    parser.add_argument('--realtime', action='store_true', help='Stream the recordings at real-time pace')
+    args = parser.parse_args()
+
+    references = {}
+    if args.references:
+        with open(args.references, 'r', encoding='utf-8') as file:
+            references = json.load(file)
+
+    selected = [backends[name] for name in args.backends]
+    for backend in selected:
+        backend.warm_up() # Model loading is not part of the latency
+
+    print(f"{'backend':<8} {'operation':<14} {'input':<20} {'audio s':>6} {'latency ms':>9} {'WER/RTF':>5}  transcript")
+    for backend in selected:
+        for path in args.wavs:
+            if not backend.available('stt'):
+                print(f'{backend.name:<8} STT not available')
+                break
+            try:
+                bench_stt(backend, path, references.get(os.path.basename(path)), args.realtime)
+            except Exception as e:
+                print(f'{backend.name:<8} {os.path.basename(path)}: failed ({e})')
+
+        for text in args.tts:
+            if not backend.available('tts'):
+                print(f'{backend.name:<8} TTS not available')
+                break
+            try:
+                bench_tts(backend, text, args.repeat)
+            except Exception as e:
+                print(f'{backend.name:<8} tts: failed ({e})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+'''
+Silero VAD backend micro-benchmark: per-window latency and memory (RSS) of the torch JIT
+model vs. the ONNX (float and int8) model run with onnxruntime.
+
+Each backend runs in its own process so that RSS is measured in isolation.
+
+Usage (from the repo root):
+    python -m tools.vad_backend_benchmark
+    python -m tools.vad_backend_benchmark --windows 5000 --threads 1 1 --wav recordings/hola.wav
+'''
+import argparse
+import multiprocessing
+import time
+import wave
+
+import numpy as np
+import psutil
+
+from services.vad import load_vad
+
+WINDOW_SIZE = 512
+RATE = 16000
+
+CONFIGS = {
+    'torch': {'backend': 'torch'},
+    'onnx': {'backend': 'onnx'},
+    'onnx-int8': {'backend': 'onnx', 'quantize': True},
+}
+
+
+def load_windows(wav_path, n_windows):
+    if wav_path is None: # Noise-like audio
+        rng = np.random.default_rng(0)
+        audio = (rng.standard_normal(n_windows * WINDOW_SIZE) * 0.05).astype(np.float32)
+    else:
+        with wave.open(wav_path, 'rb') as wav:
+            if wav.getframerate() != RATE or wav.getnchannels() != 1 or wav.getsampwidth() != 2:
+                raise ValueError('Only 16 kHz mono 16-bit WAV files are supported')
+            audio = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16).astype(np.float32) / 32768.0
+        audio = np.resize(audio, n_windows * WINDOW_SIZE) # Loop the file if needed
+
+    return audio.reshape(n_windows, WINDOW_SIZE)
+
+
+def run_backend(name, config, args, results):
+    process = psutil.Process()
+    rss_start = process.memory_info().rss
+
+    model = load_vad(config['backend'], intra_op_threads=args.threads[0], inter_op_threads=args.threads[1],
+                     **({'quantize': True} if config.get('quantize') else {}))
+    rss_loaded = process.memory_info().rss
+
+    windows = load_windows(args.wav, args.windows)
+    for window in windows[:args.warmup]:
+        model(window, RATE).item()
+    model.reset_states()
+
+    latencies = np.empty(len(windows))
+    cpu_start = time.process_time()
+    for i, window in enumerate(windows):
+        start = time.perf_counter()
+        model(window, RATE).item()
+        latencies[i] = time.perf_counter() - start
+    cpu_time = time.process_time() - cpu_start
+
+    results[name] = {
+        'mean_ms': latencies.mean() * 1000,
+        'p50_ms': np.percentile(latencies, 50) * 1000,
+        'p99_ms': np.percentile(latencies, 99) * 1000,
+        'cpu_ms_per_window': cpu_time / len(windows) * 1000, # > mean latency if several threads are used
+        'rss_model_mb': (rss_loaded - rss_start) / 2**20,
+        'rss_total_mb': process.memory_info().rss / 2**20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Silero VAD backend micro-benchmark')
+    parser.add_argument('--backends', nargs='+', choices=list(CONFIGS), default=list(CONFIGS))
+    parser.add_argument('--windows', type=int, default=2000, help='Number of 512-sample windows')
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--threads', type=int, nargs=2, default=[1, 1], metavar=('INTRA', 'INTER'),
+                        help='Intra-op and inter-op thread counts')
+    parser.add_argument('--wav', help='16 kHz mono WAV file to use as input (default: noise)')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn') # Fresh process (and RSS) per backend
+    results = context.Manager().dict()
+
+    for name in args.backends:
+        process = context.Process(target=run_backend, args=(name, CONFIGS[name], args, results))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            print(f'{name}: failed (exit code {process.exitcode})')
+
+    print(f"{'backend':<10} {'mean ms':>8} {'p50 ms':>8} {'p99 ms':>8} {'CPU ms':>8} {'model MB':>9} {'RSS MB':>8}")
+    for name in args.backends:
+        if name not in results:
+            continue
+        r = results[name]
+        print(f"{name:<10} {r['mean_ms']:8.3f} {r['p50_ms']:8.3f} {r['p99_ms']:8.3f} "
+              f"{r['cpu_ms_per_window']:8.3f} {r['rss_model_mb']:9.1f} {r['rss_total_mb']:8.1f}")
+
+
+if __name__ == '__main__':
+    main()
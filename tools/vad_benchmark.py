@@ -0,0 +1,253 @@
+'''
+Offline VAD/endpointing benchmark.
+
+Feeds WAV files through Recorder.on_data (via the capture engine, with a stub PyAudio)
+at real-time or accelerated pace and compares the detected utterances against labels.
+For each file it reports detected speech start/end times, end-of-speech latency,
+false triggers, missed utterances and CPU time per audio second.
+
+Labels are a JSON file mapping each WAV file name to its speech segments in seconds:
+    {"hola.wav": [[0.52, 1.31]], "dos_frases.wav": [[0.40, 2.10], [3.05, 4.60]]}
+
+Usage (from the repo root):
+    python -m tools.vad_benchmark --labels labels.json recordings/*.wav
+    python -m tools.vad_benchmark --labels labels.json --vad-mode window --process-every-n 2 recordings/*.wav
+'''
+import argparse
+import json
+import logging
+import os
+import time
+import wave
+
+import numpy as np
+
+from services import mic
+
+
+class StubStream:
+    def __init__(self, stream_callback, frames_per_buffer, **kwargs):
+        self.stream_callback = stream_callback
+        self.frames_per_buffer = frames_per_buffer
+
+    def feed(self, data):
+        self.stream_callback(data, len(data) // 2, {}, 0)
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class StubPyAudio:
+    ''' Replaces pyaudio.PyAudio: a single fake input device whose stream is fed by the benchmark '''
+    def __init__(self):
+        self.stream = None
+
+    def get_device_count(self):
+        return 1
+
+    def get_device_info_by_index(self, index):
+        return {'name': 'ReSpeaker (benchmark stub)'}
+
+    def open(self, **kwargs):
+        self.stream = StubStream(**kwargs)
+        return self.stream
+
+    def terminate(self):
+        pass
+
+
+def read_wav(path, rate):
+    # Read a WAV file as mono int16 at the given sample rate
+    with wave.open(path, 'rb') as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError(f'{path}: only 16-bit PCM WAV files are supported')
+        channels = wav.getnchannels()
+        file_rate = wav.getframerate()
+        samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1).astype(np.int16)
+
+    if file_rate != rate: # Linear resampling, good enough for VAD benchmarking
+        n_out = int(len(samples) * rate / file_rate)
+        samples = np.interp(np.arange(n_out) * file_rate / rate, np.arange(len(samples)), samples).astype(np.int16)
+
+    return samples
+
+
+def run_file(recorder, samples, pace, tail):
+    ''' Feed a file chunk by chunk and return the detected segments [(start, end), ...] in seconds '''
+    stream = recorder.capture.p.stream
+    chunk_size = recorder.chunk_size
+    rate = recorder.rate
+
+    samples = np.concatenate((samples, np.zeros(int(tail * rate), dtype=np.int16))) # Trailing silence
+    n_chunks = len(samples) // chunk_size
+
+    detections = []
+    speech_start = None
+
+    recorder.start()
+    origin = recorder.buffer.write_pos # File start position
+    for i in range(n_chunks):
+        chunk_start_time = time.perf_counter()
+        stream.feed(samples[i * chunk_size:(i + 1) * chunk_size].tobytes())
+
+        if recorder.vad_worker: # Wait for the worker to process the chunk
+            while recorder.processed_pos < recorder.buffer.write_pos and not recorder.stop_recording.is_set():
+                time.sleep(0.0005)
+
+        position = (recorder.buffer.write_pos - origin) / rate
+        if speech_start is None and (recorder.start_recording.is_set() or recorder.stop_recording.is_set()):
+            speech_start = position
+
+        if recorder.stop_recording.is_set():
+            detections.append((speech_start, (recorder.utterance_end - origin) / rate))
+            speech_start = None
+            recorder.stop() # Re-arm the recorder, as the robot does after each utterance
+            recorder.start()
+
+        if pace > 0:
+            time.sleep(max(0.0, chunk_size / rate / pace - (time.perf_counter() - chunk_start_time)))
+
+    if speech_start is not None: # Utterance not finished at the end of the file
+        detections.append((speech_start, None))
+    recorder.stop()
+
+    return detections
+
+
+def score(detections, labels, onset_tolerance=0.5):
+    ''' Match detected segments with labeled segments '''
+    matched = []
+    false_triggers = []
+    used = set()
+
+    for det_start, det_end in detections:
+        label = next((i for i, (start, end) in enumerate(labels)
+                      if i not in used and start - onset_tolerance <= det_start <= end + onset_tolerance), None)
+        if label is None:
+            false_triggers.append((det_start, det_end))
+            continue
+
+        used.add(label)
+        start, end = labels[label]
+        matched.append({
+            'label': [start, end],
+            'detected': [det_start, det_end],
+            'onset_delay': det_start - start,
+            'end_latency': det_end - end if det_end is not None else None,
+        })
+
+    missed = [labels[i] for i in range(len(labels)) if i not in used]
+    return matched, false_triggers, missed
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline VAD/endpointing benchmark over a WAV corpus')
+    parser.add_argument('wavs', nargs='+', help='WAV files (16-bit PCM)')
+    parser.add_argument('--labels', required=True, help='JSON file with the speech segments of each file')
+    parser.add_argument('--pace', type=float, default=0, help='Feeding speed: 1 = real time, 0 = as fast as possible')
+    parser.add_argument('--tail', type=float, default=1.5, help='Seconds of silence appended to each file')
+    parser.add_argument('--rate', type=int, default=16000)
+    parser.add_argument('--chunk-size', type=int, default=2048)
+    parser.add_argument('--process-every-n', type=int, default=2, help='Window VAD mode only')
+    parser.add_argument('--min-buffer-size', type=float, default=0.5, help='Window VAD mode only, in seconds')
+    parser.add_argument('--silence-duration', type=float, default=0.5)
+    parser.add_argument('--vad-mode', choices=['window', 'streaming'], default='streaming')
+    parser.add_argument('--vad-threshold', type=float, default=0.5)
+    parser.add_argument('--vad-backend', choices=['torch', 'onnx'], default='torch')
+    parser.add_argument('--pregate', action='store_true')
+    parser.add_argument('--vad-worker', action='store_true')
+    parser.add_argument('--json', help='Write the full results to this JSON file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().handlers[0].setLevel(logging.WARNING)
+
+    with open(args.labels, 'r', encoding='utf-8') as f:
+        labels = json.load(f)
+
+    mic.pyaudio.PyAudio = StubPyAudio # No audio hardware needed
+    recorder = mic.Recorder(lambda event, audio=None: None,
+                            chunk_size=args.chunk_size,
+                            rate=args.rate,
+                            silence_duration=args.silence_duration,
+                            vad_mode=args.vad_mode,
+                            vad_threshold=args.vad_threshold,
+                            vad_backend=args.vad_backend,
+                            pregate=args.pregate,
+                            vad_worker=args.vad_worker)
+    recorder.process_every_n = args.process_every_n
+    recorder.min_buffer_size = int(args.rate / args.chunk_size * args.min_buffer_size)
+
+    results = []
+    total_audio = 0.0
+    total_cpu = 0.0
+
+    for path in args.wavs:
+        name = os.path.basename(path)
+        if name not in labels:
+            print(f'{name}: no labels, skipped')
+            continue
+
+        samples = read_wav(path, args.rate)
+        duration = len(samples) / args.rate + args.tail
+
+        cpu_start = time.process_time()
+        detections = run_file(recorder, samples, args.pace, args.tail)
+        cpu_time = time.process_time() - cpu_start
+
+        matched, false_triggers, missed = score(detections, labels[name])
+        results.append({'file': name, 'duration': duration, 'cpu_time': cpu_time, 'matched': matched,
+                        'false_triggers': false_triggers, 'missed': missed})
+        total_audio += duration
+        total_cpu += cpu_time
+
+        print(f'{name} ({duration:.2f} s, CPU {cpu_time / duration * 1000:.1f} ms per audio second)')
+        for match in matched:
+            end_latency = f"{match['end_latency']:+.3f} s" if match['end_latency'] is not None else 'not finished'
+            print(f"  label {match['label'][0]:.2f}-{match['label'][1]:.2f} s | "
+                  f"detected {match['detected'][0]:.2f}-{match['detected'][1] or float('nan'):.2f} s | "
+                  f"onset delay {match['onset_delay']:+.3f} s | end latency {end_latency}")
+        for start, end in false_triggers:
+            print(f"  FALSE TRIGGER {start:.2f}-{end or float('nan'):.2f} s")
+        for start, end in missed:
+            print(f'  MISSED {start:.2f}-{end:.2f} s')
+
+    end_latencies = [m['end_latency'] for r in results for m in r['matched'] if m['end_latency'] is not None]
+    onset_delays = [m['onset_delay'] for r in results for m in r['matched']]
+    summary = {
+        'files': len(results),
+        'utterances': sum(len(r['matched']) + len(r['missed']) for r in results),
+        'detected': sum(len(r['matched']) for r in results),
+        'missed': sum(len(r['missed']) for r in results),
+        'false_triggers': sum(len(r['false_triggers']) for r in results),
+        'end_latency_p50': percentile(end_latencies, 50),
+        'end_latency_p90': percentile(end_latencies, 90),
+        'onset_delay_p50': percentile(onset_delays, 50),
+        'cpu_ms_per_audio_second': total_cpu / total_audio * 1000 if total_audio else float('nan'),
+        'vad_stats': recorder.get_vad_stats(),
+        'timing_stats': recorder.get_timing_stats(),
+    }
+
+    print('\nSummary')
+    for key, value in summary.items():
+        print(f'  {key}: {value:.3f}' if isinstance(value, float) else f'  {key}: {value}')
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'config': vars(args), 'summary': summary, 'results': results}, f, indent=4)
+
+    recorder.destroy()
+
+
+if __name__ == '__main__':
+    main()